@@ -19,17 +19,19 @@ except ImportError as e:
     print("\nInstalando Pillow...")
     subprocess.check_call([sys.executable, "-m", "pip", "install", "Pillow"])
 
-# Lanzar GUI
-print("\n" + "="*60)
-print("🚀 LANZANDO INTERFAZ GRÁFICA")
-print("="*60)
-print("\n📋 Características:")
-print("  ✓ Vista previa de imágenes extraídas")
-print("  ✓ Selección individual de productos")
-print("  ✓ Caché de análisis IA (más rápido)")
-print("  ✓ Progreso en tiempo real")
-print("  ✓ Timeouts optimizados (0.1-0.2s)")
-print("\n")
+# Lanzar GUI (protegido: el render en paralelo del PDF crea procesos hijos
+# que re-importan este script en Windows)
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🚀 LANZANDO INTERFAZ GRÁFICA")
+    print("="*60)
+    print("\n📋 Características:")
+    print("  ✓ Vista previa de imágenes extraídas")
+    print("  ✓ Selección individual de productos")
+    print("  ✓ Caché de análisis IA (más rápido)")
+    print("  ✓ Progreso en tiempo real")
+    print("  ✓ Timeouts optimizados (0.1-0.2s)")
+    print("\n")
 
-from marketplace_gui import main
-main()
+    from marketplace_gui import main
+    main()
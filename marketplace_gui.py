@@ -7,15 +7,19 @@ from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import os
 import sys
-import json
 import threading
+import time
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from modules.pdf_extractor import PDFImageExtractor
+from modules.render_cache import RenderCache
 from modules.ai_analyzer import AIImageAnalyzer
+from modules.ai_backends import create_client
+from modules.analysis_store import AnalysisStore
+from modules.metrics_store import MetricsStore
 from modules.facebook_auth import FacebookAuthenticator
 from modules.marketplace_automation import MarketplaceAutomation
 from modules.history import ListingHistory
@@ -32,12 +36,34 @@ class MarketplaceGUI:
 
         # Configuración
         self.config = Config()
-        self.pdf_extractor = PDFImageExtractor()
+        render_cache = RenderCache(self.config.RENDER_CACHE_DIR, self.config.RENDER_CACHE_MAX_MB * 1024 * 1024,
+                                   self.config.RENDER_CACHE_MAX_ENTRIES)
+        self.pdf_extractor = PDFImageExtractor(backend=self.config.PDF_BACKEND,
+                                               parallel_min_pages=self.config.PDF_PARALLEL_MIN_PAGES,
+                                               cache=render_cache,
+                                               passthrough=self.config.PDF_JPEG_PASSTHROUGH,
+                                               full_dpi=self.config.FULL_DPI,
+                                               image_format=self.config.IMAGE_FORMAT,
+                                               image_quality=self.config.IMAGE_QUALITY,
+                                               max_inflight_pages=self.config.PDF_MAX_INFLIGHT_PAGES)
         # La IA solo se inicializa si hay API key (no crashea sin ella)
         self.ai_analyzer = None
-        if self.config.GEMINI_API_KEY:
+        if self.config.GEMINI_API_KEY or self.config.AI_BACKEND == 'fake':
             try:
-                self.ai_analyzer = AIImageAnalyzer(self.config.GEMINI_API_KEY, self.config.AI_MODEL_IMAGE, self.config.MAX_IMAGE_SIZE)
+                self.ai_analyzer = AIImageAnalyzer(self.config.GEMINI_API_KEY, self.config.AI_MODEL_IMAGE,
+                                                   self.config.MAX_IMAGE_SIZE, self.config.AI_MAX_CONCURRENCY,
+                                                   self.config.AI_IMAGES_PER_REQUEST,
+                                                   requests_per_minute=self.config.AI_REQUESTS_PER_MINUTE,
+                                                   max_retries=self.config.AI_MAX_RETRIES,
+                                                   pdf_text=self.config.AI_PDF_TEXT,
+                                                   escalate_model=(self.config.AI_MODEL_CHAT
+                                                                   if self.config.AI_CASCADE else None),
+                                                   min_confidence=self.config.AI_CASCADE_MIN_CONFIDENCE,
+                                                   client=create_client(self.config),
+                                                   resolution_steps=self.config.AI_RESOLUTION_STEPS)
+                # metricas de cada llamada (tokens, latencia, costo), las de la GUI como cuenta 'gui'
+                metrics = MetricsStore(self.config.AI_METRICS_DB, self.config.AI_METRICS_DAYS)
+                self.ai_analyzer.metrics = lambda entry: metrics.record(dict(entry, account='gui'))
             except Exception as e:
                 print(f"No se pudo iniciar la IA: {e}")
         # Historial + logs
@@ -47,12 +73,12 @@ class MarketplaceGUI:
         self.current_pdf = None
         self.extracted_images = []
         self.selected_images = []
-        self.ai_cache = {}
+        self.ai_cache = None
         self.driver = None
         self.marketplace = None
+        self.extract_cancel = None
         
-        # Cargar caché de IA
-        self.cache_file = "ai_analysis_cache.json"
+        # Caché de IA (sqlite): se consulta bajo demanda, no se carga entero
         self.load_ai_cache()
         
         self.setup_ui()
@@ -270,22 +296,10 @@ class MarketplaceGUI:
         self.root.update_idletasks()
     
     def load_ai_cache(self):
-        """Cargar caché de análisis IA"""
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    self.ai_cache = json.load(f)
-                self.log(f"✓ Caché cargado: {len(self.ai_cache)} análisis")
-            except:
-                self.ai_cache = {}
-    
-    def save_ai_cache(self):
-        """Guardar caché de análisis IA"""
-        try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.ai_cache, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.log(f"⚠ Error guardando caché: {e}")
+        """Abrir caché de análisis IA (migra el ai_analysis_cache.json antiguo)"""
+        self.ai_cache = AnalysisStore(self.config.AI_CACHE_DB, self.config.AI_CACHE_MAX_ENTRIES,
+                                      self.config.AI_CACHE_TTL_DAYS)
+        self.ai_cache.import_json("ai_analysis_cache.json")
     
     def load_pdf(self):
         """Cargar y extraer imágenes de PDF"""
@@ -297,29 +311,48 @@ class MarketplaceGUI:
         if not pdf_path:
             return
         
+        # Cancelar una extraccion anterior que siga en curso
+        if self.extract_cancel:
+            self.extract_cancel.set()
+        self.extract_cancel = threading.Event()
+
         self.current_pdf = pdf_path
+        self.extracted_images = []
+        self._display_images()
         self.update_status("Extrayendo imágenes del PDF...")
         self.log(f"📄 Cargando PDF: {os.path.basename(pdf_path)}")
         
         # Extraer en thread para no bloquear UI
-        thread = threading.Thread(target=self._extract_images_thread, args=(pdf_path,))
+        thread = threading.Thread(target=self._extract_images_thread, args=(pdf_path, self.extract_cancel))
         thread.start()
     
-    def _extract_images_thread(self, pdf_path):
-        """Extraer imágenes en thread separado"""
+    def _extract_images_thread(self, pdf_path, cancel_event):
+        """Extraer imágenes en thread separado (cada página aparece al escribirse)"""
         try:
-            self.extracted_images = self.pdf_extractor.extract_images_from_pdf(pdf_path)
-            
-            if not self.extracted_images:
+            count = 0
+            # Total al instante (sin renderizar) para el progreso y la ETA
+            total = self.pdf_extractor.get_pdf_info(pdf_path)['num_pages']
+            self.root.after(0, lambda: self.update_status(f"Extrayendo {total} páginas..."))
+            start = time.time()
+            # Vista previa barata; la alta resolución se renderiza al subir
+            for ev in self.pdf_extractor.iter_images_from_pdf(pdf_path, dpi=self.config.PREVIEW_DPI,
+                                                              cancel_event=cancel_event):
+                count += 1
+                eta = (time.time() - start) / count * (ev['total'] - count)
+                # Actualizar UI en el thread principal
+                self.root.after(0, lambda p=ev['path']: self._append_image(p, cancel_event))
+                self.root.after(0, lambda n=ev['page'], t=ev['total'], e=eta:
+                                self.update_status(f"Extrayendo página {n}/{t} (~{e:.0f}s restantes)..."))
+
+            if cancel_event.is_set():
+                return
+
+            if not count:
                 self.root.after(0, lambda: messagebox.showerror("Error", "No se pudieron extraer imágenes"))
                 return
             
-            self.log(f"✓ Extraídas {len(self.extracted_images)} imágenes")
-            
-            # Actualizar UI en el thread principal
-            self.root.after(0, self._display_images)
-            self.root.after(0, self._update_info)
-            self.root.after(0, lambda: self.update_status(f"Listo - {len(self.extracted_images)} imágenes extraídas"))
+            self.root.after(0, lambda: self.log(f"✓ Extraídas {count} imágenes"))
+            self.root.after(0, lambda: self.update_status(f"Listo - {count} imágenes extraídas"))
             
         except Exception as e:
             self.root.after(0, lambda: messagebox.showerror("Error", f"Error extrayendo PDF: {e}"))
@@ -340,8 +373,20 @@ class MarketplaceGUI:
             self._create_image_card(idx, img_path, row, col)
         
         # Habilitar botones
+        if self.extracted_images:
+            self.btn_select_all.config(state=tk.NORMAL)
+            self.btn_deselect_all.config(state=tk.NORMAL)
+
+    def _append_image(self, img_path, cancel_event):
+        """Agregar al grid una página recién extraída (modo streaming)"""
+        if cancel_event.is_set():
+            return
+        idx = len(self.extracted_images)
+        self.extracted_images.append(img_path)
+        self._create_image_card(idx, img_path, idx // 4, idx % 4)
         self.btn_select_all.config(state=tk.NORMAL)
         self.btn_deselect_all.config(state=tk.NORMAL)
+        self._update_info()
     
     def _create_image_card(self, idx, img_path, row, col):
         """Crear tarjeta de imagen con checkbox y preview en grid"""
@@ -422,7 +467,7 @@ class MarketplaceGUI:
         window.geometry("800x600")
         
         try:
-            img = Image.open(img_path)
+            img = Image.open(self.pdf_extractor.full_resolution(img_path))
             img.thumbnail((780, 580))
             photo = ImageTk.PhotoImage(img)
             
@@ -630,6 +675,24 @@ Estado: {"Listo para subir" if selected > 0 else "Sin selección"}
 
         self.root.after(0, lambda: self.progress_bar.config(maximum=total, value=0))
 
+        # Analizar en paralelo lo que no esta en cache (la publicacion sigue
+        # siendo secuencial por las pausas anti-baneo)
+        pending = [p for p in self.selected_images[:remaining] if self.ai_analyzer.cache_key(p) not in self.ai_cache]
+        if pending:
+            self.root.after(0, lambda n=len(pending): self.log(f"🤖 Analizando {n} imágenes con IA en paralelo..."))
+            for res in self.ai_analyzer.iter_analyze_batch(pending, prepare=self.pdf_extractor.full_resolution,
+                                                           hints=self.pdf_extractor.page_hints):
+                if res['error']:
+                    self.root.after(0, lambda e=res['error']: self.log(f"  ⚠ Error IA (se reintenta al publicar): {e}"))
+                    continue
+                self.ai_cache[self.ai_analyzer.cache_key(res['item'])] = res['info']
+            usage = self.ai_analyzer.usage_stats()
+            self.root.after(0, lambda u=usage: self.log(f"  ℹ {u['tokens_per_image']} tokens/imagen ({u['requests']} llamadas)"))
+            if usage['escalated']:
+                self.root.after(0, lambda u=usage: self.log(
+                    f"  ℹ {u['escalated']} repetidas con {self.config.AI_MODEL_CHAT} "
+                    f"({u['escalation_rate']:.0%}, {u['escalation_latency_s']}s c/u)"))
+
         for idx, img_path in enumerate(self.selected_images, 1):
             if success_count >= remaining:
                 self.root.after(0, lambda: self.log("⚠ Límite diario alcanzado, deteniendo."))
@@ -640,15 +703,20 @@ Estado: {"Listo para subir" if selected > 0 else "Sin selección"}
 
             product_info = None
             try:
-                cache_key = os.path.basename(img_path)
-                if cache_key in self.ai_cache:
+                # El grid usa vistas previas: IA y Facebook reciben la alta resolución
+                full_path = self.pdf_extractor.full_resolution(img_path)
+                cache_key = self.ai_analyzer.cache_key(img_path)
+                product_info = self.ai_cache.get(cache_key)
+                if product_info is not None:
                     self.root.after(0, lambda: self.log("  ⚡ Usando análisis cacheado"))
-                    product_info = self.ai_cache[cache_key]
                 else:
                     self.root.after(0, lambda: self.log("  🤖 Analizando con IA..."))
-                    product_info = self.ai_analyzer.analyze_image_for_marketplace(img_path)
+                    product_info = self.ai_analyzer.analyze_image_for_marketplace(
+                        full_path, self.pdf_extractor.page_hints(img_path))
+                    if product_info.get('fallback'):
+                        # no publicar el texto generico como si fuera el producto
+                        raise RuntimeError(f"IA no disponible: {product_info['error']}")
                     self.ai_cache[cache_key] = product_info
-                    self.save_ai_cache()
                 self.root.after(0, lambda t=product_info['title']: self.log(f"  ✓ {t}"))
             except Exception as e:
                 failed_count += 1
@@ -669,7 +737,7 @@ Estado: {"Listo para subir" if selected > 0 else "Sin selección"}
                         description=product_info['description'],
                         category=self.config.DEFAULT_CATEGORY,
                         condition=self.config.DEFAULT_CONDITION,
-                        images=[img_path],
+                        images=[full_path],
                         tags=product_info['tags'],
                     )
                 except Exception as e:
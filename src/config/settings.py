@@ -21,6 +21,43 @@ class Config:
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
     AI_MODEL_IMAGE = os.getenv('AI_MODEL_IMAGE', 'gemini-2.5-flash')
     AI_MODEL_CHAT = os.getenv('AI_MODEL_CHAT', 'gemini-2.5-pro')
+    # Cascada: analizar con AI_MODEL_IMAGE y repetir con AI_MODEL_CHAT solo los
+    # resultados de baja confianza (campos vacios, precio por defecto, pocos tags...)
+    AI_CASCADE = os.getenv('AI_CASCADE', 'False').lower() == 'true'
+    AI_CASCADE_MIN_CONFIDENCE = float(os.getenv('AI_CASCADE_MIN_CONFIDENCE', '0.8'))
+    # Analisis por lote: llamadas simultaneas a Gemini
+    AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '4'))
+    # Imagenes por llamada en los lotes (el PROMPT se paga una vez por llamada).
+    # 1 = una imagen por llamada
+    AI_IMAGES_PER_REQUEST = int(os.getenv('AI_IMAGES_PER_REQUEST', '1'))
+    # Cuota de Gemini: peticiones por minuto del modelo (nivel gratuito de
+    # gemini-2.5-flash = 10; 0 = sin limite) y reintentos ante 429/5xx
+    AI_REQUESTS_PER_MINUTE = int(os.getenv('AI_REQUESTS_PER_MINUTE', '10'))
+    AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', '4'))
+    # Capa de texto del PDF: auto (precio/texto como pistas y sin imagen si la
+    # pagina trae nombre y precio) | hints (siempre con imagen) | off
+    AI_PDF_TEXT = os.getenv('AI_PDF_TEXT', 'auto').strip().lower()
+    # Cache de analisis (sqlite): maximo de analisis guardados y dias que valen
+    AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '20000'))
+    AI_CACHE_TTL_DAYS = int(os.getenv('AI_CACHE_TTL_DAYS', '90'))
+    # Metricas de cada llamada a la IA (tokens, latencia, costo): dias que se guardan
+    AI_METRICS_DAYS = int(os.getenv('AI_METRICS_DAYS', '90'))
+    # Backend de IA: gemini | fake (doble local sin red ni cuota, para medir
+    # rendimiento; ver modules/ai_backends.py) y la conducta del doble:
+    # latencia mediana y dispersion, probabilidad de 503 y de 429, cuota
+    # simulada por minuto (0 = sin cuota) y semilla (vacio = aleatorio)
+    AI_BACKEND = os.getenv('AI_BACKEND', 'gemini').strip().lower()
+    AI_FAKE_LATENCY_MS = float(os.getenv('AI_FAKE_LATENCY_MS', '800'))
+    AI_FAKE_LATENCY_SIGMA = float(os.getenv('AI_FAKE_LATENCY_SIGMA', '0.3'))
+    AI_FAKE_ERROR_RATE = float(os.getenv('AI_FAKE_ERROR_RATE', '0'))
+    AI_FAKE_429_RATE = float(os.getenv('AI_FAKE_429_RATE', '0'))
+    AI_FAKE_QUOTA_RPM = int(os.getenv('AI_FAKE_QUOTA_RPM', '0'))
+    AI_FAKE_SEED = int(os.getenv('AI_FAKE_SEED')) if os.getenv('AI_FAKE_SEED', '').strip() else None
+    AI_FAKE_BATCH_S = float(os.getenv('AI_FAKE_BATCH_S', '5'))
+    # Batch jobs (catalogos completos por la Batch API, mitad de precio; ver
+    # modules/batch_jobs.py): tope de cada job en MB y cada cuanto se consulta
+    AI_BATCH_INLINE_MB = float(os.getenv('AI_BATCH_INLINE_MB', '18'))
+    AI_BATCH_POLL_S = float(os.getenv('AI_BATCH_POLL_S', '30'))
 
     # Browser Settings
     HEADLESS = os.getenv('HEADLESS', 'False').lower() == 'true'
@@ -48,6 +85,31 @@ class Config:
 
     # Image Settings
     MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', '2048'))
+    # Resolucion adaptativa: escalones (px) menores que MAX_IMAGE_SIZE, p.ej.
+    # "768,1280". El analisis empieza en el aprendido para cada catalogo y
+    # sube solo si el resultado queda sin nombre o precio; vacio = desactivado
+    AI_RESOLUTION_STEPS = [int(s) for s in os.getenv('AI_RESOLUTION_STEPS', '').split(',') if s.strip()]
+
+    # PDF: backend de render forzado ('pypdfium2' | 'pdf2image'); vacio = el mas
+    # rapido segun una calibracion al primer uso
+    PDF_BACKEND = os.getenv('PDF_BACKEND', '').strip().lower()
+    # A partir de cuantas paginas se renderiza en paralelo (un proceso por nucleo)
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '8'))
+    # Dos niveles de render: vista previa barata para el grid y alta resolucion
+    # solo para las paginas que se analizan o publican
+    PREVIEW_DPI = int(os.getenv('PREVIEW_DPI', '50'))
+    FULL_DPI = int(os.getenv('FULL_DPI', '100'))
+    # Formato de salida de paginas y fotos: png | jpeg | webp | auto
+    # (auto = JPEG para fotos, PNG sin perdida solo para graficos/transparencias)
+    IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'auto').lower()
+    IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+    # Paginas que son una sola foto JPEG: copiar el JPEG original sin rasterizar
+    PDF_JPEG_PASSTHROUGH = os.getenv('PDF_JPEG_PASSTHROUGH', 'True').lower() == 'true'
+    # Maximo de paginas renderizadas en memoria a la vez (memoria plana en PDFs enormes)
+    PDF_MAX_INFLIGHT_PAGES = int(os.getenv('PDF_MAX_INFLIGHT_PAGES', '16'))
+    # Cache de render: re-subir el mismo PDF (mismo contenido y DPI) no re-renderiza
+    RENDER_CACHE_MAX_MB = int(os.getenv('RENDER_CACHE_MAX_MB', '2048'))
+    RENDER_CACHE_MAX_ENTRIES = int(os.getenv('RENDER_CACHE_MAX_ENTRIES', '50'))
 
     # URLs
     MARKETPLACE_URL = 'https://www.facebook.com/marketplace/create/item'
@@ -56,9 +118,13 @@ class Config:
 
     # Directories
     TEMP_DIR = 'temp_images'
+    RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', 'render_cache')
     SCREENSHOTS_DIR = 'screenshots'
     LOGS_DIR = 'logs'
     HISTORY_FILE = os.getenv('HISTORY_FILE', 'listings_history.json')
+    AI_CACHE_DB = os.getenv('AI_CACHE_DB', 'ai_analysis.db')
+    AI_METRICS_DB = os.getenv('AI_METRICS_DB', 'ai_metrics.db')
+    BATCH_JOBS_DIR = os.getenv('BATCH_JOBS_DIR', 'batch_jobs')
 
     @classmethod
     def validate(cls):
@@ -3,12 +3,22 @@ AI Image Analyzer Module
 Usa Google Gemini para analizar imagenes y generar la info del producto.
 Devuelve JSON estructurado (no parseo de texto fragil).
 """
+import io
 import os
 import json
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google import genai
 from google.genai import types
 from PIL import Image
 
+from modules.gemini_client import GeminiClient
+from modules.resolution_ladder import ResolutionLadder
+
 
 PROMPT = """Analiza esta imagen de un producto para una publicacion en Facebook Marketplace.
 
@@ -41,43 +51,241 @@ Responde UNICAMENTE con un objeto JSON valido con esta forma EXACTA:
 - price debe ser un numero entero (el unitario mas bajo).
 - tags: minimo 8, relevantes al producto, sin 'remate' ni 'oferta'."""
 
+_digests = {}   # (ruta, tamano, mtime) -> sha256 de la imagen
+_digests_lock = threading.Lock()
+
+
+def analysis_cache_key(image_path, model):
+    """
+    Clave del cache de analisis: sha256 de los bytes de la imagen + version
+    del prompt + modelo.
+
+    Los nombres no sirven: las fotos subidas reciben nombres aleatorios (la
+    misma foto nunca acertaba) y las paginas siempre son page_N (un catalogo
+    nuevo reusaba el analisis de la pagina N del anterior). El hash de cada
+    archivo se memoiza por (ruta, tamano, mtime).
+    """
+    st = os.stat(image_path)
+    stamp = (os.path.abspath(image_path), st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(stamp)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digests_lock:
+            if len(_digests) >= 4096:
+                _digests.clear()
+            _digests[stamp] = digest
+    return f"{digest}:{PROMPT_VERSION}:{model}"
+
+
+def packed_prompt(n):
+    """PROMPT para n imagenes en una sola llamada: mismas reglas de precio y
+    descripcion, pero la respuesta es un array con un objeto por imagen."""
+    rules = PROMPT.split("Responde UNICAMENTE")[0].replace(
+        "Analiza esta imagen de un producto",
+        f"Analiza CADA UNA de las {n} imagenes siguientes (cada imagen es un producto distinto)")
+    return rules + f"""Responde UNICAMENTE con un ARRAY JSON valido de {n} objetos, uno por imagen, con esta forma EXACTA:
+[
+  {{"image": 1, "title": "nombre del producto", "price": 0, "description": "...", "tags": ["tag1", "tag2"]}}
+]
+- image: numero de la imagen que describe ese objeto (de 1 a {n}, cada uno una sola vez).
+- description: con el formato de arriba, usa \\n para los saltos de linea.
+- price debe ser un numero entero (el unitario mas bajo).
+- tags: minimo 8, relevantes al producto, sin 'remate' ni 'oferta'."""
+
+
+def hint_block(hints):
+    """Pistas de la capa de texto del PDF (ver price_extractor.page_hints)."""
+    block = f'\n\nTEXTO DE LA PAGINA (capa de texto del PDF, puede estar desordenado):\n"""{hints["text"]}"""'
+    if hints.get('price') is not None:
+        block += (f"\nPRECIO UNITARIO MAS BAJO ya calculado con las reglas de arriba: {hints['price']}"
+                  f" (de {', '.join(hints['prices'])}).")
+        block += (" Usa ese valor en \"price\"." if hints.get('exact', True) else
+                  " Algun precio del texto admite otra lectura: confirmalo con la imagen.")
+    return block
+
+
+def text_prompt(hints):
+    """PROMPT sin imagen: la pagina trae nombre y precio en su capa de texto."""
+    return PROMPT.replace(
+        "Analiza esta imagen de un producto para una publicacion en Facebook Marketplace.",
+        "Prepara una publicacion de Facebook Marketplace para el producto de esta pagina de "
+        "catalogo. No hay imagen: usa SOLO el texto de la pagina.") + hint_block(hints)
+
+
+# Huella de los prompts: forma parte de la clave del cache de analisis, asi
+# que editar cualquiera (PROMPT, el de varias imagenes, el bloque de pistas o
+# el de solo texto) invalida solo los analisis hechos con los anteriores. Las
+# plantillas con parametros entran renderizadas con valores fijos.
+def prompt_version():
+    sample = {'text': '', 'price': 0, 'prices': ['0'], 'exact': False}
+    templates = (PROMPT, packed_prompt(2), hint_block(sample), text_prompt(sample))
+    return hashlib.sha256('\x00'.join(templates).encode('utf-8')).hexdigest()[:12]
+
+
+PROMPT_VERSION = prompt_version()
+
+MIN_TAGS = 8   # lo que pide el PROMPT
+
+
+def generation_config():
+    """Configuracion de generate_content (la misma para los Batch jobs)."""
+    return types.GenerateContentConfig(response_mime_type="application/json", temperature=0.4)
+
+
+def confidence(data, info):
+    """
+    Que tan confiable es un analisis (0..1), sin otra llamada: penaliza lo
+    que _normalize tuvo que rellenar (campos que faltaban, el precio '10' por
+    defecto) y lo que incumple el PROMPT (menos de MIN_TAGS tags, emojis o
+    acentos en la descripcion).
+
+    data: el JSON tal cual lo devolvio el modelo; info: ya normalizado.
+    """
+    score = 1.0
+    for field in ('title', 'price', 'description', 'tags'):
+        if data.get(field) in (None, '', [], 0):
+            score -= 0.3
+    if info['price'] == '10' and str(data.get('price')).strip() not in ('10', '10.0'):
+        score -= 0.4
+    if len(info['tags']) < MIN_TAGS:
+        score -= 0.15 if len(info['tags']) >= 3 else 0.3
+    if not info['description'].isascii():
+        score -= 0.2
+    return round(max(score, 0.0), 2)
+
+
+def incomplete(info):
+    """
+    El analisis no leyo lo que depende de la resolucion: el nombre (quedo el
+    de _normalize) o el precio (quedo el '10' por defecto, que confidence()
+    penaliza con 0.4; un 10 real con el resto bien puntua mas de 0.6).
+    """
+    return info['title'] == 'Producto en venta' or (info['price'] == '10' and info['confidence'] <= 0.6)
+
+
+class MalformedBatchResponse(ValueError):
+    """La respuesta de una llamada con varias imagenes no mapea 1:1 con ellas."""
+
 
 class AIImageAnalyzer:
     """Analiza imagenes con Gemini y devuelve info de producto estructurada."""
 
-    def __init__(self, api_key, model='gemini-2.5-flash', max_size=2048):
-        if not api_key:
-            raise ValueError("AIImageAnalyzer requiere una GEMINI_API_KEY valida (ponla en el .env)")
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key, model='gemini-2.5-flash', max_size=2048, max_concurrency=4,
+                 images_per_request=1, jpeg_quality=85, prepared_cache_mb=64,
+                 requests_per_minute=10, max_retries=4, pdf_text='auto',
+                 escalate_model=None, min_confidence=0.8, client=None, resolution_steps=None):
+        # client: cualquier objeto con client.models.generate_content como el
+        # de google-genai (ver ai_backends.py: el doble local para pruebas de
+        # carga); por defecto genai.Client con la api_key
+        if client is None:
+            if not api_key:
+                raise ValueError("AIImageAnalyzer requiere una GEMINI_API_KEY valida (ponla en el .env)")
+            client = genai.Client(api_key=api_key)
+        self.client = client
         self.model = model
+        # Toda llamada pasa por aqui: limite por minuto compartido por el
+        # proceso + reintentos con backoff (ver gemini_client.py)
+        self.gemini = GeminiClient(self.client, model, requests_per_minute, max_retries)
+        # Cascada: todo pasa primero por `model` (barato); solo los resultados
+        # con confidence() < min_confidence se repiten con escalate_model
+        self.strong = (GeminiClient(self.client, escalate_model, requests_per_minute, max_retries)
+                       if escalate_model and escalate_model != model else None)
+        self.min_confidence = min_confidence
+        # Capa de texto del PDF (hints de PDFImageExtractor.page_hints):
+        #   'auto'  -> pistas con la imagen; sin imagen si la pagina trae nombre y precio
+        #   'hints' -> siempre con imagen, el texto y el precio solo como pistas
+        #   'off'   -> se ignoran
+        self.pdf_text = pdf_text
         self.max_size = max_size
+        # Resolucion adaptativa: con escalones menores que max_size cada imagen
+        # empieza en el de partida de su fuente y sube solo si el resultado
+        # queda incompleto (ver resolution_ladder.py). source_of: ruta ->
+        # fuente (catalogo); por defecto la carpeta de la imagen
+        sizes = [s for s in (resolution_steps or []) if 0 < s < max_size]
+        self.ladder = ResolutionLadder(sizes + [max_size]) if sizes else None
+        self.source_of = os.path.dirname
+        # Llamadas simultaneas a Gemini en los analisis por lote
+        self.max_concurrency = max(1, max_concurrency)
+        # Imagenes por llamada en los lotes: el PROMPT largo se paga una vez por
+        # llamada, no por imagen (1 = una imagen por llamada, como siempre)
+        self.images_per_request = max(1, images_per_request)
+        self._usage = {'requests': 0, 'images': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'seconds': 0.0,
+                       'scored': 0, 'escalated': 0, 'escalation_tokens': 0, 'escalation_seconds': 0.0,
+                       'climbed': 0}
+        self._usage_lock = threading.Lock()
+        # Sink de metricas: callable(dict) por cada llamada (ver
+        # metrics_store.py); None = no se registra nada
+        self.metrics = None
+        # Imagenes ya preparadas (JPEG en memoria) por sha256 del archivo: un
+        # re-analisis (force, reintento, otro lote) no vuelve a decodificar
+        self.jpeg_quality = jpeg_quality
+        self._prepared = OrderedDict()
+        self._prepared_bytes = 0
+        self._prepared_max = prepared_cache_mb * 1024 * 1024
+        self._prepared_lock = threading.Lock()
 
-    def prepare_image(self, image_path):
-        """Abre la imagen y la reduce si es muy grande."""
-        img = Image.open(image_path)
-        if max(img.size) > self.max_size:
-            img_copy = img.copy()
-            img_copy.thumbnail((self.max_size, self.max_size), Image.Resampling.LANCZOS)
-            base, ext = os.path.splitext(image_path)
-            temp_path = f"{base}_resized{ext if ext else '.png'}"
-            img_copy.save(temp_path)
-            return Image.open(temp_path)
-        return img
-
-    def analyze_image_for_marketplace(self, image_path):
-        """Devuelve dict {title, price, description, tags}."""
+    def cache_key(self, image_path):
+        """Clave de cache de la imagen para este modelo (ver analysis_cache_key)."""
+        return analysis_cache_key(image_path, self.model)
+
+    def prepare_image(self, image_path, size=None):
+        """
+        Imagen lista para enviar: JPEG compacto en memoria como Part inline,
+        de lado maximo `size` (default: max_size).
+
+        Sin archivos temporales: los JPEG grandes se decodifican ya reducidos
+        (draft, escalado DCT) y el resultado se codifica una sola vez. Se
+        memoiza por sha256 del archivo y tamano (LRU acotado a prepared_cache_mb).
+        """
+        size = size or self.max_size
+        with open(image_path, 'rb') as f:
+            raw = f.read()
+        key = (hashlib.sha256(raw).hexdigest(), size)
+        with self._prepared_lock:
+            data = self._prepared.get(key)
+            if data is not None:
+                self._prepared.move_to_end(key)
+        if data is None:
+            data = self._encode_for_model(raw, size)
+            with self._prepared_lock:
+                if key not in self._prepared:
+                    self._prepared[key] = data
+                    self._prepared_bytes += len(data)
+                while self._prepared_bytes > self._prepared_max and len(self._prepared) > 1:
+                    _, old = self._prepared.popitem(last=False)
+                    self._prepared_bytes -= len(old)
+        return types.Part.from_bytes(data=data, mime_type='image/jpeg')
+
+    def _encode_for_model(self, raw, size=None):
+        """Bytes de imagen -> JPEG RGB de lado maximo size (default: max_size)."""
+        size = size or self.max_size
+        with Image.open(io.BytesIO(raw)) as img:
+            # JPEG: decodifica directamente a 1/2, 1/4 u 1/8 si sobra resolucion
+            img.draft('RGB', (size, size))
+            img = img.convert('RGB')
+        if max(img.size) > size:
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=self.jpeg_quality)
+        return out.getvalue()
+
+    def analyze_image_for_marketplace(self, image_path, hints=None):
+        """
+        Devuelve dict {title, price, description, tags, confidence, model}.
+
+        hints: pistas de la capa de texto de la pagina (ver _analyze_one).
+
+        Si Gemini falla (o el circuito esta abierto) devuelve un texto generico
+        marcado con 'fallback': True y el 'error'; ese resultado NO es un
+        analisis: no se debe guardar en cache ni publicar como si lo fuera.
+        """
         try:
-            image = self.prepare_image(image_path)
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=[PROMPT, image],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.4,
-                ),
-            )
-            data = self._parse_json(response.text)
-            return self._normalize(data)
+            return self._analyze(image_path, hints)
         except Exception as e:
             print(f"Error analizando imagen con IA: {e}")
             return {
@@ -85,8 +293,352 @@ class AIImageAnalyzer:
                 'description': 'Producto en excelente condicion. Contactar para mas detalles.',
                 'price': '10',
                 'tags': ['producto', 'venta', 'marketplace'],
+                'fallback': True,
+                'error': str(e),
             }
 
+    def _generate(self, contents, images, gemini=None):
+        """generate_content + contabilidad de tokens y latencia. Devuelve
+        (texto, tokens por imagen). gemini: el cliente del modelo fuerte al
+        escalar (se contabiliza aparte)."""
+        gemini = gemini or self.gemini
+        started = time.monotonic()
+        try:
+            response = gemini.generate_content(contents=contents, config=generation_config())
+        except Exception as e:
+            self._record(gemini.model, contents, images, time.monotonic() - started, error=e)
+            raise
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+        elapsed = time.monotonic() - started
+        self._record(gemini.model, contents, images, elapsed, prompt_tokens, output_tokens)
+        with self._usage_lock:
+            if gemini is self.gemini:
+                self._usage['requests'] += 1
+                self._usage['images'] += images
+                self._usage['prompt_tokens'] += prompt_tokens
+                self._usage['output_tokens'] += output_tokens
+                self._usage['seconds'] += elapsed
+            else:
+                self._usage['escalation_tokens'] += prompt_tokens + output_tokens
+                self._usage['escalation_seconds'] += elapsed
+        return response.text, (prompt_tokens + output_tokens) / images
+
+    def _record(self, model, contents, images, seconds, prompt_tokens=0, output_tokens=0, error=None):
+        """Una fila para el sink de metricas; si el sink falla el analisis sigue."""
+        if self.metrics is None:
+            return
+        image_bytes = sum(len(c.inline_data.data) for c in contents if getattr(c, 'inline_data', None))
+        try:
+            self.metrics({'kind': 'call', 'model': model, 'images': images, 'image_bytes': image_bytes,
+                          'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens,
+                          'seconds': round(seconds, 3), 'error': str(error)[:200] if error else None})
+        except Exception as e:
+            print(f"No se pudo registrar la metrica: {e}")
+
+    def _analyze(self, image_path, hints=None):
+        """Una llamada a Gemini; a diferencia de analyze_image_for_marketplace
+        propaga los errores (el lote los reporta por item)."""
+        entries = [(image_path, hints)]
+        results = self._climb(entries, [self._analyze_one(image_path, hints)])
+        return self._cascade(entries, results)[0][0]
+
+    def text_only(self, hints):
+        """La pagina trae nombre y un precio sin ambiguedad en su texto: no
+        hace falta la imagen (ni renderizar su alta resolucion)."""
+        return self.pdf_text == 'auto' and bool(hints) and hints.get('complete')
+
+    def _analyze_one(self, image_path, hints=None, gemini=None, size=None):
+        """
+        Una imagen. Con pistas de la capa de texto se agregan al prompt; si la
+        plantilla esta completa (modo 'auto') se manda solo el texto, sin la
+        imagen, y el precio es el calculado localmente.
+
+        size: lado de la imagen enviada (default: el de partida de su fuente
+        con la resolucion adaptativa, si no max_size).
+        """
+        gemini = gemini or self.gemini
+        if self.pdf_text == 'off':
+            hints = None
+        if self.text_only(hints):
+            text, tokens = self._generate([text_prompt(hints)], 1, gemini)
+            data = self._parse_json(text)
+            data['price'] = hints['price']
+            return self._scored(data, gemini.model), tokens
+        prompt = PROMPT + hint_block(hints) if hints else PROMPT
+        size = size or self._start_size(image_path)
+        text, tokens = self._generate([prompt, self.prepare_image(image_path, size)], 1, gemini)
+        return self._scored(self._parse_json(text), gemini.model, size), tokens
+
+    def _start_size(self, image_path):
+        """Lado con el que se manda primero la imagen (el escalon de partida de su fuente)."""
+        return self.ladder.start(self.source_of(image_path)) if self.ladder else self.max_size
+
+    def _scored(self, data, model, size=None):
+        """_normalize + la confianza del resultado, el modelo que lo hizo y,
+        con la resolucion adaptativa, el lado de la imagen que se envio."""
+        info = self._normalize(data)
+        info['confidence'] = confidence(data, info)
+        info['model'] = model
+        if self.ladder and size:
+            info['resolution'] = size
+        return info
+
+    def _climb(self, entries, results):
+        """
+        Resolucion adaptativa (entries/results como en _cascade): los
+        resultados incompletos se repiten con el escalon siguiente hasta
+        completarse o llegar a max_size; cada intento le ensena a la escalera
+        que tamano necesita esa fuente. Si una repeticion falla queda el
+        resultado que habia.
+        """
+        if self.ladder is None:
+            return results
+        for pos, (info, tokens) in enumerate(results):
+            size = info.get('resolution')
+            if size is None:            # solo texto: no hay imagen que agrandar
+                continue
+            source = self.source_of(entries[pos][0])
+            while True:
+                done = not incomplete(info)
+                self.ladder.observe(source, size, done)
+                size = None if done else self.ladder.next_size(size)
+                if size is None:
+                    break
+                with self._usage_lock:
+                    self._usage['climbed'] += 1
+                try:
+                    info, extra = self._analyze_one(*entries[pos], size=size)
+                except Exception as e:
+                    print(f"Reintento a {size}px fallo ({e}); queda el de {info['resolution']}px")
+                    break
+                tokens += extra
+            results[pos] = (info, tokens)
+        return results
+
+    def _cascade(self, entries, results):
+        """
+        Repite con el modelo fuerte los resultados de baja confianza
+        (entries/results alineados: [(ruta, pistas)] / [(info, tokens)]). Se
+        queda con el mejor de los dos; si el fuerte falla, con el barato.
+        """
+        with self._usage_lock:
+            self._usage['scored'] += len(results)
+        if self.strong is None:
+            return results
+        for pos, (info, tokens) in enumerate(results):
+            if info['confidence'] >= self.min_confidence:
+                continue
+            with self._usage_lock:
+                self._usage['escalated'] += 1
+            try:
+                better, extra = self._analyze_one(*entries[pos], gemini=self.strong,
+                                                  size=info.get('resolution'))
+            except Exception as e:
+                print(f"Escalado a {self.strong.model} fallo ({e}); queda el de {self.model}")
+                continue
+            if better['confidence'] >= info['confidence']:
+                results[pos] = (better, tokens + extra)
+        return results
+
+    def _analyze_packed(self, entries):
+        """
+        Varias imagenes en UNA llamada (entries: [(ruta, pistas o None)]). La
+        respuesta debe ser un array con un objeto por imagen y su numero
+        ("image"); si no mapea 1:1 se lanza MalformedBatchResponse.
+        """
+        n = len(entries)
+        contents = [packed_prompt(n)]
+        sizes = []
+        for i, (path, hints) in enumerate(entries, 1):
+            label = f"Imagen {i}:"
+            if hints and self.pdf_text != 'off':
+                label += hint_block(hints).replace("TEXTO DE LA PAGINA", f"TEXTO DE LA PAGINA DE LA IMAGEN {i}")
+            sizes.append(self._start_size(path))
+            contents += [label, self.prepare_image(path, sizes[-1])]
+        text, tokens = self._generate(contents, n)
+        data = self._parse_json_array(text)
+        by_image = {}
+        for obj in data:
+            try:
+                idx = int(obj.get('image'))
+            except (AttributeError, TypeError, ValueError):
+                raise MalformedBatchResponse(f"objeto sin numero de imagen: {obj!r:.80}")
+            by_image[idx] = obj
+        if len(data) != n or sorted(by_image) != list(range(1, n + 1)):
+            raise MalformedBatchResponse(f"se esperaban {n} resultados (1..{n}), llegaron {sorted(by_image)}")
+        return [(self._scored(by_image[i], self.model, sizes[i - 1]), tokens) for i in range(1, n + 1)]
+
+    def _analyze_group(self, entries):
+        """Analiza un grupo empaquetado ([(ruta, pistas)]); si la respuesta no
+        cuadra se parte en dos mitades (hasta llegar a una imagen por llamada).
+        Las paginas que se resuelven solo con texto van aparte, sin imagen."""
+        results = [None] * len(entries)
+        packed = []
+        for pos, (path, hints) in enumerate(entries):
+            if self.text_only(hints):
+                results[pos] = self._analyze_one(path, hints)
+            else:
+                packed.append(pos)
+        if len(packed) == 1:
+            results[packed[0]] = self._analyze_one(*entries[packed[0]])
+        elif packed:
+            try:
+                out = self._analyze_packed([entries[pos] for pos in packed])
+            except MalformedBatchResponse as e:
+                print(f"Respuesta de lote invalida ({e}); partiendo en dos")
+                half = len(packed) // 2
+                out = (self._analyze_group([entries[pos] for pos in packed[:half]]) +
+                       self._analyze_group([entries[pos] for pos in packed[half:]]))
+            for pos, res in zip(packed, out):
+                results[pos] = res
+        return results
+
+    def usage_stats(self):
+        """Tokens consumidos desde que se creo el analizador (y por imagen)."""
+        with self._usage_lock:
+            usage = dict(self._usage)
+        total = usage['prompt_tokens'] + usage['output_tokens']
+        usage['tokens_per_image'] = round(total / usage['images'], 1) if usage['images'] else 0
+        usage['retries'] = self.gemini.retries + (self.strong.retries if self.strong else 0)
+        usage['throttled_s'] = round(self.gemini.throttled_seconds, 1)
+        usage['circuit'] = self.gemini.breaker.state
+        # Cascada: cuantos resultados se repitieron con el modelo fuerte y lo
+        # que tarda en promedio una llamada de cada modelo
+        usage['escalation_rate'] = round(usage['escalated'] / usage['scored'], 3) if usage['scored'] else 0
+        usage['latency_s'] = round(usage.pop('seconds') / usage['requests'], 2) if usage['requests'] else 0
+        escalation_seconds = usage.pop('escalation_seconds')
+        usage['escalation_latency_s'] = (round(escalation_seconds / usage['escalated'], 2)
+                                         if usage['escalated'] else 0)
+        # Resolucion adaptativa: reintentos a mayor resolucion por resultado y
+        # el tamano de partida aprendido de cada fuente
+        usage['climb_rate'] = round(usage['climbed'] / usage['scored'], 3) if usage['scored'] else 0
+        if self.ladder:
+            usage['resolution'] = self.ladder.stats()
+        return usage
+
+    def iter_analyze_batch(self, items, max_concurrency=None, prepare=None, cancel_event=None,
+                           images_per_request=None, hints=None):
+        """
+        Analiza varias imagenes en paralelo y entrega cada resultado al terminar.
+
+        Las llamadas a Gemini son casi todo espera de red, asi que un pool de
+        hilos con `max_concurrency` llamadas a la vez convierte N viajes de ida
+        y vuelta en ~N/max_concurrency. Con images_per_request > 1 cada llamada
+        lleva varias imagenes (ver _analyze_group).
+
+        Args:
+            items (list): rutas de imagen (o claves, si se pasa prepare)
+            max_concurrency (int): llamadas simultaneas (default: self.max_concurrency)
+            prepare (callable): item -> ruta a analizar; corre en el hilo del
+                item (p.ej. renderizar la alta resolucion) y se solapa con las
+                llamadas de los demas
+            cancel_event (threading.Event): los items aun no empezados se omiten
+            images_per_request (int): imagenes por llamada (default: self.images_per_request)
+            hints (callable): item -> pistas de la capa de texto o None (ver
+                PDFImageExtractor.page_hints)
+
+        Yields:
+            dict: {'index', 'item', 'info', 'tokens', 'error'} en orden de
+            finalizacion; info es None y error el mensaje si ese item fallo
+        """
+        size = images_per_request or self.images_per_request
+        groups = [list(range(i, min(i + size, len(items)))) for i in range(0, len(items), size)]
+
+        def work(group):
+            if cancel_event is not None and cancel_event.is_set():
+                raise RuntimeError("cancelado")
+            entries = []
+            for i in group:
+                h = hints(items[i]) if hints else None
+                # solo texto: no se prepara (renderiza) la imagen
+                path = prepare(items[i]) if prepare and not self.text_only(h) else items[i]
+                entries.append((path, h))
+            return self._cascade(entries, self._climb(entries, self._analyze_group(entries)))
+
+        workers = max(1, min(max_concurrency or self.max_concurrency, len(groups) or 1))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            # cada hilo con una copia del contexto del llamador (la cuenta de
+            # metrics_store.account, por ejemplo)
+            futures = {executor.submit(contextvars.copy_context().run, work, group): group
+                       for group in groups}
+            for future in as_completed(futures):
+                group = futures[future]
+                error = future.exception()
+                results = None if error else future.result()
+                for pos, i in enumerate(group):
+                    info, tokens = results[pos] if results else (None, None)
+                    yield {'index': i, 'item': items[i], 'info': info, 'tokens': tokens,
+                           'error': str(error) if error else None}
+        finally:
+            # Si el consumidor abandona (cliente desconectado) no se empiezan mas
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def analyze_batch(self, items, max_concurrency=None, prepare=None, images_per_request=None,
+                      hints=None):
+        """Como iter_analyze_batch pero devuelve la lista en el orden de `items`."""
+        results = [None] * len(items)
+        for res in self.iter_analyze_batch(items, max_concurrency, prepare,
+                                           images_per_request=images_per_request, hints=hints):
+            results[res['index']] = res
+        return results
+
+    # ---------- Batch API (trabajos asincronos; ver batch_jobs.py) ----------
+    def batch_request(self, image_path, hints=None, metadata=None):
+        """
+        Una peticion de un Batch job: el mismo prompt que _analyze_one (con
+        pistas, o solo el texto si la pagina esta completa) y la imagen a
+        max_size. metadata: dict de texto que vuelve con la respuesta.
+        """
+        if self.pdf_text == 'off':
+            hints = None
+        if self.text_only(hints):
+            parts = [types.Part.from_text(text=text_prompt(hints))]
+        else:
+            prompt = PROMPT + hint_block(hints) if hints else PROMPT
+            parts = [types.Part.from_text(text=prompt), self.prepare_image(image_path)]
+        return types.InlinedRequest(contents=[types.Content(role='user', parts=parts)],
+                                    config=generation_config(), metadata=metadata)
+
+    def submit_batch_job(self, requests, display_name=None):
+        """Crea un Batch job con las peticiones de batch_request; devuelve su nombre."""
+        job = self.client.batches.create(model=self.model, src=requests,
+                                         config={'display_name': display_name} if display_name else None)
+        return job.name
+
+    def batch_job(self, name):
+        """
+        Estado de un Batch job: (estado, respuestas). estado sin el prefijo
+        JOB_STATE_ ('PENDING', 'RUNNING', 'SUCCEEDED', 'FAILED', ...);
+        respuestas: las InlinedResponse en el orden de las peticiones cuando
+        termina, None mientras tanto.
+        """
+        job = self.client.batches.get(name=name)
+        state = getattr(job.state, 'name', str(job.state)).replace('JOB_STATE_', '')
+        responses = job.dest.inlined_responses if job.dest else None
+        return state, responses
+
+    def cancel_batch_job(self, name):
+        self.client.batches.cancel(name=name)
+
+    def batch_result(self, response, hints=None):
+        """
+        InlinedResponse -> (info, prompt_tokens, output_tokens); lanza
+        RuntimeError si esa peticion fallo. hints: los de su batch_request
+        (en las de solo texto el precio es el calculado localmente).
+        """
+        if response.error:
+            raise RuntimeError(f"{response.error.code}: {response.error.message}")
+        data = self._parse_json(response.response.text)
+        if self.text_only(hints):
+            data['price'] = hints['price']
+        usage = response.response.usage_metadata
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+        return self._scored(data, self.model), prompt_tokens, output_tokens
+
     def _parse_json(self, content):
         """Parsea JSON aunque venga envuelto en ```json ... ```."""
         if not content:
@@ -110,6 +662,29 @@ class AIImageAnalyzer:
                     pass
             return {}
 
+    def _parse_json_array(self, content):
+        """Como _parse_json pero para la respuesta de varias imagenes (un array).
+        Acepta tambien {"results": [...]}; lanza MalformedBatchResponse si no hay array."""
+        text = (content or '').strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            if text.lower().startswith("json"):
+                text = text[4:]
+            text = text.strip()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            start, end = text.find('['), text.rfind(']')
+            try:
+                data = json.loads(text[start:end + 1]) if 0 <= start < end else None
+            except json.JSONDecodeError:
+                data = None
+        if isinstance(data, dict):
+            data = next((v for v in data.values() if isinstance(v, list)), None)
+        if not isinstance(data, list):
+            raise MalformedBatchResponse(f"no es un array JSON: {text[:80]!r}")
+        return data
+
     def _normalize(self, data):
         """Asegura tipos y valores por defecto."""
         title = str(data.get('title') or '').strip() or 'Producto en venta'
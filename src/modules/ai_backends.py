@@ -0,0 +1,247 @@
+"""
+AI Backends Module
+De donde sale el cliente que usa AIImageAnalyzer.
+
+El analizador solo necesita client.models.generate_content(model, contents,
+config) con la forma de google-genai (respuesta con .text y .usage_metadata,
+errores google.genai.errors.APIError). Cualquier objeto con esa forma sirve:
+
+  - 'gemini': genai.Client con la GEMINI_API_KEY (lo normal)
+  - 'fake':   FakeGeminiClient, un doble local sin red ni cuota que responde
+              JSON valido segun el PROMPT con latencia, errores 5xx y 429
+              configurables. Sirve para medir el throughput de /api/analyze,
+              los lotes, la publicacion o la GUI de forma reproducible (con
+              AI_FAKE_SEED) en una maquina sin conexion. Tambien imita la
+              Batch API (client.batches): los jobs terminan AI_FAKE_BATCH_S
+              segundos despues de crearse.
+"""
+import json
+import math
+import time
+import random
+import uuid
+import hashlib
+import threading
+from collections import deque
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+
+def create_client(config):
+    """Cliente para AIImageAnalyzer segun config.AI_BACKEND ('gemini' | 'fake')."""
+    if config.AI_BACKEND == 'fake':
+        return FakeGeminiClient(latency_ms=config.AI_FAKE_LATENCY_MS,
+                                latency_sigma=config.AI_FAKE_LATENCY_SIGMA,
+                                error_rate=config.AI_FAKE_ERROR_RATE,
+                                rate_429=config.AI_FAKE_429_RATE,
+                                quota_rpm=config.AI_FAKE_QUOTA_RPM,
+                                seed=config.AI_FAKE_SEED,
+                                batch_seconds=config.AI_FAKE_BATCH_S)
+    if config.AI_BACKEND != 'gemini':
+        raise ValueError(f"AI_BACKEND desconocido: {config.AI_BACKEND!r} (usa 'gemini' o 'fake')")
+    if not config.GEMINI_API_KEY:
+        raise ValueError("AIImageAnalyzer requiere una GEMINI_API_KEY valida (ponla en el .env)")
+    return genai.Client(api_key=config.GEMINI_API_KEY)
+
+
+_PRODUCTS = [
+    ('Audifonos Bluetooth TWS', ['audifonos', 'bluetooth', 'tws', 'inalambrico', 'musica', 'gaming',
+                                 'manos libres', 'tecnologia']),
+    ('Set de Ollas Antiadherentes', ['ollas', 'cocina', 'antiadherente', 'hogar', 'set', 'menaje',
+                                     'utensilios', 'calidad']),
+    ('Mochila Escolar Impermeable', ['mochila', 'escolar', 'impermeable', 'viaje', 'estudiantes',
+                                     'resistente', 'espaciosa', 'moda']),
+    ('Peluche de Oso Gigante', ['peluche', 'oso', 'regalo', 'juguete', 'suave', 'ninos', 'decoracion',
+                                'gigante']),
+]
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeGeminiClient:
+    """
+    Doble de genai.Client (client.models.generate_content).
+
+    Args:
+        latency_ms (float): mediana de la latencia de una llamada de 1 imagen;
+            cada imagen extra de una llamada empaquetada suma un 30%
+        latency_sigma (float): dispersion lognormal (0 = latencia fija)
+        error_rate (float): probabilidad de un 503 UNAVAILABLE
+        rate_429 (float): probabilidad de un 429 (con Retry-After de
+            retry_after segundos)
+        quota_rpm (int): cuota simulada; pasadas quota_rpm llamadas en 60 s
+            responde 429 con el tiempo hasta que se libere un cupo (0 = sin cuota)
+        seed (int): semilla para resultados reproducibles (None = aleatorio)
+        batch_seconds (float): lo que tarda un Batch job en terminar; cada
+            peticion del job falla con probabilidad error_rate
+    """
+
+    def __init__(self, latency_ms=800, latency_sigma=0.3, error_rate=0.0, rate_429=0.0,
+                 quota_rpm=0, retry_after=2.0, seed=None, batch_seconds=5.0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.quota_rpm = quota_rpm
+        self.retry_after = retry_after
+        self.batch_seconds = batch_seconds
+        self.stats = {'calls': 0, 'images': 0, 'errors_503': 0, 'errors_429': 0, 'batch_jobs': 0}
+        self._random = random.Random(seed)
+        self._recent = deque()   # instantes de las ultimas llamadas aceptadas (cuota)
+        self._lock = threading.Lock()
+        self.batches = FakeBatches(self)
+
+    @property
+    def models(self):
+        return self
+
+    def generate_content(self, model, contents, config=None):
+        contents = contents if isinstance(contents, list) else [contents]
+        images = [c for c in contents if getattr(c, 'inline_data', None)]
+        n = len(images)
+        with self._lock:
+            self.stats['calls'] += 1
+            roll = self._random.random()
+            wait_quota = None if roll < self.rate_429 else self._take_quota()
+            delay = self.latency_ms / 1000.0 * (1 + 0.3 * max(n - 1, 0))
+            if self.latency_sigma:
+                delay *= math.exp(self._random.gauss(0, self.latency_sigma))
+        if wait_quota is not None or roll < self.rate_429:
+            time.sleep(min(delay, 0.05))
+            with self._lock:
+                self.stats['errors_429'] += 1
+            raise self._error(429, 'RESOURCE_EXHAUSTED', wait_quota or self.retry_after)
+        time.sleep(delay)
+        if roll < self.rate_429 + self.error_rate:
+            with self._lock:
+                self.stats['errors_503'] += 1
+            raise self._error(503, 'UNAVAILABLE')
+        return FakeResponse(*self._respond(contents))
+
+    def _respond(self, contents):
+        """(texto JSON, uso) para contents: str o Part de texto y de imagen."""
+        images = [c for c in contents if getattr(c, 'inline_data', None)]
+        texts = [c if isinstance(c, str) else getattr(c, 'text', None) or '' for c in contents
+                 if not getattr(c, 'inline_data', None)]
+        n = len(images)
+        with self._lock:
+            self.stats['images'] += n
+        prompt_chars = sum(len(t) for t in texts)
+        # sin imagen (pagina de solo texto): el producto sale del texto
+        seeds = [c.inline_data.data for c in images] or [''.join(texts).encode()]
+        objs = [self._product(data) for data in seeds]
+        if n > 1:
+            for i, obj in enumerate(objs, 1):
+                obj['image'] = i
+            text = json.dumps(objs)
+        else:
+            text = json.dumps(objs[0])
+        return text, FakeUsage(prompt_chars // 4 + 258 * n, 120 * len(objs))
+
+    def _take_quota(self):
+        """Segundos hasta el proximo cupo si se paso la cuota; None si hay cupo."""
+        if not self.quota_rpm:
+            return None
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 60:
+            self._recent.popleft()
+        if len(self._recent) >= self.quota_rpm:
+            return 60 - (now - self._recent[0])
+        self._recent.append(now)
+        return None
+
+    def _error(self, code, status, retry_after=None):
+        """Igual que los errores de google-genai (codigo, RetryInfo, cabecera)."""
+        body = {'error': {'code': code, 'status': status, 'message': f'{status} (fake)', 'details': []}}
+        headers = {}
+        if retry_after is not None:
+            body['error']['details'].append({'@type': 'type.googleapis.com/google.rpc.RetryInfo',
+                                             'retryDelay': f'{retry_after:.1f}s'})
+            headers['retry-after'] = f'{retry_after:.1f}'
+        response = httpx.Response(code, headers=headers, json=body)
+        cls = errors.ClientError if code < 500 else errors.ServerError
+        return cls(code, body, response)
+
+    @staticmethod
+    def _product(data):
+        """Producto estable para los mismos bytes (la misma imagen, la misma respuesta)."""
+        digest = hashlib.sha256(data).digest()
+        title, tags = _PRODUCTS[digest[0] % len(_PRODUCTS)]
+        unit = 10 + digest[1] % 30
+        bulk = max(unit - 5, 5)
+        description = (f"GENTE LLEGARON LOS {title.upper()} AL MEJOR PRECIO <3\n\n"
+                       f":) 1 unidad x {unit} soles\n:D 3 unidades a mas x {bulk} soles ({bulk * 3} soles)\n\n"
+                       "SOMOS LK <3\nContacto: 995665397 WhatsApp")
+        return {'title': title, 'price': bulk, 'description': description, 'tags': list(tags)}
+
+
+class FakeBatches:
+    """client.batches del doble: create / get / cancel como los de google-genai."""
+
+    TERMINAL = ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED')
+
+    def __init__(self, client):
+        self.client = client
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, model, src, config=None):
+        name = f'batches/fake-{uuid.uuid4().hex[:12]}'
+        requests = [r if isinstance(r, types.InlinedRequest) else types.InlinedRequest.model_validate(r)
+                    for r in src]
+        with self._lock:
+            self._jobs[name] = {'model': model, 'requests': requests, 'created': time.monotonic(),
+                                'state': 'JOB_STATE_PENDING', 'responses': None}
+        with self.client._lock:
+            self.client.stats['batch_jobs'] += 1
+        return self.get(name)
+
+    def get(self, name, config=None):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                raise self.client._error(404, 'NOT_FOUND')
+            if job['state'] not in self.TERMINAL:
+                if time.monotonic() - job['created'] >= self.client.batch_seconds:
+                    job['responses'] = [self._run(r) for r in job['requests']]
+                    job['state'] = 'JOB_STATE_SUCCEEDED'
+                else:
+                    job['state'] = 'JOB_STATE_RUNNING'
+            dest = (types.BatchJobDestination(inlined_responses=job['responses'])
+                    if job['responses'] is not None else None)
+            return types.BatchJob(name=name, model=job['model'], state=types.JobState(job['state']), dest=dest)
+
+    def cancel(self, name, config=None):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                raise self.client._error(404, 'NOT_FOUND')
+            if job['state'] not in self.TERMINAL:
+                job['state'] = 'JOB_STATE_CANCELLED'
+
+    def _run(self, request):
+        """Una peticion del job: respuesta con su metadata o error (error_rate)."""
+        with self.client._lock:
+            failed = self.client._random.random() < self.client.error_rate
+        if failed:
+            return types.InlinedResponse(metadata=request.metadata,
+                                         error=types.JobError(code=503, message='UNAVAILABLE (fake)'))
+        parts = [p for content in request.contents for p in content.parts]
+        text, usage = self.client._respond(parts)
+        response = types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role='model', parts=[types.Part(text=text)]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=usage.prompt_token_count, candidates_token_count=usage.candidates_token_count))
+        return types.InlinedResponse(metadata=request.metadata, response=response)
@@ -0,0 +1,155 @@
+"""
+Analysis Store Module
+Almacen persistente de analisis IA (sqlite3 en modo WAL).
+
+Reemplaza ai_analysis_cache.json, que se reescribia entero (indent=2) tras
+cada analisis y crecia sin limite. Aqui:
+  - cada escritura es un INSERT de una fila (no reescribe nada)
+  - al arrancar no se carga nada en memoria: cada consulta va a la base
+  - eviccion por antiguedad (ttl_days) y por tamano (max_entries, LRU)
+  - WAL + busy_timeout: la GUI, el backend web y varios procesos de trabajo
+    pueden leer y escribir a la vez sobre el mismo archivo
+
+Las claves son las de analysis_cache_key (hash de la imagen + prompt + modelo)
+y los valores el dict de producto que devuelve AIImageAnalyzer.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class AnalysisStore:
+    """Cache clave -> info de producto con interfaz tipo dict (thread-safe)."""
+
+    # Una consulta acertada solo re-escribe last_used si tiene mas de esto:
+    # el orden LRU no necesita precision de segundos y asi leer casi no escribe
+    TOUCH_SECONDS = 3600
+    # Cada cuantas inserciones se revisan los limites
+    EVICT_EVERY = 100
+
+    def __init__(self, db_path='ai_analysis.db', max_entries=20000, ttl_days=90):
+        self.db_path = str(db_path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self._local = threading.local()
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+        folder = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analyses (
+                key       TEXT PRIMARY KEY,
+                info      TEXT NOT NULL,
+                created   REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses(last_used)")
+        self.evict()
+
+    # ---------- conexion ----------
+    def _conn(self):
+        """Una conexion por hilo (sqlite3 no comparte conexiones entre hilos)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Cierra la conexion del hilo actual."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---------- API tipo dict ----------
+    def get(self, key, default=None):
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT info, created, last_used FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        info, created, last_used = row
+        if self.ttl_seconds and created < now - self.ttl_seconds:
+            self._conn().execute("DELETE FROM analyses WHERE key = ?", (key,))
+            return default
+        if last_used < now - self.TOUCH_SECONDS:
+            self._conn().execute("UPDATE analyses SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(info)
+
+    def put(self, key, info):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO analyses (key, info, created, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(info, ensure_ascii=False), now, now))
+        with self._puts_lock:
+            self._puts += 1
+            due = self._puts % self.EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def __getitem__(self, key):
+        info = self.get(key)
+        if info is None:
+            raise KeyError(key)
+        return info
+
+    def __setitem__(self, key, info):
+        self.put(key, info)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __delitem__(self, key):
+        self._conn().execute("DELETE FROM analyses WHERE key = ?", (key,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    # ---------- mantenimiento ----------
+    def evict(self):
+        """Borra lo vencido (ttl) y, si sobran filas, las menos usadas."""
+        conn = self._conn()
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM analyses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        if self.max_entries:
+            extra = len(self) - self.max_entries
+            if extra > 0:
+                conn.execute(
+                    "DELETE FROM analyses WHERE key IN "
+                    "(SELECT key FROM analyses ORDER BY last_used LIMIT ?)", (extra,))
+
+    def import_json(self, json_path):
+        """
+        Migra un ai_analysis_cache.json antiguo (una sola vez: el archivo se
+        renombra a .migrated). Solo se conservan las claves por contenido; las
+        de nombre de archivo ya no acertaban. Devuelve cuantas se importaron.
+        """
+        json_path = str(json_path)
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                old = json.load(f)
+        except Exception:
+            old = {}
+        now = time.time()
+        rows = [(k, json.dumps(v, ensure_ascii=False), now, now)
+                for k, v in old.items() if isinstance(v, dict) and k.count(':') >= 2]
+        conn = self._conn()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR IGNORE INTO analyses (key, info, created, last_used) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        os.replace(json_path, json_path + '.migrated')
+        self.evict()
+        return len(rows)
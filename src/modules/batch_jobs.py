@@ -0,0 +1,408 @@
+"""
+Batch Jobs Module
+Analisis de catalogos completos con la Batch API de Gemini.
+
+Para preparar catalogos de noche no importa la latencia sino el costo y el
+throughput: un Batch job cuesta la mitad por token que las llamadas
+interactivas, no gasta la cuota por minuto y Gemini lo resuelve en horas
+(hasta 24 h). BatchJobRunner:
+
+  - arma una corrida con las imagenes del catalogo; las que ya estan en el
+    cache de analisis se omiten. Va en un solo job mientras las peticiones
+    quepan en el limite de peticiones en linea (inline_mb), si no en varios
+  - guarda el estado de cada corrida en <state_dir>/<id>.json despues de
+    cada paso: tras un reinicio resume() vuelve a consultar los jobs ya
+    enviados y envia los que faltaban (preparados con el mismo prepare)
+  - la CLI (web/backend/batch_catalog.py) y el backend comparten la carpeta
+    y ven las corridas del otro. Enviar, consultar o cancelar una corrida
+    toma antes <state_dir>/<id>.lock (ver file_lock.py), asi dos procesos
+    nunca envian las mismas imagenes en dos jobs pagados
+  - al terminar cada job escribe los resultados en el cache (AnalysisStore)
+    con la misma clave que /api/analyze: el dashboard y la GUI los
+    encuentran sin llamar a la IA
+
+Estados de una corrida: pending (creada, sin enviar) -> running -> done |
+cancelled. Cada imagen: pending, submitted, done, failed o cached.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from contextlib import contextmanager
+
+from modules.file_lock import file_lock
+
+# Estados de un job que ya no cambian (ver AIImageAnalyzer.batch_job)
+TERMINAL = ('SUCCEEDED', 'PARTIALLY_SUCCEEDED', 'FAILED', 'CANCELLED', 'EXPIRED')
+
+
+class BatchJobRunner:
+    """
+    Corridas de Batch jobs resumibles sobre un AIImageAnalyzer.
+
+    Args:
+        analyzer: AIImageAnalyzer (su client debe tener .batches)
+        cache: AnalysisStore (o cualquier objeto con get/put) donde quedan
+            los resultados
+        state_dir (str): carpeta de los <id>.json de las corridas
+        inline_mb (float): tope de cada job con peticiones en linea (la
+            Batch API acepta hasta 20 MB)
+        poll_seconds (float): cada cuanto consulta watch()
+        prepare (callable): ruta -> ruta a enviar (p.ej. la alta resolucion
+            de una pagina), para los submit sin prepare propio; resume() y
+            watch() lo usan para no enviar las vistas previas
+    """
+
+    def __init__(self, analyzer, cache, state_dir='batch_jobs', inline_mb=18, poll_seconds=30, prepare=None):
+        self.analyzer = analyzer
+        self.cache = cache
+        self.state_dir = str(state_dir)
+        self.inline_bytes = int(inline_mb * 1024 * 1024)
+        self.poll_seconds = poll_seconds
+        self.prepare = prepare
+        self._runs = {}
+        self._mtimes = {}        # archivo -> mtime leido
+        self._lock = threading.Lock()
+        self._busy = {}          # id -> Lock: un envio / consulta a la vez por corrida
+        self._watcher = None
+        os.makedirs(self.state_dir, exist_ok=True)
+        self._load()
+
+    # ---------- estado ----------
+    def _load(self):
+        """Lee de state_dir las corridas nuevas o que otro proceso actualizo
+        (las que este esta enviando o consultando no se pisan)."""
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if self._mtimes.get(name) == mtime:
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    run = json.load(f)
+                run_id = run['id']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Corrida de lote ilegible {name}: {e}")
+                continue
+            with self._lock:
+                self._mtimes[name] = mtime
+                mine = self._runs.get(run_id)
+                busy = self._busy.get(run_id)
+                if mine is None or (run['updated'] > mine['updated'] and not (busy and busy.locked())):
+                    self._runs[run_id] = run
+
+    def _save(self, run):
+        """Escritura atomica del estado (un corte a mitad no deja un JSON roto)."""
+        run['updated'] = time.time()
+        path = os.path.join(self.state_dir, f"{run['id']}.json")
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(run, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._mtimes[os.path.basename(path)] = os.path.getmtime(path)
+
+    def _busy_lock(self, run_id):
+        with self._lock:
+            return self._busy.setdefault(run_id, threading.Lock())
+
+    @contextmanager
+    def _claim(self, run_id, blocking=False):
+        """
+        Toma la corrida (entre hilos y entre procesos) y la relee del disco:
+        lo que otro proceso ya envio no se vuelve a enviar. Entrega None si
+        otro proceso la tiene y blocking es False.
+        """
+        with self._busy_lock(run_id), \
+                file_lock(os.path.join(self.state_dir, f"{run_id}.lock"), blocking) as mine:
+            yield self._reload(run_id) if mine else None
+
+    def _reload(self, run_id):
+        """La corrida segun el disco (si es mas reciente que la de memoria)."""
+        name = f"{run_id}.json"
+        path = os.path.join(self.state_dir, name)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, encoding='utf-8') as f:
+                run = json.load(f)
+        except (OSError, ValueError):
+            run = None
+        with self._lock:
+            mine = self._runs.get(run_id)
+            if run is not None and (mine is None or run['updated'] >= mine['updated']):
+                self._runs[run_id] = run
+                self._mtimes[name] = mtime
+            return self._runs[run_id]
+
+    @staticmethod
+    def progress(run):
+        """Resumen de una corrida (sin la lista de imagenes)."""
+        counts = {s: 0 for s in ('pending', 'submitted', 'done', 'failed', 'cached')}
+        for item in run['items']:
+            counts[item['status']] += 1
+        return {'id': run['id'], 'name': run['name'], 'model': run['model'], 'status': run['status'],
+                'total': len(run['items']), **counts,
+                'jobs': [{'name': j['name'], 'state': j['state'], 'images': len(j['items'])} for j in run['jobs']],
+                'prompt_tokens': run['prompt_tokens'], 'output_tokens': run['output_tokens'],
+                'created': run['created'], 'updated': run['updated']}
+
+    def get(self, run_id):
+        self._load()
+        with self._lock:
+            run = self._runs.get(run_id)
+            return self.progress(run) if run else None
+
+    def runs(self):
+        """Todas las corridas, la mas reciente primero."""
+        self._load()
+        with self._lock:
+            runs = sorted(self._runs.values(), key=lambda r: r['created'], reverse=True)
+            return [self.progress(r) for r in runs]
+
+    def errors(self, run_id):
+        """{ruta: error} de las imagenes que fallaron."""
+        with self._lock:
+            run = self._runs.get(run_id)
+            return {i['path']: i['error'] for i in run['items'] if i['status'] == 'failed'} if run else {}
+
+    def pending_paths(self):
+        """Rutas de las imagenes aun sin enviar de las corridas abiertas (el
+        backend no borra sus workspaces al arrancar)."""
+        self._load()
+        with self._lock:
+            return [i['path'] for r in self._runs.values() if r['status'] in ('pending', 'running')
+                    for i in r['items'] if i['status'] == 'pending']
+
+    # ---------- crear / enviar ----------
+    def create(self, items, hints=None, name=None, account=None, files_dir=None, keys=None):
+        """
+        Registra una corrida sin enviar nada (ver submit).
+
+        Args:
+            items (list): rutas de las imagenes del catalogo
+            hints (callable): ruta -> pistas de la capa de texto o None
+            name (str): nombre visible (default: el id)
+            account (str): a quien se anotan los tokens en las metricas
+            files_dir (str): carpeta propia de las imagenes (p.ej. las
+                paginas que extrajo la CLI); se borra cuando ya se enviaron
+            keys (callable): ruta -> clave de cache, si no es la de la propia
+                imagen (p.ej. la de su vista previa, como en /api/analyze)
+        """
+        run_id = uuid.uuid4().hex[:12]
+        entries = []
+        for path in items:
+            key = keys(path) if keys else self.analyzer.cache_key(path)
+            cached = self.cache.get(key) is not None
+            entries.append({'path': str(path), 'key': key, 'hints': hints(path) if hints else None,
+                            'status': 'cached' if cached else 'pending', 'job': None, 'error': None})
+        now = time.time()
+        run = {'id': run_id, 'name': name or run_id, 'model': self.analyzer.model, 'account': account,
+               'files_dir': str(files_dir) if files_dir else None,
+               'status': 'pending', 'items': entries, 'jobs': [], 'prompt_tokens': 0, 'output_tokens': 0,
+               'created': now, 'updated': now}
+        with self._lock:
+            self._runs[run_id] = run
+            self._save(run)
+        return self.progress(run)
+
+    def submit(self, run_id, prepare=None):
+        """
+        Envia las imagenes pendientes de la corrida en uno o mas jobs (se
+        guarda el estado tras cada uno). prepare: ruta -> ruta a enviar (p.ej.
+        la alta resolucion de una pagina; default: self.prepare); las de solo
+        texto no se preparan. Una imagen que ya no existe queda 'failed'. Si
+        otro proceso la esta enviando o consultando no se hace nada.
+        """
+        prepare = prepare or self.prepare
+        with self._claim(run_id) as run:
+            with self._lock:
+                if run is None or run['status'] == 'cancelled':
+                    return self.progress(self._runs[run_id])
+                pending = [i for i, item in enumerate(run['items']) if item['status'] == 'pending']
+            chunk, requests, size = [], [], 0
+            for pos in pending + [None]:
+                if pos is not None:
+                    item = run['items'][pos]
+                    try:
+                        path = item['path']
+                        if prepare and not self.analyzer.text_only(item['hints']):
+                            path = prepare(path)
+                        request = self.analyzer.batch_request(path, item['hints'], {'key': item['key']})
+                    except Exception as e:
+                        with self._lock:
+                            item.update(status='failed', error=f"no se pudo preparar: {e}")
+                        continue
+                    weight = sum(len(p.inline_data.data) for c in request.contents for p in c.parts
+                                 if p.inline_data) + 4096
+                    if chunk and size + weight > self.inline_bytes:
+                        self._send(run, chunk, requests)
+                        chunk, requests, size = [], [], 0
+                    chunk.append(pos)
+                    requests.append(request)
+                    size += weight
+                elif chunk:
+                    self._send(run, chunk, requests)
+            with self._lock:
+                if run['status'] == 'pending':
+                    run['status'] = 'running'
+                self._finish_if_done(run)
+                if run['files_dir']:
+                    shutil.rmtree(run['files_dir'], ignore_errors=True)
+                    run['files_dir'] = None
+                self._save(run)
+                return self.progress(run)
+
+    def _send(self, run, chunk, requests):
+        label = f"{run['name']} ({len(run['jobs']) + 1})"
+        job_name = self.analyzer.submit_batch_job(requests, display_name=label)
+        with self._lock:
+            run['jobs'].append({'name': job_name, 'state': 'PENDING', 'items': chunk})
+            for pos in chunk:
+                run['items'][pos].update(status='submitted', job=len(run['jobs']) - 1)
+            run['status'] = 'running'
+            self._save(run)
+
+    def start(self, items, hints=None, prepare=None, name=None, account=None, files_dir=None, keys=None):
+        """create + submit."""
+        run = self.create(items, hints, name, account, files_dir, keys)
+        return self.submit(run['id'], prepare)
+
+    # ---------- consultar ----------
+    def poll(self, run_id):
+        """Consulta los jobs sin terminar; los que terminaron escriben sus
+        resultados en el cache. Devuelve el progreso (sin consultar si otro
+        proceso la tiene tomada)."""
+        with self._claim(run_id) as run:
+            with self._lock:
+                if run is None:
+                    return self.progress(self._runs[run_id])
+                jobs = [j for j in run['jobs'] if j['state'] not in TERMINAL]
+            for job in jobs:
+                try:
+                    state, responses = self.analyzer.batch_job(job['name'])
+                except Exception as e:
+                    print(f"No se pudo consultar el job {job['name']}: {e}")
+                    continue
+                if state in ('SUCCEEDED', 'PARTIALLY_SUCCEEDED') and responses is not None:
+                    self._harvest(run, job, responses)
+                elif state in TERMINAL:
+                    with self._lock:
+                        for pos in job['items']:
+                            run['items'][pos].update(status='failed', error=f"job {state}")
+                with self._lock:
+                    job['state'] = state
+                    self._save(run)
+            with self._lock:
+                self._finish_if_done(run)
+                self._save(run)
+                return self.progress(run)
+
+    def _harvest(self, run, job, responses):
+        """Resultados de un job terminado -> cache (y metricas)."""
+        items = [run['items'][pos] for pos in job['items']]
+        by_key = {item['key']: item for item in items}
+        for n, response in enumerate(responses):
+            # la metadata trae la clave; si la API no la devuelve, el orden
+            key = (response.metadata or {}).get('key')
+            item = by_key.get(key) if key else (items[n] if n < len(items) else None)
+            if item is None or item['status'] != 'submitted':
+                continue
+            try:
+                info, prompt_tokens, output_tokens = self.analyzer.batch_result(response, item['hints'])
+                self.cache.put(item['key'], info)
+            except Exception as e:
+                with self._lock:
+                    item.update(status='failed', error=str(e)[:200])
+                continue
+            with self._lock:
+                item['status'] = 'done'
+                run['prompt_tokens'] += prompt_tokens
+                run['output_tokens'] += output_tokens
+            self._record(run, prompt_tokens, output_tokens)
+        with self._lock:
+            for item in items:
+                if item['status'] == 'submitted':
+                    item.update(status='failed', error='sin respuesta en el job')
+
+    def _record(self, run, prompt_tokens, output_tokens):
+        """Fila 'batch' para el sink de metricas del analizador (ver metrics_store.py)."""
+        if self.analyzer.metrics is None:
+            return
+        try:
+            self.analyzer.metrics({'kind': 'batch', 'model': run['model'], 'account': run['account'],
+                                   'images': 1, 'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens})
+        except Exception as e:
+            print(f"No se pudo registrar la metrica: {e}")
+
+    @staticmethod
+    def _finish_if_done(run):
+        if run['status'] == 'running' and all(i['status'] not in ('pending', 'submitted') for i in run['items']):
+            run['status'] = 'done'
+
+    # ---------- control ----------
+    def cancel(self, run_id):
+        """Cancela los jobs sin terminar; lo pendiente queda 'failed'. Si otro
+        proceso la esta enviando, espera a que termine."""
+        with self._claim(run_id, blocking=True) as run:
+            with self._lock:
+                jobs = [j for j in run['jobs'] if j['state'] not in TERMINAL]
+            for job in jobs:
+                try:
+                    self.analyzer.cancel_batch_job(job['name'])
+                except Exception as e:
+                    print(f"No se pudo cancelar el job {job['name']}: {e}")
+            with self._lock:
+                for item in run['items']:
+                    if item['status'] in ('pending', 'submitted'):
+                        item.update(status='failed', error='cancelado')
+                for job in jobs:
+                    job['state'] = 'CANCELLED'
+                run['status'] = 'cancelled'
+                self._save(run)
+                return self.progress(run)
+
+    def resume(self, accept=None):
+        """Retoma las corridas sin terminar (tras un reinicio): envia lo que
+        faltaba y consulta los jobs. accept(corrida) -> bool: las que este
+        proceso puede retomar (default: todas). Devuelve su progreso."""
+        self._load()
+        with self._lock:
+            open_runs = [r['id'] for r in self._runs.values() if r['status'] in ('pending', 'running')
+                         and (accept is None or accept(r))]
+        out = []
+        for run_id in open_runs:
+            try:
+                with self._lock:
+                    unsent = any(i['status'] == 'pending' for i in self._runs[run_id]['items'])
+                if unsent:
+                    self.submit(run_id)
+                out.append(self.poll(run_id))
+            except Exception as e:
+                print(f"No se pudo retomar la corrida {run_id}: {e}")
+        return out
+
+    def wait(self, run_id, poll_seconds=None, on_progress=None):
+        """Consulta hasta que la corrida termine (CLI). on_progress(progreso)."""
+        while True:
+            progress = self.poll(run_id)
+            if on_progress:
+                on_progress(progress)
+            if progress['status'] not in ('pending', 'running'):
+                return progress
+            time.sleep(poll_seconds or self.poll_seconds)
+
+    def watch(self):
+        """Hilo de fondo que llama a resume() cada poll_seconds (backend)."""
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            self.resume()
+            time.sleep(self.poll_seconds)
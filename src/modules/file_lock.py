@@ -0,0 +1,67 @@
+"""
+File Lock Module
+Lock exclusivo entre procesos sobre un archivo (fcntl en Linux/macOS, msvcrt
+en Windows).
+
+La GUI, el backend web y la CLI de Batch jobs comparten carpetas (cache de
+render, corridas de Batch jobs) y un threading.Lock solo ordena los hilos de
+un proceso. El lock es del archivo abierto, asi que tambien ordena hilos del
+mismo proceso, y el sistema operativo lo suelta si el proceso muere: no
+quedan locks huerfanos.
+"""
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:          # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    Toma el lock de `path` (se crea si no existe) mientras dura el bloque.
+
+    Args:
+        path (str): archivo de lock
+        blocking (bool): False -> no espera si otro lo tiene
+
+    Yields:
+        bool: True si se tomo el lock (siempre True con blocking)
+    """
+    with open(path, 'a+b') as f:
+        if not _acquire(f, blocking):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            _release(f)
+
+
+def _acquire(f, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def _release(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
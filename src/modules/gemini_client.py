@@ -0,0 +1,250 @@
+"""
+Gemini Client Module
+Capa alrededor de client.models.generate_content que respeta la cuota.
+
+  - TokenBucket compartido por proceso y modelo (la cuota de Gemini es por
+    proyecto y modelo): todos los analizadores e hilos de un proceso sacan de
+    la misma cubeta, asi un lote llena la cuota sin pasarse.
+  - Errores reintentables (429, 5xx, fallos de red): backoff exponencial con
+    jitter; si Gemini indica cuanto esperar (cabecera Retry-After o RetryInfo
+    en el cuerpo del 429) se respeta, y la cubeta se pausa para TODOS los
+    hilos, no solo para el que recibio el 429.
+  - Errores permanentes (400, 401, 403, 404...): GeminiError con el codigo y
+    el mensaje de Gemini, sin reintentar.
+  - CircuitBreaker compartido por proceso y modelo: tras varios fallos de
+    disponibilidad seguidos (5xx, timeouts, red) las llamadas fallan al
+    instante con CircuitOpenError en vez de esperar cada una sus reintentos;
+    pasado reset_seconds una sola llamada de prueba decide si se reabre.
+"""
+import time
+import random
+import threading
+
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiError(RuntimeError):
+    """Fallo de Gemini que no se resuelve reintentando (o tras agotar reintentos)."""
+
+    def __init__(self, message, code=None, retryable=False):
+        super().__init__(message)
+        self.code = code
+        self.retryable = retryable
+
+
+class CircuitOpenError(GeminiError):
+    """El circuito esta abierto: Gemini fallo hace poco y no se llama."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Gemini no disponible (circuito abierto, reintenta en {retry_in:.0f}s)",
+                         retryable=True)
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold fallos seguidos) -> open -> (reset_seconds)
+    -> half_open: pasa UNA llamada de prueba; si va bien closed, si no open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Lanza CircuitOpenError si no se debe llamar ahora."""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(max(remaining, 0.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """La llamada de prueba termino sin decir nada de la salud (p.ej. un 400)."""
+        with self._lock:
+            self._probing = False
+
+
+class TokenBucket:
+    """Limitador de peticiones por minuto (thread-safe, bloqueante)."""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya una peticion disponible. Devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Nadie saca peticiones durante `seconds` (tras un 429 con Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+_buckets = {}
+_breakers = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(model, rate_per_minute):
+    """Cubeta del proceso para `model` (se crea al primer uso)."""
+    with _buckets_lock:
+        bucket = _buckets.get(model)
+        if bucket is None or bucket.rate != rate_per_minute / 60.0:
+            bucket = _buckets[model] = TokenBucket(rate_per_minute)
+        return bucket
+
+
+def shared_breaker(model):
+    """CircuitBreaker del proceso para `model`."""
+    with _buckets_lock:
+        return _breakers.setdefault(model, CircuitBreaker())
+
+
+def _parse_seconds(value):
+    """'37s', '1.5', '37' -> float; None si no se entiende."""
+    try:
+        return float(str(value).strip().rstrip('s'))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(error):
+    """Segundos que Gemini pide esperar: cabecera Retry-After o RetryInfo.retryDelay."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        seconds = _parse_seconds(headers.get('retry-after'))
+        if seconds is not None:
+            return seconds
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        details = details.get('error', details).get('details', [])
+    for item in details or []:
+        if isinstance(item, dict) and str(item.get('@type', '')).endswith('RetryInfo'):
+            return _parse_seconds(item.get('retryDelay'))
+    return None
+
+
+def classify(error):
+    """(reintentable, codigo) de una excepcion lanzada por generate_content."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES, code
+    # Sin codigo HTTP: errores de red / timeouts (httpx, sockets) -> reintentar
+    retryable = isinstance(error, (ConnectionError, TimeoutError)) or \
+        type(error).__module__.startswith(('httpx', 'httpcore'))
+    return retryable, None
+
+
+class GeminiClient:
+    """generate_content con limite de peticiones por minuto y reintentos."""
+
+    def __init__(self, client, model, requests_per_minute=10, max_retries=4,
+                 base_delay=1.0, max_delay=60.0, breaker=None):
+        self.client = client
+        self.model = model
+        # 0 = sin limitador (cuota de pago alta, o pruebas)
+        self.bucket = shared_bucket(model, requests_per_minute) if requests_per_minute else None
+        self.breaker = breaker or shared_breaker(model)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def generate_content(self, contents, config=None):
+        """
+        Como client.models.generate_content(model=self.model, ...).
+
+        Raises:
+            CircuitOpenError: Gemini esta fallando; no se llega a llamar
+            GeminiError: error permanente, o reintentable tras agotar max_retries
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            if self.bucket is not None:
+                waited = self.bucket.acquire()
+                if waited:
+                    with self._stats_lock:
+                        self.throttled_seconds += waited
+            try:
+                response = self.client.models.generate_content(
+                    model=self.model, contents=contents, config=config)
+            except Exception as e:
+                retryable, code = classify(e)
+                if retryable and code != 429:
+                    # 429 es cuota (lo resuelve la cubeta), no un Gemini caido
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_probe()
+                if not retryable:
+                    raise GeminiError(f"Gemini rechazo la peticion ({code or type(e).__name__}): {e}",
+                                      code) from e
+                if attempt >= self.max_retries:
+                    raise GeminiError(f"Gemini no disponible tras {attempt + 1} intentos: {e}",
+                                      code, retryable=True) from e
+                delay = self._backoff(attempt)
+                hint = retry_after(e)
+                if hint is not None:
+                    delay = max(delay, hint)
+                    if self.bucket is not None:
+                        self.bucket.pause(hint)
+                attempt += 1
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return response
+
+    def _backoff(self, attempt):
+        """Exponencial con jitter: entre la mitad y el total de base * 2^attempt."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,121 @@
+"""
+Image Encoder Module
+Politica de formato de salida para paginas renderizadas y fotos subidas.
+
+Antes todo se guardaba como PNG sin compresion: rapido, pero un catalogo
+dejaba cientos de MB en temp_images que luego viajan al navegador, al agente
+y a Facebook. Politicas:
+  - 'png'  : PNG sin compresion (comportamiento historico, el mas rapido)
+  - 'jpeg' : JPEG con calidad `quality`
+  - 'webp' : WebP con calidad `quality`
+  - 'auto' : JPEG para fotos; PNG (sin perdida) solo si hace falta: imagenes
+             con transparencia o de pocos colores (texto, graficos planos)
+
+Cada guardado devuelve sus estadisticas (bytes escritos, bytes "crudos"
+equivalentes al PNG sin compresion y tiempo de codificacion) para poder
+ajustar disco, ancho de banda y latencia de subida.
+"""
+import os
+import time
+import threading
+
+POLICIES = ('png', 'jpeg', 'webp', 'auto')
+EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+
+# Menos colores distintos que esto (en una miniatura) = grafico/texto -> PNG
+_FLAT_MAX_COLORS = 64
+
+
+def _has_alpha(image):
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        return image.getextrema()[-1][0] < 255
+    return image.mode == 'P' and 'transparency' in image.info
+
+
+def choose_format(image, policy='auto'):
+    """Formato concreto ('png' | 'jpeg' | 'webp') para una imagen segun la politica."""
+    if policy != 'auto':
+        return policy
+    if _has_alpha(image):
+        return 'png'
+    probe = image.copy()
+    probe.thumbnail((128, 128))
+    if probe.convert('RGB').getcolors(_FLAT_MAX_COLORS) is not None:
+        return 'png'
+    return 'jpeg'
+
+
+def encode_image(image, base_path, policy='png', quality=85):
+    """
+    Save `image` as base_path + extension according to the policy.
+
+    Se borra el archivo previo en lugar de sobrescribirlo: puede ser un hardlink
+    al cache de render y truncarlo corromperia la copia cacheada.
+
+    Returns:
+        tuple: (path, stats) con stats = {format, bytes, raw_bytes, seconds}
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Formato de imagen no soportado: {policy} (usa {', '.join(POLICIES)})")
+    start = time.perf_counter()
+    fmt = choose_format(image, policy)
+    path = base_path + EXTENSIONS[fmt]
+    if os.path.exists(path):
+        os.remove(path)
+    if fmt == 'png':
+        # 'png' explicito = guardado ultra rapido; en 'auto' el PNG es el caso
+        # sin perdida para graficos, donde comprimir si compensa
+        image.save(path, 'PNG', optimize=False, compress_level=0 if policy == 'png' else 6)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if fmt == 'jpeg':
+            image.save(path, 'JPEG', quality=quality)
+        else:
+            image.save(path, 'WEBP', quality=quality, method=4)
+    width, height = image.size
+    return path, {
+        'format': fmt,
+        'bytes': os.path.getsize(path),
+        'raw_bytes': width * height * len(image.getbands()),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+class EncodeStats:
+    """Acumulador thread-safe de las estadisticas de encode_image."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.images = 0
+        self.bytes_written = 0
+        self.raw_bytes = 0
+        self.seconds = 0.0
+        self.formats = {}
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def add(self, stats):
+        if not stats:
+            return
+        with self._lock:
+            self.images += 1
+            self.bytes_written += stats['bytes']
+            self.raw_bytes += stats['raw_bytes']
+            self.seconds += stats['seconds']
+            self.formats[stats['format']] = self.formats.get(stats['format'], 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'bytes_written': self.bytes_written,
+                'bytes_saved': max(0, self.raw_bytes - self.bytes_written),
+                'encode_seconds': round(self.seconds, 3),
+                'formats': dict(self.formats),
+            }
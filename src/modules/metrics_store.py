@@ -0,0 +1,186 @@
+"""
+Metrics Store Module
+Registro de cada llamada a la IA (sqlite3 en modo WAL) y sus agregados.
+
+Por cada llamada a Gemini se guarda una fila con el modelo, el tiempo de
+pared (incluye reintentos y esperas de cuota), los tokens de usage_metadata,
+los bytes de imagen enviados y el error si fallo; los aciertos del cache de
+analisis y los analisis compartidos (single flight) tambien quedan
+registrados, sin tokens.
+
+Cada resultado de un Batch job tiene su propia fila (kind 'batch', a mitad de
+precio y sin latencia propia; ver batch_jobs.py).
+
+Con eso summary() responde cuanto cuesta cada catalogo, el p95 de latencia
+por modelo o el efecto de cambiar MAX_IMAGE_SIZE, por dia, por cuenta (IP) o
+por modelo.
+
+La cuenta sale de la variable de contexto `account`: el backend la fija al
+empezar cada peticion y viaja a los hilos del analizador (asyncio.to_thread
+y los lotes copian el contexto).
+"""
+import os
+import math
+import time
+import sqlite3
+import datetime
+import threading
+import contextvars
+
+# Quien pide el analisis (IP del dashboard, 'gui', ...); lo fija el llamador
+account = contextvars.ContextVar('metrics_account', default=None)
+
+# USD por millon de tokens (entrada, salida) segun la lista publica de
+# Gemini; solo para estimar, los modelos desconocidos cuentan 0
+PRICES_PER_MILLION = {
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-flash-lite': (0.10, 0.40),
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-2.0-flash': (0.10, 0.40),
+}
+# La Batch API cobra la mitad por token
+BATCH_DISCOUNT = 0.5
+
+GROUPS = {'day': 'day', 'account': 'account', 'model': 'model'}
+
+
+def cost_usd(model, prompt_tokens, output_tokens):
+    """Costo estimado de una llamada."""
+    price_in, price_out = PRICES_PER_MILLION.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+
+def percentile(values, pct):
+    """Percentil por rango mas cercano (values ya ordenados)."""
+    if not values:
+        return None
+    idx = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return round(values[idx], 3)
+
+
+class MetricsStore:
+    """Sink de metricas de la IA: record() por llamada, summary() para leerlas."""
+
+    # Cada cuantas filas se borran las de mas de retention_days
+    PURGE_EVERY = 500
+
+    def __init__(self, db_path='ai_metrics.db', retention_days=90):
+        self.db_path = str(db_path)
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        folder = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS calls (
+                ts            REAL NOT NULL,
+                day           TEXT NOT NULL,
+                kind          TEXT NOT NULL,
+                model         TEXT,
+                account       TEXT,
+                images        INTEGER DEFAULT 0,
+                image_bytes   INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,
+                output_tokens INTEGER DEFAULT 0,
+                seconds       REAL DEFAULT 0,
+                error         TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS calls_ts ON calls(ts)")
+        self.purge()
+
+    # ---------- conexion ----------
+    def _conn(self):
+        """Una conexion por hilo (sqlite3 no comparte conexiones entre hilos)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- escritura ----------
+    def record(self, entry):
+        """
+        Guarda una llamada o un acierto. entry: dict con kind ('call',
+        'batch', 'cache_hit', 'coalesced'), model, images, image_bytes, prompt_tokens,
+        output_tokens, seconds, error; account por defecto el del contexto.
+        """
+        now = entry.get('ts') or time.time()
+        self._conn().execute(
+            "INSERT INTO calls (ts, day, kind, model, account, images, image_bytes, prompt_tokens,"
+            " output_tokens, seconds, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (now, datetime.date.fromtimestamp(now).isoformat(), entry.get('kind', 'call'),
+             entry.get('model'), entry.get('account') or account.get(),
+             entry.get('images', 0), entry.get('image_bytes', 0), entry.get('prompt_tokens', 0),
+             entry.get('output_tokens', 0), entry.get('seconds', 0.0), entry.get('error')))
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.PURGE_EVERY == 0
+        if due:
+            self.purge()
+
+    def hit(self, model, kind='cache_hit', images=1):
+        """Analisis servido sin llamar a la IA (cache o single flight)."""
+        self.record({'kind': kind, 'model': model, 'images': images})
+
+    def purge(self):
+        if self.retention_days:
+            self._conn().execute("DELETE FROM calls WHERE ts < ?",
+                                 (time.time() - self.retention_days * 86400,))
+
+    # ---------- lectura ----------
+    def summary(self, days=7, by='day'):
+        """
+        Agregados de los ultimos `days` dias agrupados por 'day', 'account' o
+        'model': llamadas, errores, imagenes, aciertos de cache, tokens,
+        bytes de imagen, costo estimado y latencia p50/p95 de las llamadas.
+        """
+        column = GROUPS.get(by)
+        if column is None:
+            raise ValueError(f"agrupacion desconocida: {by!r} (usa {', '.join(GROUPS)})")
+        rows = self._conn().execute(
+            f"SELECT {column}, kind, model, images, image_bytes, prompt_tokens, output_tokens, seconds, error"
+            " FROM calls WHERE ts >= ?", (time.time() - days * 86400,)).fetchall()
+        groups = {}
+        for group, kind, model, images, image_bytes, prompt, output, seconds, error in rows:
+            g = groups.setdefault(group, {
+                'calls': 0, 'errors': 0, 'images': 0, 'cache_hits': 0, 'coalesced': 0,
+                'prompt_tokens': 0, 'output_tokens': 0, 'image_bytes': 0, 'cost_usd': 0.0,
+                '_latencies': []})
+            if kind in ('cache_hit', 'coalesced'):
+                g['cache_hits' if kind == 'cache_hit' else 'coalesced'] += images
+                continue
+            g['calls'] += 1
+            g['prompt_tokens'] += prompt
+            g['output_tokens'] += output
+            g['image_bytes'] += image_bytes
+            g['cost_usd'] += cost_usd(model, prompt, output) * (BATCH_DISCOUNT if kind == 'batch' else 1)
+            if error:
+                g['errors'] += 1
+            else:
+                g['images'] += images
+                if kind == 'call':
+                    g['_latencies'].append(seconds)
+        out = []
+        for group in sorted(groups, key=lambda k: (k is None, k)):
+            g = groups[group]
+            latencies = sorted(g.pop('_latencies'))
+            served = g['images'] + g['cache_hits'] + g['coalesced']
+            g.update({
+                by: group,
+                'cost_usd': round(g['cost_usd'], 6),
+                'tokens_per_image': round((g['prompt_tokens'] + g['output_tokens']) / g['images'], 1)
+                if g['images'] else 0,
+                'hit_rate': round((g['cache_hits'] + g['coalesced']) / served, 3) if served else 0,
+                'p50_s': percentile(latencies, 50),
+                'p95_s': percentile(latencies, 95),
+            })
+            out.append(g)
+        return out
@@ -3,9 +3,14 @@ PDF Image Extractor Module
 Extracts images from PDF files for processing (OPTIMIZED FOR SPEED)
 """
 import os
+import time
+import shutil
+import tempfile
+import threading
 from PIL import Image
-import PyPDF2
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.image_encoder import encode_image, EncodeStats
+from modules import price_extractor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import multiprocessing
 
 # Try to import pdf2image (requires poppler)
@@ -18,32 +23,451 @@ except ImportError:
 # Try to import pypdfium2 as fallback
 try:
     import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
     PYPDFIUM2_AVAILABLE = True
 except ImportError:
     PYPDFIUM2_AVAILABLE = False
 
 
+def probe_pdf(pdf_path):
+    """
+    Page count + metadata without a full parse
+
+    pypdfium2 solo lee el trailer/xref y la raiz del arbol de paginas (no toca
+    el contenido), asi que el total sale al instante incluso en catalogos de
+    cientos de paginas. PyPDF2 queda de respaldo y se importa solo si hace
+    falta (no pesa en el arranque).
+
+    Returns:
+        dict: {'num_pages': int, 'metadata': {'Title': ..., ...}}
+    """
+    if PYPDFIUM2_AVAILABLE:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                return {'num_pages': len(pdf), 'metadata': pdf.get_metadata_dict(skip_empty=True)}
+            finally:
+                pdf.close()
+        except Exception as e:
+            print(f"pypdfium2 no pudo leer el PDF, probando PyPDF2: {e}")
+    import PyPDF2
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        metadata = reader.metadata or {}
+        return {
+            'num_pages': len(reader.pages),
+            'metadata': {k.lstrip('/'): str(v) for k, v in metadata.items() if v},
+        }
+
+
+# Resultado de la calibracion (una vez por proceso)
+_backend_choice = None
+_backend_lock = threading.Lock()
+# Paginas que renderiza cada backend al calibrar
+CALIBRATION_PAGES = 3
+
+
+def _available_backends():
+    backends = []
+    if PYPDFIUM2_AVAILABLE:
+        backends.append('pypdfium2')
+    if PDF2IMAGE_AVAILABLE:
+        backends.append('pdf2image')
+    return backends
+
+
+def _split_pages(num_pages, shards):
+    """Divide 1..num_pages en rangos contiguos (first, last) casi iguales"""
+    shards = max(1, min(shards, num_pages))
+    size, extra = divmod(num_pages, shards)
+    ranges, first = [], 1
+    for i in range(shards):
+        last = first + size - 1 + (1 if i < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def _write_bytes(data, image_path):
+    """Escribir bytes ya codificados (borrando antes: puede ser un hardlink al cache)"""
+    if os.path.exists(image_path):
+        os.remove(image_path)
+    with open(image_path, 'wb') as f:
+        f.write(data)
+
+
+def _passthrough_jpeg(page, min_coverage=0.9):
+    """
+    Return (jpeg_bytes, (width, height)) if the page is just one full-page photo.
+
+    Condiciones (si alguna falla se renderiza la pagina normalmente):
+      - exactamente una imagen y ningun texto encima (p.ej. precios vectoriales)
+      - la imagen cubre al menos min_coverage del area de la pagina
+      - filtro DCTDecode puro, RGB o gris (CMYK se veria mal en el navegador)
+      - sin rotacion ni espejado
+    """
+    images, texts = [], 0
+    for obj in page.get_objects():
+        if obj.type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            images.append(obj)
+        elif obj.type == pdfium_c.FPDF_PAGEOBJ_TEXT:
+            texts += 1
+    if len(images) != 1 or texts or page.get_rotation() % 360:
+        return None
+    image = images[0]
+    if image.get_filters() != ['DCTDecode']:
+        return None
+    if image.get_metadata().colorspace not in (pdfium_c.FPDF_COLORSPACE_DEVICERGB,
+                                               pdfium_c.FPDF_COLORSPACE_DEVICEGRAY):
+        return None
+    a, b, c, d, _, _ = image.get_matrix().get()
+    if b or c or a <= 0 or d <= 0:
+        return None
+    bounds = image.get_bounds() if hasattr(image, 'get_bounds') else image.get_pos()
+    left, bottom, right, top = bounds
+    width, height = page.get_size()
+    if (right - left) * (top - bottom) < min_coverage * width * height:
+        return None
+    return bytes(image.get_data(decode_simple=False)), image.get_px_size()
+
+
+def _write_original(found, page_num, temp_dir):
+    """Copiar el JPEG original de una pagina-foto; devuelve (path, stats)"""
+    start = time.perf_counter()
+    data, (width, height) = found
+    image_path = os.path.join(temp_dir, f'page_{page_num}.jpg')
+    _write_bytes(data, image_path)
+    return image_path, {
+        'format': 'original',
+        'bytes': len(data),
+        'raw_bytes': width * height * 3,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _save_pdfium_page(page, page_num, scale, temp_dir, passthrough, encoding):
+    """Guardar una pagina de pypdfium2: copia directa del JPEG o render + encode.
+
+    Returns:
+        tuple: (path, stats)
+    """
+    if passthrough:
+        found = _passthrough_jpeg(page)
+        if found is not None:
+            return _write_original(found, page_num, temp_dir)
+    base_path = os.path.join(temp_dir, f'page_{page_num}')
+    return encode_image(page.render(scale=scale).to_pil(), base_path, *encoding)
+
+
+def _contiguous_runs(pages):
+    """[1, 2, 3, 7, 8] -> [(1, 3), (7, 8)]"""
+    runs = []
+    for p in pages:
+        if runs and p == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], p)
+        else:
+            runs.append((p, p))
+    return runs
+
+
+def _chunked_runs(pages, size):
+    """Rangos contiguos de como mucho `size` paginas: ([1..5], 2) -> (1,2),(3,4),(5,5)"""
+    size = max(1, size)
+    for first, last in _contiguous_runs(pages):
+        for start in range(first, last + 1, size):
+            yield start, min(start + size - 1, last)
+
+
+def _convert(pdf_path, dpi, first_page, last_page, thread_count=1):
+    """convert_from_path de un rango: pdftocairo (mas rapido) y pdftoppm de respaldo"""
+    kwargs = dict(dpi=dpi, first_page=first_page, last_page=last_page, thread_count=thread_count, fmt='png')
+    try:
+        return convert_from_path(pdf_path, use_pdftocairo=True, **kwargs)
+    except Exception as e:
+        print(f"Error con pdftocairo, intentando con pdftoppm: {e}")
+        return convert_from_path(pdf_path, **kwargs)
+
+
+def _render_shard(backend, pdf_path, first_page, last_page, dpi, temp_dir, passthrough=False,
+                  encoding=('png', 85), chunk_pages=8):
+    """
+    Render pages first_page..last_page (1-based) into temp_dir.
+
+    Corre en un proceso hijo: cada worker abre SU PROPIO documento, por eso
+    sirve tambien para pypdfium2 (que no es thread-safe). Con pdf2image se
+    convierte de a chunk_pages paginas para acotar la memoria del proceso.
+
+    Returns:
+        list: (path, stats) por pagina, en orden
+    """
+    paths = {}
+    todo = list(range(first_page, last_page + 1))
+    if backend == 'pypdfium2' or (passthrough and PYPDFIUM2_AVAILABLE):
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            scale = dpi / 72
+            for page_num in list(todo):
+                page = pdf[page_num - 1]
+                if backend == 'pypdfium2':
+                    paths[page_num] = _save_pdfium_page(page, page_num, scale, temp_dir, passthrough, encoding)
+                    todo.remove(page_num)
+                else:
+                    # pdf2image renderiza; pdfium solo detecta las paginas-foto
+                    found = _passthrough_jpeg(page)
+                    if found is not None:
+                        paths[page_num] = _write_original(found, page_num, temp_dir)
+                        todo.remove(page_num)
+                page.close()
+        finally:
+            pdf.close()
+    for first, last in _chunked_runs(todo, chunk_pages):
+        images = _convert(pdf_path, dpi, first, last)
+        for offset, image in enumerate(images):
+            base_path = os.path.join(temp_dir, f'page_{first + offset}')
+            paths[first + offset] = encode_image(image, base_path, *encoding)
+    return [paths[p] for p in sorted(paths)]
+
+
+def _time_backend(backend, pdf_path, dpi, pages):
+    """Segundos por pagina de un backend (None si falla)
+
+    Se mide lo mismo que hace un shard (_render_shard de las paginas
+    1..pages, render y guardado), asi pdfium y pdftocairo pagan los mismos
+    costos: abrir el documento, el subproceso, codificar y escribir.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        try:
+            _render_shard(backend, pdf_path, 1, pages, dpi, tmp, chunk_pages=pages)
+        except Exception as e:
+            print(f"Calibracion: {backend} no disponible ({e})")
+            return None
+        return (time.perf_counter() - start) / pages
+
+
+def choose_backend(pdf_path, dpi=100, preferred=None):
+    """
+    Pick the fastest available rendering backend.
+
+    La calibracion (las primeras CALIBRATION_PAGES paginas con cada backend,
+    como las renderiza un shard) se hace una sola vez por proceso y se
+    reutiliza. `preferred` ('pypdfium2' | 'pdf2image')
+    la salta si ese backend esta instalado.
+    """
+    global _backend_choice
+    backends = _available_backends()
+    if not backends:
+        raise RuntimeError("No PDF rendering library available. Install pdf2image (requires poppler) or pypdfium2")
+    if preferred in backends:
+        return preferred
+    with _backend_lock:
+        if _backend_choice is None:
+            # El archivo ya leido una vez: el primer backend no paga el disco en frio
+            with open(pdf_path, 'rb') as f:
+                while f.read(1 << 20):
+                    pass
+            pages = max(1, min(CALIBRATION_PAGES, probe_pdf(pdf_path)['num_pages']))
+            timings = {b: _time_backend(b, pdf_path, dpi, pages) for b in backends}
+            usable = {b: t for b, t in timings.items() if t is not None}
+            _backend_choice = min(usable, key=usable.get) if usable else backends[0]
+            print(f"Backend PDF elegido: {_backend_choice} {timings}")
+        return _backend_choice
+
+
 class PDFImageExtractor:
     """Extract images from PDF files"""
     
-    def __init__(self, temp_dir='temp_images'):
+    def __init__(self, temp_dir='temp_images', backend=None, parallel_min_pages=8, cache=None,
+                 passthrough=True, full_dpi=100, image_format='png', image_quality=85,
+                 max_inflight_pages=16):
         self.temp_dir = temp_dir
+        # Maximo de paginas renderizadas en memoria a la vez (pdf2image por bloques)
+        self.max_inflight_pages = max_inflight_pages
+        # Politica de formato de salida (ver image_encoder) y sus estadisticas
+        # de la ultima extraccion: bytes ahorrados y tiempo de codificacion
+        self.encoding = (image_format, image_quality)
+        self.encode_stats = EncodeStats()
+        # Dos niveles: la extraccion puede hacerse a DPI de vista previa y la
+        # version de alta resolucion se renderiza solo para las paginas que se
+        # analizan o publican (ver full_resolution)
+        self.full_dpi = full_dpi
+        self._sources = {}  # ruta de la pagina -> (pdf_path, pagina, dpi)
+        self._full_paths = {}  # ruta de la pagina -> ruta de su alta resolucion
+        self._full_lock = threading.Lock()
+        # get_pdf_info memoizado: (ruta, tamano, mtime) -> info
+        self._info_cache = {}
+        # Capa de texto por PDF (lista por pagina), para page_hints
+        self._page_texts = {}
+        # Paginas que son una sola foto JPEG: se copia el JPEG original (sin
+        # rasterizar ni re-codificar). Requiere pypdfium2 para detectarlas.
+        self.passthrough = passthrough and PYPDFIUM2_AVAILABLE
+        # RenderCache opcional: re-subir el mismo PDF no vuelve a renderizar
+        self.cache = cache
+        self.backend = backend or None
+        # A partir de cuantas paginas conviene repartir el render en procesos
+        self.parallel_min_pages = parallel_min_pages
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
     
-    def extract_images_from_pdf(self, pdf_path, dpi=100):
+    def extract_images_from_pdf(self, pdf_path, dpi=100, content_hash=None):
         """
         Extract all images from a PDF file (ULTRA FAST - parallel processing)
         
         Args:
             pdf_path (str): Path to the PDF file
             dpi (int): DPI for image conversion (100 para máxima velocidad, suficiente para Facebook)
+            content_hash (str): sha256 of the PDF if already known (skips re-hashing)
             
         Returns:
             list: List of image paths
         """
-        # Try pdf2image first (better quality if poppler is available)
-        if PDF2IMAGE_AVAILABLE:
+        self.encode_stats.reset()
+        key = self._cache_key(pdf_path, dpi, content_hash)
+        if key:
+            cached = self.cache.get(key, self.temp_dir)
+            if cached is not None:
+                print(f"✓ {len(cached)} páginas desde el cache de render")
+                for i, path in enumerate(cached, 1):
+                    self._remember(path, pdf_path, i, dpi)
+                return cached
+
+        image_paths = self._render_images(pdf_path, dpi)
+        self._report_encoding()
+        if key and image_paths:
+            self.cache.put(key, image_paths)
+        for i, path in enumerate(image_paths, 1):
+            self._remember(path, pdf_path, i, dpi)
+        return image_paths
+
+    def full_resolution(self, image_path, dpi=None):
+        """
+        Return the high-resolution version of an extracted page, rendering it lazily
+
+        Si la imagen no viene de una vista previa (foto subida, JPEG original
+        copiado del PDF o ya extraida a la DPI final) se devuelve tal cual.
+
+        Args:
+            image_path (str): path returned by the extraction
+            dpi (int): target DPI (default: full_dpi)
+
+        Returns:
+            str: path of the high-resolution image
+        """
+        key = os.path.abspath(image_path)
+        source = self._sources.get(key)
+        dpi = dpi or self.full_dpi
+        if source is None or dpi <= source[2]:
+            return image_path
+        pdf_path, page_num, _ = source
+        # pypdfium2 no es thread-safe: un render de alta resolucion a la vez
+        with self._full_lock:
+            full_path = self._full_paths.get(key)
+            if full_path is None or not os.path.exists(full_path):
+                base_path = os.path.join(self.temp_dir, f'page_{page_num}_full')
+                full_path = self._render_page(pdf_path, page_num, dpi, base_path, image_path)
+                self._full_paths[key] = full_path
+        return full_path
+
+    def page_hints(self, image_path):
+        """
+        Price/text hints for an extracted page, from the PDF text layer
+
+        El texto de todas las paginas se lee una vez por PDF (sin renderizar
+        nada) y se interpreta con price_extractor.page_hints.
+
+        Returns:
+            dict | None: ver price_extractor.page_hints; None para fotos
+            sueltas o paginas sin texto
+        """
+        source = self._sources.get(os.path.abspath(image_path))
+        if source is None:
+            return None
+        pdf_path, page_num, _ = source
+        # pypdfium2 no es thread-safe: mismo candado que los renders
+        with self._full_lock:
+            texts = self._page_texts.get(pdf_path)
+            if texts is None:
+                try:
+                    texts = price_extractor.read_page_texts(pdf_path)
+                except Exception as e:
+                    print(f"No se pudo leer la capa de texto: {e}")
+                    texts = []
+                self._page_texts[pdf_path] = texts
+        if page_num > len(texts):
+            return None
+        return price_extractor.page_hints(texts[page_num - 1])
+
+    def _remember(self, image_path, pdf_path, page_num, dpi):
+        """Registrar de que PDF/pagina sale una imagen (para full_resolution)"""
+        key = os.path.abspath(image_path)
+        stale = self._full_paths.pop(key, None)
+        if stale and stale != image_path and os.path.exists(stale):
+            # Alta resolucion de un PDF anterior: ya no corresponde
+            os.remove(stale)
+        self._sources[key] = (pdf_path, page_num, dpi)
+        if page_num == 1:
+            # nueva extraccion de este PDF (puede haber cambiado): releer su texto
+            self._page_texts.pop(pdf_path, None)
+
+    def _render_page(self, pdf_path, page_num, dpi, base_path, preview_path):
+        """Renderizar una sola pagina (1-based); devuelve la ruta escrita.
+
+        Si la imagen extraida ya tiene la resolucion pedida (p.ej. el JPEG
+        original copiado del PDF) se devuelve esa misma, sin renderizar.
+        """
+        if PYPDFIUM2_AVAILABLE:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                page = pdf[page_num - 1]
+                try:
+                    if self.passthrough and _passthrough_jpeg(page) is not None:
+                        return preview_path
+                    target_width = page.get_size()[0] * dpi / 72
+                    with Image.open(preview_path) as preview:
+                        if preview.size[0] >= target_width * 0.98:
+                            return preview_path
+                    path, _ = encode_image(page.render(scale=dpi / 72).to_pil(), base_path, *self.encoding)
+                finally:
+                    page.close()
+            finally:
+                pdf.close()
+        elif PDF2IMAGE_AVAILABLE:
+            images = _convert(pdf_path, dpi, page_num, page_num)
+            path, _ = encode_image(images[0], base_path, *self.encoding)
+        else:
+            raise RuntimeError("No PDF rendering library available. Install pdf2image (requires poppler) or pypdfium2")
+        return path
+
+    def _report_encoding(self):
+        stats = self.encode_stats.as_dict()
+        if stats['images']:
+            print(f"Codificacion: {stats['bytes_written'] / 1e6:.1f} MB escritos, "
+                  f"{stats['bytes_saved'] / 1e6:.1f} MB ahorrados, {stats['encode_seconds']}s {stats['formats']}")
+
+    def _cache_key(self, pdf_path, dpi, content_hash=None):
+        """Clave del cache de render para este PDF y parametros (None sin cache)"""
+        if self.cache is None:
+            return None
+        fmt, quality = self.encoding
+        return self.cache.key_for(pdf_path, content_hash=content_hash, dpi=dpi, fmt=fmt,
+                                  quality=quality, passthrough=self.passthrough)
+
+    def _render_images(self, pdf_path, dpi):
+        """Renderizar todas las paginas con el mejor metodo disponible"""
+        # Catalogos grandes: render repartido en procesos (escala con los nucleos)
+        if multiprocessing.cpu_count() > 1:
+            num_pages = self.get_pdf_info(pdf_path)['num_pages']
+            if num_pages >= self.parallel_min_pages:
+                try:
+                    return self.extract_images_parallel(pdf_path, dpi, num_pages=num_pages)
+                except Exception as e:
+                    print(f"Render en paralelo fallo, usando modo normal: {e}")
+
+        # El backend elegido (PDF_BACKEND o la calibracion). Los dos mantienen la
+        # memoria acotada: pypdfium2 tiene una sola pagina viva a la vez y
+        # pdf2image va por bloques de max_inflight_pages. Las paginas-foto se
+        # copian igual con cualquiera de los dos (passthrough).
+        if choose_backend(pdf_path, dpi, self.backend) == 'pdf2image':
             try:
                 return self._extract_with_pdf2image(pdf_path, dpi)
             except Exception as e:
@@ -52,80 +476,308 @@ class PDFImageExtractor:
                     print("Falling back to pypdfium2...")
                     return self._extract_with_pypdfium2(pdf_path, dpi)
                 raise
-        
-        # Fall back to pypdfium2
-        elif PYPDFIUM2_AVAILABLE:
-            return self._extract_with_pypdfium2(pdf_path, dpi)
-        
-        else:
-            raise RuntimeError("No PDF rendering library available. Install pdf2image (requires poppler) or pypdfium2")
+        return self._extract_with_pypdfium2(pdf_path, dpi)
     
+    def extract_images_parallel(self, pdf_path, dpi=100, workers=None, num_pages=None):
+        """
+        Extract pages with a process pool, one page range (shard) per task
+
+        Cada proceso abre su propio documento, asi que funciona con pypdfium2 y
+        con pdf2image. Se crean mas shards que procesos para repartir bien la
+        carga cuando unas paginas son mas pesadas que otras.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+            dpi (int): DPI for image conversion
+            workers (int): number of processes (default: all cores)
+            num_pages (int): page count if already known
+
+        Returns:
+            list: List of image paths, in page order
+        """
+        backend = choose_backend(pdf_path, dpi, self.backend)
+        if num_pages is None:
+            num_pages = self.get_pdf_info(pdf_path)['num_pages']
+        if num_pages <= 0:
+            return []
+        workers = workers or multiprocessing.cpu_count()
+        shards = _split_pages(num_pages, workers * 2)
+        # El presupuesto de paginas en memoria se reparte entre los procesos
+        chunk_pages = max(1, self.max_inflight_pages // workers)
+
+        results = {}
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            futures = {
+                executor.submit(_render_shard, backend, pdf_path, first, last, dpi, self.temp_dir,
+                                self.passthrough, self.encoding, chunk_pages): first
+                for first, last in shards
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                for _, stats in results[futures[future]]:
+                    self.encode_stats.add(stats)
+                done = sum(len(p) for p in results.values())
+                print(f"✓ Páginas {done}/{num_pages} ({backend})")
+
+        return [path for first in sorted(results) for path, _ in results[first]]
+
+    def iter_images_from_pdf(self, pdf_path, dpi=100, cancel_event=None, content_hash=None):
+        """
+        Extract pages one at a time (STREAMING - memoria acotada a una pagina)
+
+        Renders, saves and yields each page as soon as it is written, so the
+        caller can show progress while the rest of the catalog is processed.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+            dpi (int): DPI for image conversion
+            cancel_event (threading.Event): if set, stops before the next page
+            content_hash (str): sha256 of the PDF if already known
+
+        Yields:
+            dict: {'page': n, 'total': N, 'path': image_path}
+        """
+        self.encode_stats.reset()
+        key = self._cache_key(pdf_path, dpi, content_hash)
+        if key:
+            cached = self.cache.get(key, self.temp_dir)
+            if cached is not None:
+                for i, path in enumerate(cached, 1):
+                    self._remember(path, pdf_path, i, dpi)
+                    yield {'page': i, 'total': len(cached), 'path': path}
+                return
+
+        # Catalogos grandes: los mismos shards en procesos que extract_images_parallel
+        num_pages = self.get_pdf_info(pdf_path)['num_pages']
+        if multiprocessing.cpu_count() > 1 and num_pages >= self.parallel_min_pages:
+            pages = self._iter_parallel(pdf_path, dpi, cancel_event, num_pages)
+        else:
+            pages = self._iter_sequential(pdf_path, dpi, cancel_event)
+
+        written = []
+        total = None
+        for ev in pages:
+            written.append(ev['path'])
+            total = ev['total']
+            self._remember(ev['path'], pdf_path, ev['page'], dpi)
+            yield ev
+        self._report_encoding()
+        # Solo se cachea un catalogo completo (no uno cancelado a medias)
+        if key and written and len(written) == total:
+            self.cache.put(key, written)
+
+    def _iter_sequential(self, pdf_path, dpi, cancel_event, first_page=1):
+        """Streaming en este proceso, desde first_page"""
+        # pypdfium2 primero: mantiene el documento abierto y renderiza pagina a
+        # pagina; pdf2image tendria que re-abrir el PDF en cada llamada.
+        if PYPDFIUM2_AVAILABLE:
+            return self._iter_with_pypdfium2(pdf_path, dpi, cancel_event, first_page)
+        if PDF2IMAGE_AVAILABLE:
+            return self._iter_with_pdf2image(pdf_path, dpi, cancel_event, first_page)
+        raise RuntimeError("No PDF rendering library available. Install pdf2image (requires poppler) or pypdfium2")
+
+    def _iter_parallel(self, pdf_path, dpi, cancel_event, num_pages=None, workers=None):
+        """
+        Streaming con el render por shards en un pool de procesos
+
+        Shards chicos (el presupuesto de paginas en memoria repartido entre los
+        procesos) que se entregan en orden de pagina: la primera llega pronto
+        y el resto se renderiza con todos los nucleos. Si el pool falla se
+        sigue en este proceso desde la pagina que faltaba.
+
+        Los shards escriben en una carpeta propia de esta extraccion y cada
+        pagina pasa a temp_dir recien al entregarla: si se cancela, lo que
+        los shards ya en curso terminan de escribir se descarta y no se
+        mezcla con la extraccion siguiente.
+        """
+        backend = choose_backend(pdf_path, dpi, self.backend)
+        if num_pages is None:
+            num_pages = self.get_pdf_info(pdf_path)['num_pages']
+        workers = workers or multiprocessing.cpu_count()
+        chunk_pages = max(1, self.max_inflight_pages // workers)
+        shards = list(_chunked_runs(range(1, num_pages + 1), chunk_pages))
+        page_num = 1
+        shard_dir = tempfile.mkdtemp(prefix='shards_', dir=self.temp_dir)
+        executor = ProcessPoolExecutor(max_workers=max(1, min(workers, len(shards))))
+        try:
+            futures = [executor.submit(_render_shard, backend, pdf_path, first, last, dpi, shard_dir,
+                                       self.passthrough, self.encoding, chunk_pages)
+                       for first, last in shards]
+            for future in futures:
+                for shard_path, stats in future.result():
+                    if cancel_event is not None and cancel_event.is_set():
+                        print(f"Extraccion cancelada en pagina {page_num}/{num_pages}")
+                        return
+                    image_path = os.path.join(self.temp_dir, os.path.basename(shard_path))
+                    os.replace(shard_path, image_path)
+                    self.encode_stats.add(stats)
+                    print(f"✓ Página {page_num}/{num_pages} ({backend})")
+                    yield {'page': page_num, 'total': num_pages, 'path': image_path}
+                    page_num += 1
+            return
+        except Exception as e:
+            print(f"Render en paralelo fallo, sigue en modo normal desde la pagina {page_num}: {e}")
+        finally:
+            # cancelado o cerrado: los shards sin empezar no se renderizan y lo
+            # que escribieron los que estaban en curso se borra
+            executor.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        yield from self._iter_sequential(pdf_path, dpi, cancel_event, page_num)
+
+    def _iter_with_pypdfium2(self, pdf_path, dpi, cancel_event, first_page=1):
+        """Streaming con pypdfium2: una pagina en memoria a la vez"""
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            num_pages = len(pdf)
+            scale = dpi / 72
+            for page_num in range(first_page - 1, num_pages):
+                if cancel_event is not None and cancel_event.is_set():
+                    print(f"Extraccion cancelada en pagina {page_num+1}/{num_pages}")
+                    return
+                page = pdf[page_num]
+                try:
+                    image_path, stats = _save_pdfium_page(page, page_num + 1, scale, self.temp_dir,
+                                                          self.passthrough, self.encoding)
+                finally:
+                    page.close()
+                self.encode_stats.add(stats)
+                print(f"✓ Página {page_num+1}/{num_pages}")
+                yield {'page': page_num + 1, 'total': num_pages, 'path': image_path}
+        finally:
+            pdf.close()
+
+    def _iter_with_pdf2image(self, pdf_path, dpi, cancel_event, first_page=1):
+        """Streaming con pdf2image: convierte de a una pagina (first_page/last_page)"""
+        num_pages = self.get_pdf_info(pdf_path)['num_pages']
+        for page_num in range(first_page, num_pages + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                print(f"Extraccion cancelada en pagina {page_num}/{num_pages}")
+                return
+            images = _convert(pdf_path, dpi, page_num, page_num)
+            if not images:
+                continue
+            image_path = self._save_page(images[0], page_num)
+            print(f"✓ Página {page_num}/{num_pages}")
+            yield {'page': page_num, 'total': num_pages, 'path': image_path}
+
+    def _save_page(self, image, page_num):
+        """Guardar una pagina renderizada (segun la politica de formato) y devolver su ruta"""
+        image_path, stats = encode_image(image, os.path.join(self.temp_dir, f'page_{page_num}'), *self.encoding)
+        self.encode_stats.add(stats)
+        return image_path
+
     def _extract_with_pdf2image(self, pdf_path, dpi):
-        """Extract using pdf2image with parallel processing - ULTRA FAST"""
+        """Extract using pdf2image in bounded chunks - memoria plana
+
+        Se renderizan bloques de paginas (first_page/last_page) en vez del
+        documento entero, y cada pagina se guarda en un hilo mientras se
+        renderiza el bloque siguiente. Nunca hay mas de max_inflight_pages
+        imagenes PIL vivas a la vez, tenga el PDF 10 o 500 paginas. Con
+        passthrough las paginas-foto se copian antes (via pypdfium2) y no
+        entran en los bloques.
+        """
         # Usar máximo de hilos disponibles para conversión paralela
         max_workers = min(6, multiprocessing.cpu_count())  # Reducir a 6 para más estabilidad
-        
-        try:
-            # Convertir todas las páginas en paralelo
-            images = convert_from_path(
-                pdf_path, 
-                dpi=dpi,
-                thread_count=max_workers,  # Máximo procesamiento paralelo
-                fmt='png',
-                use_pdftocairo=True  # Más rápido que pdftoppm
-            )
-        except Exception as e:
-            print(f"Error con pdftocairo, intentando con pdftoppm: {e}")
-            # Fallback sin pdftocairo
-            images = convert_from_path(
-                pdf_path, 
-                dpi=dpi,
-                thread_count=max_workers,
-                fmt='png'
-            )
-        
-        def save_image(args):
-            """Guardar imagen individual"""
-            i, image = args
-            image_path = os.path.join(self.temp_dir, f'page_{i+1}.png')
-            # Guardado ultra rápido sin compresión
-            image.save(image_path, 'PNG', optimize=False, compress_level=0)
-            print(f"✓ Página {i+1}/{len(images)}")
-            return image_path
-        
-        # Guardar todas las imágenes en paralelo
+        num_pages = self.get_pdf_info(pdf_path)['num_pages']
+        if num_pages <= 0:
+            return []
+        paths = {}
+        if self.passthrough:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                for page_num in range(1, num_pages + 1):
+                    page = pdf[page_num - 1]
+                    try:
+                        found = _passthrough_jpeg(page)
+                    finally:
+                        page.close()
+                    if found is not None:
+                        paths[page_num], stats = _write_original(found, page_num, self.temp_dir)
+                        self.encode_stats.add(stats)
+            finally:
+                pdf.close()
+        todo = [p for p in range(1, num_pages + 1) if p not in paths]
+        budget = max(1, self.max_inflight_pages)
+        # Bloques de la mitad del presupuesto: uno se guarda mientras otro se renderiza
+        chunk = max(1, budget // 2)
+        inflight = threading.BoundedSemaphore(budget)
+        use_pdftocairo = True
+
+        def render(first, last):
+            nonlocal use_pdftocairo
+            kwargs = dict(dpi=dpi, first_page=first, last_page=last,
+                          thread_count=min(max_workers, last - first + 1), fmt='png')
+            if use_pdftocairo:
+                try:
+                    return convert_from_path(pdf_path, use_pdftocairo=True, **kwargs)  # Más rápido que pdftoppm
+                except Exception as e:
+                    print(f"Error con pdftocairo, intentando con pdftoppm: {e}")
+                    use_pdftocairo = False
+            return convert_from_path(pdf_path, **kwargs)
+
+        def save_image(page_num, image):
+            """Guardar imagen individual y liberar su lugar en el presupuesto"""
+            try:
+                image_path = self._save_page(image, page_num)
+                print(f"✓ Página {page_num}/{num_pages}")
+                return image_path
+            finally:
+                image.close()
+                inflight.release()
+
+        futures = {}
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            image_paths = list(executor.map(save_image, enumerate(images)))
-        
-        return image_paths
+            for first, last in _chunked_runs(todo, chunk):
+                # Esperar a que los guardados pendientes liberen memoria
+                for _ in range(last - first + 1):
+                    inflight.acquire()
+                images = render(first, last)
+                # Si pdf2image devolvio menos paginas, devolver los permisos sobrantes
+                for _ in range(last - first + 1 - len(images)):
+                    inflight.release()
+                for offset, image in enumerate(images):
+                    futures[first + offset] = executor.submit(save_image, first + offset, image)
+                del images
+            paths.update((page_num, f.result()) for page_num, f in futures.items())
+
+        return [paths[p] for p in sorted(paths)]
     
     def _extract_with_pypdfium2(self, pdf_path, dpi):
-        """Extract using pypdfium2 - optimized sequential (pypdfium2 no es thread-safe)"""
+        """Extract using pypdfium2 - optimized sequential (pypdfium2 no es thread-safe)
+
+        Cada pagina se renderiza, se guarda y se libera antes de la siguiente:
+        una sola imagen viva, la memoria no crece con el numero de paginas.
+        """
         pdf = pdfium.PdfDocument(pdf_path)
-        num_pages = len(pdf)
-        
-        # Calcular escala una vez
-        scale = dpi / 72
-        image_paths = []
-        
-        # Procesar secuencialmente pero super rápido
-        for page_num in range(num_pages):
-            page = pdf[page_num]
-            pil_image = page.render(scale=scale).to_pil()
-            
-            image_path = os.path.join(self.temp_dir, f'page_{page_num+1}.png')
-            # Guardado ultra rápido sin optimización ni compresión
-            pil_image.save(image_path, 'PNG', optimize=False, compress_level=0)
-            image_paths.append(image_path)
-            print(f"✓ Página {page_num+1}/{num_pages}")
-        
-        pdf.close()
+        try:
+            num_pages = len(pdf)
+
+            # Calcular escala una vez
+            scale = dpi / 72
+            image_paths = []
+
+            # Procesar secuencialmente pero super rápido
+            for page_num in range(num_pages):
+                page = pdf[page_num]
+                try:
+                    image_path, stats = _save_pdfium_page(page, page_num + 1, scale, self.temp_dir,
+                                                          self.passthrough, self.encoding)
+                finally:
+                    page.close()
+                self.encode_stats.add(stats)
+                image_paths.append(image_path)
+                print(f"✓ Página {page_num+1}/{num_pages}")
+        finally:
+            pdf.close()
         return image_paths
-    
+
     def get_pdf_info(self, pdf_path):
         """
         Get basic information about the PDF
         
+        Usa probe_pdf y recuerda el resultado por (ruta, tamano, mtime): la
+        extraccion lo consulta varias veces (barra de progreso, shards...).
+
         Args:
             pdf_path (str): Path to the PDF file
             
@@ -133,23 +785,24 @@ class PDFImageExtractor:
             dict: PDF information
         """
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-                
-                # Try to extract metadata
-                metadata = pdf_reader.metadata
-                
-                return {
-                    'num_pages': num_pages,
-                    'metadata': metadata
-                }
+            st = os.stat(pdf_path)
+            key = (os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns)
+            info = self._info_cache.get(key)
+            if info is None:
+                info = probe_pdf(pdf_path)
+                if len(self._info_cache) >= 32:
+                    self._info_cache.clear()
+                self._info_cache[key] = info
+            return dict(info)
         except Exception as e:
             print(f"Error reading PDF info: {e}")
             return {'num_pages': 0, 'metadata': None}
     
     def cleanup(self):
         """Clean up temporary image files"""
+        self._sources.clear()
+        self._full_paths.clear()
+        self._page_texts.clear()
         try:
             for file in os.listdir(self.temp_dir):
                 file_path = os.path.join(self.temp_dir, file)
@@ -0,0 +1,168 @@
+"""
+Price Extractor Module
+Precios desde la capa de texto del PDF, sin IA.
+
+Muchos catalogos traen el texto real ("3 X 50 soles", "Por Mayor 9.50") que el
+PROMPT le pide a Gemini leer de los pixeles. Aqui se extrae ese texto por
+pagina y se aplican localmente las mismas reglas del PROMPT:
+  - paquete "N X P": P / N redondeado hacia ARRIBA (3 X 50 -> 17)
+  - precio suelto con decimales: hacia abajo (Por Mayor 9.50 -> 9)
+  - el precio de la publicacion es el unitario mas bajo
+
+Solo cuentan los numeros con moneda o etiqueta de precio ("S/", "soles",
+"Por Mayor"...): "2 x 10" a secas es una medida o una cantidad, no un
+paquete. Los miles se leen enteros ("S/ 1,250.00" -> 1250).
+
+Con eso el analizador recibe el precio ya calculado (y el texto) como pista,
+o si la pagina trae nombre y un precio sin ambiguedad (plantilla completa) ni
+siquiera envia la imagen: basta una llamada de solo texto.
+"""
+import re
+import math
+
+try:
+    import pypdfium2 as pdfium
+    PYPDFIUM2_AVAILABLE = True
+except ImportError:
+    PYPDFIUM2_AVAILABLE = False
+
+# Texto maximo que se pasa como pista (una pagina de catalogo cabe de sobra)
+MAX_HINT_CHARS = 1500
+# Mas precios distintos que esto: pagina con varios productos, el "mas bajo"
+# no seria el de ninguno en particular (unidad, paquete y docena = 3)
+MAX_PRICES_PER_PRODUCT = 3
+
+# Con separador de miles ("1,250.00", "1.250") o sin el ("1250", "9.50")
+_NUM = r'(?<![\d.,])((?:\d{1,3}(?:[.,]\d{3})+|\d{1,4})(?:[.,]\d{1,2})?)(?![\d])'
+_CURRENCY = r'(?:S/\.?|s/\.?)'
+_LABEL = r'(?:por\s+unidad|unidad|c/u|precio(?:\s+unitario)?|por\s+mayor|mayorista|mayor)'
+# "3 X 50 soles", "3x S/ 50", "Por Mayor 3 x 50" (no "30 x 40 cm" ni "2 x 10"
+# a secas: sin moneda ni etiqueta no es un precio)
+_PACK = re.compile(r'(?:(' + _LABEL + r')\s*[:=-]?\s*)?(?<!\d)(\d{1,2})\s*[xX×]\s*(' + _CURRENCY + r')?\s*' +
+                   _NUM + r'(\s*soles?\b)?(?!\s*(?:cm|mm|m|ml|lt?|kg|gr?|pulg|")\b)', re.IGNORECASE)
+# "Por Unidad 20", "Por Mayor 9.50", "Precio: S/ 15", "c/u 8"
+_LABELED = re.compile(_LABEL + r'\s*[:=-]?\s*' + _CURRENCY + r'?\s*' + _NUM, re.IGNORECASE)
+# "S/ 20", "20 soles"
+_MONEY = re.compile(_CURRENCY + r'\s*' + _NUM + r'|' + _NUM + r'\s*soles?\b', re.IGNORECASE)
+
+# Lineas que no son el nombre del producto
+_BOILERPLATE = ('precio', 'soles', 'unidad', 'mayor', 'docena', 'ciento', 'cajon', 'contacto',
+                'whatsapp', 'somos', 'oferta', 'remate', 'delivery', 'envio', 'stock', 'medida')
+
+
+def _to_float(raw):
+    """'9.50' -> 9.5, '1,250.00' -> 1250.0, '1.250' -> 1250.0 (dos decimales
+    como mucho: un grupo de tres cifras son miles)"""
+    whole, decimals = re.fullmatch(r'(.*?)(?:[.,](\d{1,2}))?', raw).groups()
+    whole = re.sub(r'[.,]', '', whole)
+    return float(f'{whole}.{decimals}' if decimals else whole)
+
+
+def _exact(raw, after):
+    """El numero se lee de una sola forma: no es "1.250"/"1,250" (miles o
+    decimales mal escritos) ni sigue con cifras sueltas ("S/ 1 250")."""
+    return not re.fullmatch(r'\d{1,3}[.,]\d{3}', raw) and not re.match(r'[ \t\u00a0]?\d', after)
+
+
+def parse_prices(text):
+    """
+    Todos los precios reconocibles del texto.
+
+    Returns:
+        list: [{'raw': '3 X 50 soles', 'unit': 17, 'exact': True}, ...] con el
+        precio unitario ya redondeado segun las reglas del PROMPT; exact es
+        False si el numero admite otra lectura (ver _exact)
+    """
+    found, taken = [], []
+
+    def free(m):
+        # "3 X 50 soles" es un precio, no dos ("3 X 50" y "50 soles")
+        if any(m.start() < end and start < m.end() for start, end in taken):
+            return False
+        taken.append(m.span())
+        return True
+
+    for m in _PACK.finditer(text):
+        label, qty, currency, raw, soles = m.groups()
+        if not (label or currency or soles):
+            continue
+        total = _to_float(raw)
+        if int(qty) >= 2 and total > 0 and free(m):
+            found.append({'raw': m.group(0).strip(), 'unit': math.ceil(round(total / int(qty), 2)),
+                          'exact': _exact(raw, text[m.end(4):])})
+    for regex in (_LABELED, _MONEY):
+        for m in regex.finditer(text):
+            group = next(i for i, g in enumerate(m.groups(), 1) if g)
+            value = _to_float(m.group(group))
+            if value > 0 and free(m):
+                found.append({'raw': m.group(0).strip(), 'unit': math.floor(value),
+                              'exact': _exact(m.group(group), text[m.end(group):])})
+    return [p for p in found if p['unit'] > 0]
+
+
+def lowest_unit_price(text):
+    """El precio entero mas bajo del texto (None si no hay ninguno)."""
+    prices = parse_prices(text)
+    return min(p['unit'] for p in prices) if prices else None
+
+
+def product_name(text):
+    """Primera linea que parece un nombre de producto (no precio ni pie de catalogo)."""
+    for line in text.splitlines():
+        line = line.strip()
+        words = re.findall(r'[A-Za-zÁÉÍÓÚÑáéíóúñ]{2,}', line)
+        if len(words) < 2 or len(''.join(words)) < 6:
+            continue
+        if parse_prices(line) or any(b in line.lower() for b in _BOILERPLATE):
+            continue
+        return line
+    return None
+
+
+def page_hints(text):
+    """
+    Pistas de una pagina para el analizador.
+
+    Returns:
+        dict | None: {'text', 'price', 'prices', 'name', 'exact', 'complete'};
+        exact = todos los precios se leen de una sola forma; complete = hay
+        nombre y un precio exacto (se puede analizar sin la imagen y el precio
+        local manda). None si la pagina no tiene capa de texto util. Con
+        demasiados precios (varios productos en la pagina) price es None y
+        solo se pasa el texto.
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    prices = parse_prices(text)
+    name = product_name(text)
+    distinct = {p['unit'] for p in prices}
+    price = min(distinct) if distinct and len(distinct) <= MAX_PRICES_PER_PRODUCT else None
+    exact = all(p['exact'] for p in prices)
+    return {
+        'text': text[:MAX_HINT_CHARS],
+        'price': price,
+        'prices': [p['raw'] for p in prices],
+        'name': name,
+        'exact': exact,
+        'complete': price is not None and name is not None and exact,
+    }
+
+
+def read_page_texts(pdf_path):
+    """Texto de cada pagina del PDF (lista, una entrada por pagina)."""
+    if PYPDFIUM2_AVAILABLE:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            texts = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return texts
+        finally:
+            pdf.close()
+    import PyPDF2
+    with open(pdf_path, 'rb') as f:
+        return [page.extract_text() or '' for page in PyPDF2.PdfReader(f).pages]
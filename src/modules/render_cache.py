@@ -0,0 +1,171 @@
+"""
+Render Cache Module
+Cache de paginas ya renderizadas, direccionado por contenido.
+
+La clave es el sha256 del PDF + los parametros de render (dpi, formato...),
+asi que volver a subir el mismo catalogo devuelve las paginas al instante en
+lugar de renderizarlas de nuevo. Se comparte entre la GUI y el backend web a
+traves de PDFImageExtractor.
+
+Varios procesos pueden usar la misma carpeta (GUI, backend, CLI de Batch
+jobs): cada lectura-modificacion de index.json se hace con index.lock tomado
+(ver file_lock.py) y releyendo el indice del disco, asi ninguno pisa las
+entradas de otro ni borra paginas que otro esta enlazando.
+
+Estructura en disco:
+    <cache_dir>/index.json          -> {key: {pages, bytes, last_used}}
+    <cache_dir>/index.lock          -> lock entre procesos del indice
+    <cache_dir>/<key>/page_N.png    -> paginas renderizadas
+
+Eviccion LRU por tamano total (max_bytes) y numero de entradas (max_entries).
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from modules.file_lock import file_lock
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """sha256 de un archivo leyendo por bloques (memoria constante)."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """Hardlink (instantaneo, sin duplicar bytes); copia si el FS no lo permite."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class RenderCache:
+    """Cache LRU de paginas renderizadas (thread-safe y compartible entre procesos)."""
+
+    def __init__(self, cache_dir='render_cache', max_bytes=2 * 1024 ** 3, max_entries=50):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_file = os.path.join(cache_dir, 'index.json')
+        self._lock_file = os.path.join(cache_dir, 'index.lock')
+        self._index = self._load()
+
+    # ---------- persistencia ----------
+    def _load(self):
+        if os.path.exists(self._index_file):
+            try:
+                with open(self._index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                return {}
+        return {}
+
+    def _save(self):
+        tmp = f"{self._index_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_file)
+
+    @contextmanager
+    def _locked(self):
+        """Lock del indice (hilos y procesos) con el indice recien leido del disco."""
+        with self._lock, file_lock(self._lock_file):
+            self._index = self._load()
+            yield
+
+    # ---------- API ----------
+    @staticmethod
+    def key_for(pdf_path=None, content_hash=None, **params):
+        """Clave = hash del contenido del PDF + parametros de render ordenados."""
+        digest = content_hash or file_sha256(pdf_path)
+        extra = '&'.join(f"{k}={params[k]}" for k in sorted(params))
+        return hashlib.sha256(f"{digest}|{extra}".encode()).hexdigest()[:32]
+
+    def get(self, key, dest_dir):
+        """
+        Copia (hardlink) las paginas cacheadas a dest_dir.
+
+        Returns:
+            list: rutas en dest_dir en orden de pagina, o None si no hay entrada
+        """
+        with self._locked():
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            src_dir = os.path.join(self.cache_dir, key)
+            if not all(os.path.exists(os.path.join(src_dir, p)) for p in entry['pages']):
+                # Entrada corrupta (borrada a mano): se descarta
+                self._drop(key)
+                self._save()
+                return None
+            entry['last_used'] = time.time()
+            self._save()
+            # con el lock tomado: otro proceso no puede desalojarla a medias
+            os.makedirs(dest_dir, exist_ok=True)
+            paths = []
+            for name in entry['pages']:
+                dst = os.path.join(dest_dir, name)
+                _link_or_copy(os.path.join(src_dir, name), dst)
+                paths.append(dst)
+        return paths
+
+    def put(self, key, image_paths):
+        """Guarda las paginas renderizadas bajo key y aplica la eviccion LRU."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(prefix=f'{key}.', suffix='.tmp', dir=self.cache_dir)
+        pages, size = [], 0
+        for path in image_paths:
+            name = os.path.basename(path)
+            _link_or_copy(path, os.path.join(tmp_dir, name))
+            pages.append(name)
+            size += os.path.getsize(path)
+
+        with self._locked():
+            self._drop(key)
+            os.replace(tmp_dir, entry_dir)
+            self._index[key] = {'pages': pages, 'bytes': size, 'last_used': time.time()}
+            self._evict(keep=key)
+            self._save()
+
+    def clear(self):
+        with self._locked():
+            for key in list(self._index):
+                self._drop(key)
+            self._save()
+
+    def stats(self):
+        with self._locked():
+            return {
+                'entries': len(self._index),
+                'bytes': sum(e['bytes'] for e in self._index.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+    # ---------- internos (con el lock tomado) ----------
+    def _drop(self, key):
+        self._index.pop(key, None)
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _evict(self, keep=None):
+        by_age = sorted(self._index, key=lambda k: self._index[k]['last_used'])
+        total = sum(e['bytes'] for e in self._index.values())
+        for key in by_age:
+            if total <= self.max_bytes and len(self._index) <= self.max_entries:
+                break
+            if key == keep:
+                continue
+            total -= self._index[key]['bytes']
+            self._drop(key)
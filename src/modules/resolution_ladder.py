@@ -0,0 +1,94 @@
+"""
+Resolution Ladder Module
+Resolucion adaptativa de las imagenes que se mandan a la IA.
+
+Con un solo MAX_IMAGE_SIZE (2048 px) toda foto paga el maximo de tokens y de
+subida, aunque la mayoria se lee igual de bien a una fraccion. Con una
+escalera (p.ej. 768 -> 1280 -> 2048) el analisis empieza en el escalon mas
+bajo y solo se repite en el siguiente si el resultado quedo incompleto (sin
+nombre o con el precio '10' por defecto, ver ai_analyzer.incomplete).
+
+El escalon de partida se aprende por fuente (el catalogo: el sha256 del PDF
+en el backend web, la carpeta de las imagenes si no se dice otra cosa):
+  - si en el escalon de partida falla al menos `raise_at` de las ultimas
+    `window` imagenes, la fuente pasa a empezar en el siguiente (el intento
+    bajo ya no ahorra, solo suma una llamada)
+  - cada `probe_every` imagenes (contadas desde el ultimo cambio) se prueba
+    un escalon mas abajo; con dos pruebas seguidas completas la fuente baja
+"""
+import threading
+from collections import OrderedDict, deque
+
+
+class ResolutionLadder:
+    """Escalones de resolucion (lado maximo en px) y el de partida por fuente."""
+
+    def __init__(self, sizes, window=8, raise_at=0.5, probe_every=10, max_sources=500):
+        self.sizes = sorted(set(int(s) for s in sizes))
+        if not self.sizes:
+            raise ValueError("la escalera necesita al menos un tamano")
+        self.window = window
+        self.raise_at = raise_at
+        self.probe_every = probe_every
+        self.max_sources = max_sources
+        self._sources = OrderedDict()    # fuente -> estado (LRU)
+        self._lock = threading.Lock()
+
+    def _state(self, source):
+        st = self._sources.get(source)
+        if st is None:
+            st = {'start': 0, 'recent': deque(maxlen=self.window), 'images': 0, 'probes_ok': 0}
+            self._sources[source] = st
+            while len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+        else:
+            self._sources.move_to_end(source)
+        return st
+
+    def start(self, source):
+        """Tamano con el que empezar la siguiente imagen de `source`."""
+        with self._lock:
+            st = self._state(source)
+            st['images'] += 1
+            step = st['start']
+            if step > 0 and self.probe_every and st['images'] % self.probe_every == 0:
+                step -= 1
+            return self.sizes[step]
+
+    def next_size(self, size):
+        """El escalon siguiente a `size`, o None si ya es el ultimo."""
+        bigger = [s for s in self.sizes if s > size]
+        return bigger[0] if bigger else None
+
+    def observe(self, source, size, complete):
+        """Resultado de analizar una imagen de `source` a `size` px."""
+        if size not in self.sizes:
+            return
+        step = self.sizes.index(size)
+        with self._lock:
+            st = self._state(source)
+            if step == st['start']:
+                st['recent'].append(bool(complete))
+                recent = st['recent']
+                failed = recent.count(False)
+                if (len(recent) >= max(self.window // 2, 1) and failed / len(recent) >= self.raise_at
+                        and st['start'] < len(self.sizes) - 1):
+                    self._move(st, +1)
+            elif step == st['start'] - 1:
+                st['probes_ok'] = st['probes_ok'] + 1 if complete else 0
+                if st['probes_ok'] >= 2:
+                    self._move(st, -1)
+
+    @staticmethod
+    def _move(st, delta):
+        """Cambia el escalon de partida; las cuentas empiezan de nuevo (la
+        siguiente prueba hacia abajo, a probe_every imagenes del cambio)."""
+        st['start'] += delta
+        st['recent'].clear()
+        st['probes_ok'] = 0
+        st['images'] = 0
+
+    def stats(self):
+        """{fuente: tamano de partida} de las fuentes conocidas."""
+        with self._lock:
+            return {source: self.sizes[st['start']] for source, st in self._sources.items()}
@@ -0,0 +1,71 @@
+"""
+Single Flight Module
+Une peticiones identicas en vuelo: la primera (lider) hace el trabajo y las
+que llegan mientras tanto esperan su mismo Future en lugar de repetirlo.
+
+Se usa con la clave de cache del analisis (hash de la imagen + prompt +
+modelo): un doble clic en "Analizar" o un lote que se cruza con un analisis
+manual hacen UNA llamada a Gemini y gastan UNA vez la cuota.
+
+Los Futures son de concurrent.futures, asi sirven igual a hilos (publicacion,
+lotes) y a endpoints async (await wait(future)).
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Registro thread-safe clave -> Future del trabajo en curso."""
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """
+        Returns:
+            (Future, lider): si lider es True el llamador debe hacer el trabajo
+            y llamar a resolve(key, ...) SIEMPRE (tambien si falla); si no,
+            solo tiene que esperar el Future.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def resolve(self, key, result=None, error=None):
+        """El lider entrega el resultado (o el error) a todos los que esperan."""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key, fn):
+        """Version bloqueante: ejecuta fn() como lider o espera al que ya corre."""
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, result)
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._inflight)
+
+
+async def wait(future):
+    """Espera un Future de claim() desde async. shield: si este cliente se
+    desconecta no se cancela el Future que comparten los demas."""
+    return await asyncio.shield(asyncio.wrap_future(future))
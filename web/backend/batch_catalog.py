@@ -0,0 +1,202 @@
+"""
+ELEKA Marketplace - Analisis de catalogos por lote (Batch API de Gemini)
+========================================================================
+Para preparar catalogos de noche: el catalogo entero va como Batch job (mitad
+de precio, sin la cuota por minuto, resultados en horas) y los analisis
+quedan en el cache del backend (ai_analysis.db), asi el dashboard y la
+publicacion los usan sin llamar a la IA. Las corridas se guardan en
+batch_jobs/ y se retoman tras un reinicio; el backend las muestra en
+/api/batch-jobs (y tambien puede iniciarlas).
+
+Ejemplos:
+    py -3 batch_catalog.py start catalogo.pdf --wait
+    py -3 batch_catalog.py start fotos/ --name "Ollas marzo"
+    py -3 batch_catalog.py status
+    py -3 batch_catalog.py status 3f9c2a1b7d4e
+    py -3 batch_catalog.py resume --wait
+    py -3 batch_catalog.py cancel 3f9c2a1b7d4e
+
+Con AI_BACKEND=fake corre contra el doble local (sin API key ni costo).
+"""
+import sys
+import json
+import uuid
+import argparse
+from pathlib import Path
+
+WORK = Path(__file__).resolve().parent
+sys.path.insert(0, str(WORK.parent.parent / "src"))
+
+from config.settings import Config                       # noqa: E402
+from modules.pdf_extractor import PDFImageExtractor      # noqa: E402
+from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+from modules.ai_backends import create_client            # noqa: E402
+from modules.analysis_store import AnalysisStore         # noqa: E402
+from modules.metrics_store import MetricsStore           # noqa: E402
+from modules.batch_jobs import BatchJobRunner            # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+# Subidas del backend (ver workspaces.py): sus paginas son vistas previas y
+# solo el backend sabe renderizarlas en alta resolucion
+WORKSPACES = WORK / "workspaces"
+
+
+def build_runner(cfg=Config) -> BatchJobRunner:
+    """Mismo analizador, cache y metricas que main.py (mismas rutas de Config)."""
+    analyzer = AIImageAnalyzer(cfg.GEMINI_API_KEY, cfg.AI_MODEL_IMAGE, cfg.MAX_IMAGE_SIZE,
+                               requests_per_minute=cfg.AI_REQUESTS_PER_MINUTE,
+                               max_retries=cfg.AI_MAX_RETRIES, pdf_text=cfg.AI_PDF_TEXT,
+                               client=create_client(cfg))
+    metrics = MetricsStore(WORK / cfg.AI_METRICS_DB, cfg.AI_METRICS_DAYS)
+    analyzer.metrics = lambda entry: metrics.record(dict(entry, account=entry.get("account") or "cli"))
+    cache = AnalysisStore(WORK / cfg.AI_CACHE_DB, cfg.AI_CACHE_MAX_ENTRIES, cfg.AI_CACHE_TTL_DAYS)
+    return BatchJobRunner(analyzer, cache, WORK / cfg.BATCH_JOBS_DIR, cfg.AI_BATCH_INLINE_MB, cfg.AI_BATCH_POLL_S)
+
+
+def _show(progress) -> None:
+    print(f"[{progress['id']}] {progress['name']}: {progress['status']} | "
+          f"{progress['done']}/{progress['total']} listas, {progress['cached']} ya en cache, "
+          f"{progress['submitted']} en Gemini, {progress['pending']} sin enviar, {progress['failed']} fallidas | "
+          f"{len(progress['jobs'])} job(s), {progress['prompt_tokens'] + progress['output_tokens']} tokens")
+
+
+def _collect(source: Path, files_dir: Path, analyzer, cfg=Config):
+    """(imagenes, pistas, claves) de un PDF o de una carpeta de fotos.
+
+    Las paginas del PDF se extraen como el backend (vista previa a
+    PREVIEW_DPI) y la clave de cache sale de esa vista previa, asi
+    /api/analyze encuentra los resultados; se envia la alta resolucion
+    (FULL_DPI), que queda en files_dir y sirve tambien al retomar."""
+    if source.is_dir():
+        images = sorted(str(p) for p in source.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return images, None, None
+    extractor = PDFImageExtractor(temp_dir=str(files_dir), backend=cfg.PDF_BACKEND,
+                                  parallel_min_pages=cfg.PDF_PARALLEL_MIN_PAGES,
+                                  passthrough=cfg.PDF_JPEG_PASSTHROUGH, full_dpi=cfg.FULL_DPI,
+                                  image_format=cfg.IMAGE_FORMAT, image_quality=cfg.IMAGE_QUALITY,
+                                  max_inflight_pages=cfg.PDF_MAX_INFLIGHT_PAGES)
+    images, hints, keys = [], {}, {}
+    for preview in extractor.extract_images_from_pdf(str(source), dpi=cfg.PREVIEW_DPI):
+        page_hints = extractor.page_hints(preview)
+        # las de solo texto se envian sin imagen: no hace falta renderizarlas
+        path = preview if analyzer.text_only(page_hints) else extractor.full_resolution(preview)
+        images.append(path)
+        hints[path] = page_hints
+        keys[path] = analyzer.cache_key(preview)
+    return images, hints.get, keys.get
+
+
+def _cmd_start(args) -> int:
+    source = Path(args.source)
+    if not source.exists():
+        print(f"No existe: {source}", file=sys.stderr)
+        return 1
+    runner = build_runner()
+    # las paginas del PDF se extraen a una carpeta propia de la corrida, que
+    # se borra cuando ya se enviaron
+    files_dir = WORK / Config.BATCH_JOBS_DIR / "files" / uuid.uuid4().hex[:12]
+    images, hints, keys = _collect(source, files_dir, runner.analyzer)
+    if not images:
+        print("No hay imagenes que analizar.", file=sys.stderr)
+        return 1
+    progress = runner.start(images, hints=hints, name=args.name or source.name,
+                            files_dir=files_dir if not source.is_dir() else None, keys=keys)
+    _show(progress)
+    if args.wait:
+        progress = runner.wait(progress["id"], args.poll, _show)
+    return 0 if progress["status"] != "cancelled" else 1
+
+
+def _cmd_status(args) -> int:
+    runner = build_runner()
+    if args.id:
+        progress = runner.get(args.id)
+        if progress is None:
+            print("Corrida no encontrada.", file=sys.stderr)
+            return 1
+        print(json.dumps({**progress, "errors": runner.errors(args.id)}, indent=2, ensure_ascii=False))
+        return 0
+    runs = runner.runs()
+    if not runs:
+        print("No hay corridas.")
+    for progress in runs:
+        _show(progress)
+    return 0
+
+
+def _backend_pending(run) -> bool:
+    """La corrida tiene paginas sin enviar en un workspace del backend."""
+    return any(item["status"] == "pending" and Path(item["path"]).parent.parent == WORKSPACES
+               for item in run["items"])
+
+
+def _cmd_resume(args) -> int:
+    runner = build_runner()
+    skipped = []
+
+    def accept(run):
+        if _backend_pending(run):
+            skipped.append(run["id"])
+            return False
+        return True
+
+    open_runs = runner.resume(accept)
+    for run_id in skipped:
+        print(f"[{run_id}] tiene paginas del backend sin enviar: la retoma el backend "
+              f"(desde aqui se enviarian las vistas previas).")
+    if not open_runs and not skipped:
+        print("No hay corridas pendientes.")
+    for progress in open_runs:
+        _show(progress)
+        if args.wait:
+            runner.wait(progress["id"], args.poll, _show)
+    return 0
+
+
+def _cmd_cancel(args) -> int:
+    runner = build_runner()
+    if runner.get(args.id) is None:
+        print("Corrida no encontrada.", file=sys.stderr)
+        return 1
+    _show(runner.cancel(args.id))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Analisis de catalogos completos con la Batch API de Gemini",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_start = sub.add_parser("start", help="Enviar un catalogo (PDF o carpeta de fotos)")
+    p_start.add_argument("source", help="PDF del catalogo o carpeta con las fotos")
+    p_start.add_argument("--name", default="", help="Nombre de la corrida (default: el del archivo)")
+    p_start.add_argument("--wait", action="store_true", help="Esperar a que termine")
+    p_start.add_argument("--poll", type=float, default=None,
+                         help=f"Segundos entre consultas (default: AI_BATCH_POLL_S={Config.AI_BATCH_POLL_S:g})")
+    p_start.set_defaults(func=_cmd_start)
+
+    p_status = sub.add_parser("status", help="Progreso de las corridas (o de una, con sus errores)")
+    p_status.add_argument("id", nargs="?", help="Id de la corrida")
+    p_status.set_defaults(func=_cmd_status)
+
+    p_resume = sub.add_parser("resume", help="Retomar las corridas sin terminar (tras un reinicio); las "
+                              "que tienen paginas del backend sin enviar las retoma el backend")
+    p_resume.add_argument("--wait", action="store_true", help="Esperar a que terminen")
+    p_resume.add_argument("--poll", type=float, default=None, help="Segundos entre consultas")
+    p_resume.set_defaults(func=_cmd_resume)
+
+    p_cancel = sub.add_parser("cancel", help="Cancelar una corrida")
+    p_cancel.add_argument("id", help="Id de la corrida")
+    p_cancel.set_defaults(func=_cmd_cancel)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
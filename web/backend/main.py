@@ -14,22 +14,25 @@ IMPORTANTE: automatizar Facebook puede violar sus Terminos. Usar solo con
 cuenta y productos propios, bajo tu responsabilidad.
 """
 import os
-import io
 import sys
 import json
 import uuid
 import queue
+import hashlib
+import secrets
 import asyncio
 import datetime
 import threading
+import contextvars
 from pathlib import Path
 from typing import List
 from collections import defaultdict
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, Request
+from fastapi import (FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Header, HTTPException,
+                     Request)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from PIL import Image
 
 # --- importar modulos del repo (raiz/src) ---
@@ -38,11 +41,20 @@ sys.path.insert(0, str(REPO_ROOT / "src"))
 
 from config.settings import Config                       # noqa: E402
 from modules.pdf_extractor import PDFImageExtractor      # noqa: E402
-from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+from modules.render_cache import RenderCache, file_sha256  # noqa: E402
+from modules.image_encoder import encode_image, EncodeStats  # noqa: E402
+from modules.ai_analyzer import AIImageAnalyzer, analysis_cache_key  # noqa: E402
+from modules.ai_backends import create_client             # noqa: E402
+from modules.analysis_store import AnalysisStore          # noqa: E402
+from modules.metrics_store import MetricsStore, account as metrics_account  # noqa: E402
+from modules.single_flight import SingleFlight, wait as wait_flight  # noqa: E402
+from modules.batch_jobs import BatchJobRunner             # noqa: E402
 from modules.facebook_auth import FacebookAuthenticator  # noqa: E402
 from modules.marketplace_automation import MarketplaceAutomation  # noqa: E402
 from modules.history import ListingHistory               # noqa: E402
 from modules.human import human_gap                      # noqa: E402
+from workspaces import manager as workspaces             # noqa: E402
+from prefetch import prefetcher                          # noqa: E402
 
 app = FastAPI(title="Marketplace Automation - Web", version="1.0.0")
 app.add_middleware(
@@ -50,20 +62,44 @@ app.add_middleware(
 )
 
 # --- rutas de trabajo (relativas a web/backend) ---
+# (las imagenes viven en workspaces/<id>/; temp_images/ queda por compatibilidad)
 WORK = Path(__file__).resolve().parent
-TEMP_DIR = WORK / "temp_images"
-TEMP_DIR.mkdir(exist_ok=True)
 (WORK / "screenshots").mkdir(exist_ok=True)
 
 cfg = Config()
 # Modo demo: para el showcase publico (no abre Chrome ni publica de verdad)
 DEMO_MODE = os.getenv("MARKETPLACE_DEMO", "0") == "1"
-extractor = PDFImageExtractor(temp_dir=str(TEMP_DIR))
+# Rutas de Config (RENDER_CACHE_DIR, AI_CACHE_DB, ...): las relativas cuelgan
+# de web/backend, las absolutas se respetan tal cual
+render_cache = RenderCache(str(WORK / cfg.RENDER_CACHE_DIR), cfg.RENDER_CACHE_MAX_MB * 1024 * 1024,
+                           cfg.RENDER_CACHE_MAX_ENTRIES)
+
+
+def _new_extractor(temp_dir):
+    """Un extractor por workspace (el cache de render es compartido)."""
+    return PDFImageExtractor(temp_dir=temp_dir, backend=cfg.PDF_BACKEND,
+                             parallel_min_pages=cfg.PDF_PARALLEL_MIN_PAGES, cache=render_cache,
+                             passthrough=cfg.PDF_JPEG_PASSTHROUGH, full_dpi=cfg.FULL_DPI,
+                             image_format=cfg.IMAGE_FORMAT, image_quality=cfg.IMAGE_QUALITY,
+                             max_inflight_pages=cfg.PDF_MAX_INFLIGHT_PAGES)
+
+
+# Workspaces aislados por subida (ver workspaces.py); la sesion suelta el suyo
+# tras WORKSPACE_IDLE_MIN minutos sin uso
+workspaces.extractor_factory = _new_extractor
+workspaces.idle_seconds = int(os.getenv("WORKSPACE_IDLE_MIN", "720")) * 60
 history = ListingHistory(str(WORK / "listings_history.json"), str(WORK / "logs"))
 analyzer = None
-if cfg.GEMINI_API_KEY:
+if cfg.GEMINI_API_KEY or cfg.AI_BACKEND == "fake":
     try:
-        analyzer = AIImageAnalyzer(cfg.GEMINI_API_KEY, cfg.AI_MODEL_IMAGE, cfg.MAX_IMAGE_SIZE)
+        analyzer = AIImageAnalyzer(cfg.GEMINI_API_KEY, cfg.AI_MODEL_IMAGE, cfg.MAX_IMAGE_SIZE,
+                                   cfg.AI_MAX_CONCURRENCY, cfg.AI_IMAGES_PER_REQUEST,
+                                   requests_per_minute=cfg.AI_REQUESTS_PER_MINUTE,
+                                   max_retries=cfg.AI_MAX_RETRIES, pdf_text=cfg.AI_PDF_TEXT,
+                                   escalate_model=cfg.AI_MODEL_CHAT if cfg.AI_CASCADE else None,
+                                   min_confidence=cfg.AI_CASCADE_MIN_CONFIDENCE,
+                                   client=create_client(cfg),
+                                   resolution_steps=cfg.AI_RESOLUTION_STEPS)
     except Exception as e:
         print(f"[IA] No se pudo iniciar: {e}")
 
@@ -77,23 +113,54 @@ SESSION = {
     "needs_2fa": False,
 }
 _2fa_event = threading.Event()
-_ai_cache_file = WORK / "ai_analysis_cache.json"
-
-
-def _load_cache():
-    if _ai_cache_file.exists():
-        try:
-            return json.loads(_ai_cache_file.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
-
-
-def _save_cache(cache):
-    _ai_cache_file.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
-
 
-AI_CACHE = _load_cache()
+# Analisis ya hechos (sqlite, ver analysis_store.py); cada analisis se guarda
+# al instante. Claves: sha256 de la imagen + version del prompt + modelo
+AI_CACHE = AnalysisStore(WORK / cfg.AI_CACHE_DB, cfg.AI_CACHE_MAX_ENTRIES, cfg.AI_CACHE_TTL_DAYS)
+AI_CACHE.import_json(WORK / "ai_analysis_cache.json")
+# Analisis en curso por clave de cache: la misma imagen pedida dos veces a la
+# vez (doble clic, lote + analisis manual, publicacion) hace UNA llamada
+INFLIGHT = SingleFlight()
+# Cada llamada a la IA (tokens, latencia, bytes, errores) y cada acierto de
+# cache, por dia / IP / modelo: ver /api/metrics
+METRICS = MetricsStore(WORK / cfg.AI_METRICS_DB, cfg.AI_METRICS_DAYS)
+
+
+def _source(path):
+    """Catalogo de una imagen para la resolucion adaptativa: el PDF del que
+    salio (su sha256, asi volver a subirlo reusa lo aprendido) o, para fotos
+    sueltas, un hash de su workspace. Nunca el id del workspace en si: sale
+    en /api/metrics (publico) y es lo unico que protege /api/img/<id>/..."""
+    parent = Path(path).parent
+    ws = workspaces.get(parent.name)
+    if ws is None:
+        return parent.name
+    return ws.source or hashlib.sha256(ws.id.encode()).hexdigest()[:16]
+
+
+if analyzer:
+    analyzer.metrics = METRICS.record
+    analyzer.source_of = _source
+
+# Catalogos completos por la Batch API (mitad de precio, resultados en horas;
+# ver batch_jobs.py). Las corridas viven en BATCH_JOBS_DIR (las comparte la CLI
+# batch_catalog.py) y un hilo las consulta cada AI_BATCH_POLL_S segundos, asi
+# que un reinicio del backend las retoma. Las imagenes sin enviar se preparan
+# siempre en alta resolucion (ver _batch_prepare) y sus workspaces sobreviven
+# al reinicio
+BATCH = (BatchJobRunner(analyzer, AI_CACHE, WORK / cfg.BATCH_JOBS_DIR, cfg.AI_BATCH_INLINE_MB, cfg.AI_BATCH_POLL_S)
+         if analyzer else None)
+workspaces.purge_orphans(keep={Path(p).parent.name for p in BATCH.pending_paths()} if BATCH else ())
+
+
+def _model():
+    return analyzer.model if analyzer else "demo"
+
+
+def _cache_key(fp):
+    """Clave de AI_CACHE para el archivo fp (el modo demo usa su propio espacio
+    para no mezclar productos simulados con analisis reales)."""
+    return analysis_cache_key(str(fp), _model())
 
 # --- guard de uso para /api/analyze (protege la cuota gratuita de Gemini) ---
 # El endpoint es publico (demo sin auth); limitamos analisis reales por dia.
@@ -110,11 +177,13 @@ def _rate_reset_if_needed():
         _rate["by_ip"] = defaultdict(int)
 
 
-def _rate_check(ip):
+def _rate_check(ip, reserve=0):
+    """reserve: analisis del dia que se dejan libres (el prefetch no gasta los
+    ultimos, quedan para lo que pida el usuario)."""
     _rate_reset_if_needed()
-    if _rate["global"] >= ANALYZE_DAILY_GLOBAL:
+    if _rate["global"] + reserve >= ANALYZE_DAILY_GLOBAL:
         return False, "Limite diario global de analisis IA alcanzado. Intenta de nuevo manana."
-    if _rate["by_ip"][ip] >= ANALYZE_DAILY_PER_IP:
+    if _rate["by_ip"][ip] + reserve >= ANALYZE_DAILY_PER_IP:
         return False, f"Alcanzaste el limite de {ANALYZE_DAILY_PER_IP} analisis IA por dia para esta sesion."
     return True, None
 
@@ -124,6 +193,98 @@ def _rate_bump(ip):
     _rate["by_ip"][ip] += 1
 
 
+# Los Batch jobs tienen su propia cuota (imagenes por dia): un catalogo entero
+# no cabe en la de /api/analyze y tampoco la agota
+BATCH_DAILY_GLOBAL = int(os.getenv("BATCH_DAILY_GLOBAL", "2000"))
+BATCH_DAILY_PER_IP = int(os.getenv("BATCH_DAILY_PER_IP", "500"))
+_batch_rate = {"date": None, "global": 0, "by_ip": defaultdict(int)}
+
+
+def _batch_quota(ip, images):
+    """Descuenta `images` de la cuota diaria de Batch jobs, si alcanza."""
+    today = datetime.date.today().isoformat()
+    if _batch_rate["date"] != today:
+        _batch_rate["date"] = today
+        _batch_rate["global"] = 0
+        _batch_rate["by_ip"] = defaultdict(int)
+    if _batch_rate["global"] + images > BATCH_DAILY_GLOBAL:
+        return False, "Limite diario global de Batch jobs alcanzado. Intenta de nuevo manana."
+    if _batch_rate["by_ip"][ip] + images > BATCH_DAILY_PER_IP:
+        left = BATCH_DAILY_PER_IP - _batch_rate["by_ip"][ip]
+        return False, f"El limite de Batch jobs es de {BATCH_DAILY_PER_IP} imagenes por dia (quedan {left})."
+    _batch_rate["global"] += images
+    _batch_rate["by_ip"][ip] += images
+    return True, None
+
+
+def _analyze_now(ws, fp, key, ip):
+    """Analiza fp (alta resolucion, o solo su texto) y guarda el resultado. El
+    llamador ya es el lider de INFLIGHT para key. Bloqueante."""
+    with workspaces.hold(ws):
+        hints = _page_hints(ws, fp)
+        if not analyzer.text_only(hints):
+            fp = _full_resolution(ws, fp)
+        info = analyzer.analyze_image_for_marketplace(str(fp), hints)
+    # Gemini caido: texto generico editable, pero no se guarda ni cuenta
+    if not info.get("fallback"):
+        _rate_bump(ip)
+        AI_CACHE.put(key, info)
+    return info
+
+
+def _analyze_flight(ws, fp, key, ip):
+    """_analyze_now que entrega el resultado (o el error) a INFLIGHT desde el
+    mismo hilo: si el cliente del lider se desconecta solo se cancela su
+    espera, y los que esperan la misma imagen reciben el analisis igual."""
+    try:
+        info = _analyze_now(ws, fp, key, ip)
+    except BaseException as e:
+        INFLIGHT.resolve(key, error=e)
+        raise
+    INFLIGHT.resolve(key, info)
+    return info
+
+
+# --- analisis especulativo tras la subida (opt-in, ver prefetch.py) ---
+PREFETCH = os.getenv("AI_PREFETCH", "0") == "1"
+PREFETCH_RESERVE = int(os.getenv("AI_PREFETCH_RESERVE", "5"))
+prefetcher.idle_seconds = int(os.getenv("AI_PREFETCH_IDLE_S", "60"))
+
+
+def _prefetch_one(name, ip):
+    """Un analisis del prefetcher (su hilo): "stop" si no queda cuota o Gemini
+    no responde, "skip" si no hace falta (cacheada, en curso, ya no existe)."""
+    metrics_account.set(ip)
+    ws, fp = workspaces.resolve(name)
+    if fp is None or not fp.exists():
+        return "skip"
+    key = _cache_key(fp)
+    if key in AI_CACHE:
+        return "skip"
+    if not _rate_check(ip, PREFETCH_RESERVE)[0]:
+        return "stop"
+    future, leader = INFLIGHT.claim(key)
+    if not leader:
+        return "skip"
+    try:
+        info = _analyze_now(ws, fp, key, ip)
+    except BaseException as e:
+        INFLIGHT.resolve(key, error=e)
+        raise
+    INFLIGHT.resolve(key, info)
+    return "stop" if info.get("fallback") else "ok"
+
+
+prefetcher.analyze = _prefetch_one
+
+
+def _prefetch(ws, paths, request):
+    """Encola las imagenes recien subidas (si AI_PREFETCH y hay IA real)."""
+    if PREFETCH and analyzer:
+        prefetcher.enqueue(ws.id, [ws.name_for(p) for p in paths],
+                           request.client.host if request.client else "?")
+
+
 # ======================================================================
 #  Salud / configuracion
 # ======================================================================
@@ -134,6 +295,7 @@ def health():
         "demo": DEMO_MODE,
         "ai_ready": analyzer is not None or DEMO_MODE,
         "ai_real": analyzer is not None,   # IA de verdad (no datos simulados)
+        "ai_backend": cfg.AI_BACKEND if analyzer else None,
         "logged_in": SESSION["logged_in"],
     }
 
@@ -189,91 +351,609 @@ async def set_config(payload: dict):
     return get_config()
 
 
+# ======================================================================
+#  Workspaces: cada subida trabaja en su directorio, con nombres "<id>/<archivo>"
+# ======================================================================
+def _resolve(name):
+    """Nombre publico -> (workspace, Path) del archivo; 404 si no existe."""
+    ws, fp = workspaces.resolve(name)
+    if fp is None or not fp.exists():
+        raise HTTPException(404, f"imagen no encontrada: {name}")
+    return ws, fp
+
+
+def _full_resolution(ws, fp):
+    """Alta resolucion de una pagina (las fotos sueltas se devuelven tal cual)."""
+    return Path(ws.extractor.full_resolution(str(fp))) if ws else fp
+
+
+def _page_hints(ws, fp):
+    """Precio/texto de la capa de texto del PDF (None para fotos sueltas)."""
+    return ws.extractor.page_hints(str(fp)) if ws else None
+
+
+_restore_lock = threading.Lock()
+
+
+def _batch_prepare(path):
+    """Alta resolucion de una imagen de una corrida de Batch jobs. Si su
+    workspace es de antes de un reinicio (purge_orphans lo conservo) se vuelve
+    a registrar y sus paginas se extraen otra vez a PREVIEW_DPI (desde el
+    cache de render), asi full_resolution sabe de que pagina sale cada una."""
+    fp = Path(path)
+    with _restore_lock:
+        ws = workspaces.get(fp.parent.name)
+        if ws is None and fp.parent.parent == workspaces.root:
+            ws = workspaces.adopt(fp.parent.name)
+            pdf = fp.parent / "upload.pdf"
+            if ws and pdf.exists():
+                ws.source = file_sha256(pdf)
+                ws.extractor.extract_images_from_pdf(str(pdf), dpi=cfg.PREVIEW_DPI, content_hash=ws.source)
+    with workspaces.hold(ws):
+        return str(_full_resolution(ws, fp))
+
+
+if BATCH:
+    BATCH.prepare = _batch_prepare
+    BATCH.watch()
+
+
+# Subidas: se copian a disco por bloques (memoria plana con subidas grandes
+# concurrentes) y el sha256 sale de la misma pasada
+UPLOAD_CHUNK = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+# Margen del cuerpo multipart sobre el archivo (cabeceras, boundary, campos)
+UPLOAD_OVERHEAD = 1024 * 1024
+UPLOAD_PATHS = {"/api/upload-pdf", "/api/upload-pdf-stream", "/api/upload-images"}
+
+
+class UploadLimit:
+    """Corta las subidas demasiado grandes ANTES de que Starlette guarde el
+    cuerpo multipart entero: 413 de entrada si el Content-Length ya supera
+    MAX_UPLOAD_MB y, sin Content-Length (chunked), apenas lo recibido lo
+    supera. El limite es por peticion (varias fotos suman)."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self):
+        return HTTPException(413, f"La subida supera el maximo de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in UPLOAD_PATHS:
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": self._too_large().detail}, status_code=413)
+            return await response(scope, receive, send)
+        received = 0
+
+        async def limited():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                raise self._too_large()
+            return message
+
+        await self.app(scope, limited, send)
+
+
+app.add_middleware(UploadLimit, max_bytes=MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD)
+
+
+def _copy_upload(src, dest: Path, max_bytes: int, filename: str):
+    """Copia bloqueante del archivo temporal de Starlette (corre en un hilo)."""
+    digest = hashlib.sha256()
+    size = 0
+    src.seek(0)
+    with open(dest, "wb") as out:
+        while True:
+            chunk = src.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(413, f"{filename}: supera el maximo de "
+                                         f"{max_bytes // (1024 * 1024)} MB")
+            digest.update(chunk)
+            out.write(chunk)
+    return size, digest.hexdigest()
+
+
+async def _stream_to_disk(upload: UploadFile, dest: Path, max_bytes: int = None):
+    """Escribe la subida en dest por bloques, fuera del event loop. Devuelve
+    (bytes, sha256); 413 si supera max_bytes (MAX_UPLOAD_MB por defecto) y no
+    deja el archivo a medias. Las subidas que ya exceden el limite del cuerpo
+    las corta antes UploadLimit."""
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    try:
+        return await asyncio.to_thread(_copy_upload, upload.file, dest, max_bytes, upload.filename)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+
+
+def _encode_upload(raw: Path, base: str):
+    """Valida (abriendo con PIL) y normaliza una foto subida segun IMAGE_FORMAT."""
+    with Image.open(raw) as img:
+        img.load()
+        return encode_image(img.convert("RGB"), base, cfg.IMAGE_FORMAT, cfg.IMAGE_QUALITY)
+
+
+def _item(ws, path, **extra):
+    name = ws.name_for(path)
+    return {**extra, "filename": name, "url": f"/api/img/{name}"}
+
+
+def _leave(ws_id):
+    """La sesion suelta su workspace: tambien se descarta su prefetch."""
+    workspaces.disown(ws_id)
+    prefetcher.drop(ws_id)
+
+
+@app.delete("/api/workspaces/{ws_id}")
+def release_workspace(ws_id: str):
+    """El dashboard deja su workspace (boton Limpiar). Los jobs del relay que
+    aun usan sus imagenes lo mantienen vivo hasta terminar."""
+    _leave(ws_id)
+    return {"ok": True}
+
+
+@app.post("/api/workspaces/{ws_id}/heartbeat")
+def workspace_heartbeat(ws_id: str):
+    """El dashboard sigue abierto: mantiene vivo el workspace (y su prefetch,
+    que se descarta tras AI_PREFETCH_IDLE_S sin latidos)."""
+    alive = workspaces.get(ws_id) is not None
+    return {"alive": alive, "prefetch": prefetcher.heartbeat(ws_id)}
+
+
 # ======================================================================
 #  PDF -> imagenes
 # ======================================================================
 @app.post("/api/upload-pdf")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(request: Request, file: UploadFile = File(...), workspace: str = Form("")):
+    """`workspace`: el de la subida anterior de esta sesion, que se libera."""
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(400, "Sube un archivo PDF")
-    # limpiar imagenes anteriores
-    extractor.cleanup()
-    dest = WORK / "upload.pdf"
-    dest.write_bytes(await file.read())
+    if workspace:
+        _leave(workspace)
+    ws = workspaces.create()
+    dest = ws.path / "upload.pdf"
     try:
-        paths = extractor.extract_images_from_pdf(str(dest))
+        _, digest = await _stream_to_disk(file, dest)
+    except HTTPException:
+        workspaces.disown(ws.id)
+        raise
+    ws.source = digest
+    try:
+        with workspaces.hold(ws):
+            paths = await asyncio.to_thread(ws.extractor.extract_images_from_pdf, str(dest),
+                                            dpi=cfg.PREVIEW_DPI, content_hash=digest)
     except Exception as e:
+        workspaces.disown(ws.id)
         raise HTTPException(500, f"No se pudo procesar el PDF: {e}")
-    items = []
-    for i, p in enumerate(paths, 1):
-        fn = os.path.basename(p)
-        items.append({"page": i, "filename": fn, "url": f"/api/img/{fn}"})
-    return {"count": len(items), "items": items}
+    _prefetch(ws, paths, request)
+    items = [_item(ws, p, page=i) for i, p in enumerate(paths, 1)]
+    return {"workspace": ws.id, "sha256": digest, "count": len(items), "items": items,
+            "encoding": ws.extractor.encode_stats.as_dict()}
+
+
+@app.post("/api/upload-pdf-stream")
+async def upload_pdf_stream(request: Request, file: UploadFile = File(...), workspace: str = Form("")):
+    """Igual que /api/upload-pdf pero transmite cada pagina (NDJSON, una linea
+    por evento) apenas se escribe en disco. El primer evento ('start') trae el
+    id del workspace. Si el cliente se desconecta se cancela la extraccion
+    antes de la siguiente pagina."""
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(400, "Sube un archivo PDF")
+    if workspace:
+        _leave(workspace)
+    ws = workspaces.create()
+    dest = ws.path / "upload.pdf"
+    try:
+        _, digest = await _stream_to_disk(file, dest)
+    except HTTPException:
+        workspaces.disown(ws.id)
+        raise
+    ws.source = digest
+    cancel = threading.Event()
+    pages = ws.extractor.iter_images_from_pdf(str(dest), dpi=cfg.PREVIEW_DPI, cancel_event=cancel,
+                                              content_hash=digest)
+    # next() y close() del generador nunca a la vez: si el cliente se va con
+    # una pagina en curso, el cierre espera a que termine
+    turn = threading.Lock()
+
+    def step():
+        with turn:
+            return next(pages, None)
+
+    def close():
+        with turn:
+            try:
+                pages.close()
+            finally:
+                workspaces.release(ws.id)
+
+    async def events():
+        count = 0
+        # referencia propia mientras se extrae: liberar el workspace a mitad no
+        # borra el directorio bajo el render
+        if not workspaces.acquire(ws.id):
+            return
+        try:
+            # total al instante (solo trailer/xref) para la barra de progreso
+            info = await asyncio.to_thread(ws.extractor.get_pdf_info, str(dest))
+            yield json.dumps({"type": "start", "workspace": ws.id, "sha256": digest,
+                              "total": info["num_pages"]}) + "\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    ev = await asyncio.to_thread(step)
+                except Exception as e:
+                    yield json.dumps({"type": "error", "message": f"No se pudo procesar el PDF: {e}"}) + "\n"
+                    return
+                if ev is None:
+                    break
+                count += 1
+                _prefetch(ws, [ev["path"]], request)
+                yield json.dumps(_item(ws, ev["path"], type="page", page=ev["page"], total=ev["total"])) + "\n"
+            yield json.dumps({"type": "done", "count": count,
+                              "encoding": ws.extractor.encode_stats.as_dict()}) + "\n"
+        finally:
+            # cierra el documento (y suelta el workspace) sin esperar en el loop
+            cancel.set()
+            asyncio.get_running_loop().run_in_executor(None, close)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 
 @app.post("/api/upload-images")
-async def upload_images(files: List[UploadFile] = File(...)):
+async def upload_images(request: Request, files: List[UploadFile] = File(...), workspace: str = Form("")):
     """Sube fotos directamente (sin PDF): seleccion multiple, pegado o arrastrar.
-    Cada imagen se normaliza a PNG y se agrega al set de trabajo."""
+    Cada imagen se normaliza segun IMAGE_FORMAT y se agrega al workspace de la
+    sesion (`workspace`), o a uno nuevo si no hay. Las fotos repetidas (mismo
+    sha256 que una ya guardada en el workspace) se omiten y se cuentan en
+    `duplicates`."""
+    ws = workspaces.get(workspace) if workspace else None
+    if ws is None:
+        ws = workspaces.create()
     saved = []
-    for f in files:
-        # No confiamos en el content-type del cliente: validamos abriendo con PIL.
-        try:
-            data = await f.read()
-            img = Image.open(io.BytesIO(data))
-            img.load()
-            img = img.convert("RGB")
-        except Exception:
-            continue
-        fn = f"img_{uuid.uuid4().hex[:10]}.png"
-        img.save(TEMP_DIR / fn, "PNG")
-        saved.append({"filename": fn, "url": f"/api/img/{fn}"})
-    if not saved:
+    duplicates = 0
+    stats = EncodeStats()
+    try:
+        with workspaces.hold(ws):
+            for f in files:
+                raw = ws.path / f"upload_{uuid.uuid4().hex[:10]}"
+                _, digest = await _stream_to_disk(f, raw)
+                if digest in ws.uploads:
+                    raw.unlink()
+                    duplicates += 1
+                    continue
+                # No confiamos en el content-type del cliente: validamos abriendo con PIL.
+                try:
+                    path, st = await asyncio.to_thread(_encode_upload, raw,
+                                                       str(ws.path / f"img_{uuid.uuid4().hex[:10]}"))
+                except Exception:
+                    continue
+                finally:
+                    raw.unlink(missing_ok=True)
+                stats.add(st)
+                ws.uploads[digest] = path
+                saved.append(_item(ws, path))
+    except FileNotFoundError:
+        raise HTTPException(409, "El workspace fue liberado, vuelve a subir las fotos")
+    except HTTPException:
+        if ws.id != workspace:
+            workspaces.disown(ws.id)
+        raise
+    if not saved and not duplicates:
+        if ws.id != workspace:
+            workspaces.disown(ws.id)
         raise HTTPException(400, "No se recibieron imagenes validas (sube JPG/PNG)")
-    return {"count": len(saved), "items": saved}
+    _prefetch(ws, [ws.path / Path(it["filename"]).name for it in saved], request)
+    return {"workspace": ws.id, "count": len(saved), "duplicates": duplicates, "items": saved,
+            "encoding": stats.as_dict()}
 
 
-@app.get("/api/img/{filename}")
+@app.get("/api/img/{filename:path}")
 def get_image(filename: str):
-    safe = os.path.basename(filename)
-    fp = TEMP_DIR / safe
-    if not fp.exists():
-        raise HTTPException(404, "imagen no encontrada")
+    _, fp = _resolve(filename)
     return FileResponse(fp)
 
 
+@app.post("/api/full-res")
+async def full_res(payload: dict):
+    """Renderiza (bajo demanda) la version de alta resolucion de las paginas
+    indicadas y devuelve {filename_preview: filename_full}. La usa el dashboard
+    antes de mandar un job al agente, que descarga las imagenes por nombre."""
+    out = {}
+    for name in payload.get("filenames", []):
+        ws, fp = _resolve(name)
+        with workspaces.hold(ws):
+            full = await asyncio.to_thread(_full_resolution, ws, fp)
+        out[name] = ws.name_for(full) if ws else name
+    return {"files": out}
+
+
 # ======================================================================
 #  Analisis IA
 # ======================================================================
 @app.post("/api/analyze")
 async def analyze(payload: dict, request: Request):
-    fn = os.path.basename(payload.get("filename", ""))
+    fn = payload.get("filename", "")
     # ---- IA REAL: si hay analyzer (GEMINI_API_KEY presente) se analiza de verdad,
     #      aunque el resto de la demo (publicacion) siga simulado. ----
     if analyzer:
-        fp = TEMP_DIR / fn
-        if not fp.exists():
-            raise HTTPException(404, "imagen no encontrada")
-        if fn in AI_CACHE and not payload.get("force"):
-            return {"cached": True, "real": True, **AI_CACHE[fn]}
         ip = request.client.host if request.client else "?"
+        metrics_account.set(ip)
+        ws, fp = _resolve(fn)
+        key = await asyncio.to_thread(_cache_key, fp)
+        cached = None if payload.get("force") else await asyncio.to_thread(AI_CACHE.get, key)
+        if cached:
+            await asyncio.to_thread(METRICS.hit, _model())
+            return {"cached": True, "real": True, **cached}
+        future, leader = INFLIGHT.claim(key)
+        if not leader:
+            # ya se esta analizando esta imagen: se espera ese resultado (sin
+            # otra llamada a Gemini ni gastar cuota)
+            info = await wait_flight(future)
+            await asyncio.to_thread(METRICS.hit, _model(), "coalesced")
+            return {"cached": False, "real": not info.get("fallback"), "coalesced": True, **info}
         ok, msg = _rate_check(ip)
         if not ok:
+            INFLIGHT.resolve(key, error=HTTPException(429, msg))
             raise HTTPException(429, msg)
-        info = await asyncio.to_thread(analyzer.analyze_image_for_marketplace, str(fp))
-        _rate_bump(ip)
-        AI_CACHE[fn] = info
-        _save_cache(AI_CACHE)
-        return {"cached": False, "real": True, **info}
+        with prefetcher.preempt():
+            # shield: cancelar esta espera no debe cancelar el hilo aun en cola
+            info = await asyncio.shield(asyncio.to_thread(_analyze_flight, ws, fp, key, ip))
+        return {"cached": False, "real": not info.get("fallback"), **info}
     # ---- Fallback simulado (sin key) ----
     if DEMO_MODE:
         await asyncio.sleep(0.8)  # simular el tiempo de la IA
         info = _demo_info(fn)
-        AI_CACHE[fn] = info
+        ws, fp = workspaces.resolve(fn)
+        if fp is not None and fp.exists():
+            AI_CACHE[_cache_key(fp)] = info
         return {"cached": False, "demo": True, **info}
     raise HTTPException(400, "Falta GEMINI_API_KEY en el .env")
 
 
+@app.post("/api/analyze-batch")
+async def analyze_batch(payload: dict, request: Request):
+    """Analiza varias imagenes en paralelo (AI_MAX_CONCURRENCY llamadas a la
+    vez) y transmite cada resultado (NDJSON) apenas termina, en orden de
+    llegada: {"type": "result", "filename", "cached", ...info} o
+    {"type": "error", "filename", "message"} por item, y al final "done" con
+    el consumo de tokens (con AI_IMAGES_PER_REQUEST > 1 van varias imagenes
+    por llamada)."""
+    names = [str(n) for n in payload.get("filenames", [])]
+    force = payload.get("force")
+    if not analyzer and not DEMO_MODE:
+        raise HTTPException(400, "Falta GEMINI_API_KEY en el .env")
+    ip = request.client.host if request.client else "?"
+
+    def line(**ev):
+        return json.dumps(ev) + "\n"
+
+    def lookup():
+        """(nombre, workspace, ruta, clave, analisis cacheado) de cada imagen;
+        ruta None si no existe."""
+        out = []
+        for name in names:
+            ws, fp = workspaces.resolve(name)
+            if fp is None or not fp.exists():
+                out.append((name, ws, None, None, None))
+            else:
+                key = _cache_key(fp)
+                out.append((name, ws, fp, key, None if force else AI_CACHE.get(key)))
+        return out
+
+    async def events():
+        metrics_account.set(ip)
+        ok = failed = 0
+        hits = 0
+        pending = []   # (nombre, workspace, ruta, clave) a analizar
+        waiting = []   # (nombre, Future) de imagenes que ya analiza otro
+        claimed = set()
+
+        def settle(key, info=None, error=None):
+            claimed.discard(key)
+            INFLIGHT.resolve(key, info, error)
+
+        cancel = threading.Event()
+        results = None
+        held = []
+        # los analisis que pide el usuario van antes que el prefetch
+        with prefetcher.preempt():
+            try:
+                for name, ws, fp, key, cached in await asyncio.to_thread(lookup):
+                    if fp is None:
+                        failed += 1
+                        yield line(type="error", filename=name, message="imagen no encontrada")
+                        continue
+                    if cached:
+                        ok += 1
+                        hits += 1
+                        yield line(type="result", filename=name, cached=True, **cached)
+                        continue
+                    future, leader = INFLIGHT.claim(key)
+                    if not leader:
+                        waiting.append((name, future))
+                        continue
+                    claimed.add(key)
+                    if analyzer:
+                        # las ya encoladas cuentan como reservadas; la cuota se
+                        # gasta solo por resultado exitoso (como /api/analyze)
+                        allowed, msg = _rate_check(ip, reserve=len(pending))
+                        if not allowed:
+                            failed += 1
+                            settle(key, error=RuntimeError(msg))
+                            yield line(type="error", filename=name, message=msg)
+                            continue
+                    pending.append((name, ws, fp, key))
+                if hits:
+                    await asyncio.to_thread(METRICS.hit, _model(), "cache_hit", hits)
+
+                if not analyzer:
+                    # ---- Fallback simulado (modo demo sin key) ----
+                    for name, _, _, key in pending:
+                        await asyncio.sleep(0.3)
+                        info = _demo_info(name)
+                        AI_CACHE[key] = info
+                        settle(key, info)
+                        ok += 1
+                        yield line(type="result", filename=name, cached=False, demo=True, **info)
+                else:
+                    held = [ws.id for ws in {p[1] for p in pending if p[1]} if workspaces.acquire(ws.id)]
+                    results = analyzer.iter_analyze_batch(
+                        pending, prepare=lambda p: str(_full_resolution(p[1], p[2])), cancel_event=cancel,
+                        hints=lambda p: _page_hints(p[1], p[2]))
+                    while True:
+                        if await request.is_disconnected():
+                            return
+                        res = await asyncio.to_thread(next, results, None)
+                        if res is None:
+                            break
+                        name, key = res["item"][0], res["item"][3]
+                        if res["error"]:
+                            failed += 1
+                            settle(key, error=RuntimeError(res["error"]))
+                            yield line(type="error", filename=name, message=res["error"])
+                            continue
+                        ok += 1
+                        _rate_bump(ip)
+                        await asyncio.to_thread(AI_CACHE.put, key, res["info"])
+                        settle(key, res["info"])
+                        yield line(type="result", filename=name, cached=False, real=True,
+                                   tokens=res["tokens"], **res["info"])
+
+                # Repetidas (en este lote o ya en curso en otra peticion): el
+                # resultado de esa unica llamada
+                for name, future in waiting:
+                    try:
+                        info = await wait_flight(future)
+                    except Exception as e:
+                        failed += 1
+                        yield line(type="error", filename=name, message=str(e))
+                        continue
+                    ok += 1
+                    await asyncio.to_thread(METRICS.hit, _model(), "coalesced")
+                    yield line(type="result", filename=name, cached=False, coalesced=True,
+                               real=not info.get("fallback"), **info)
+                if analyzer:
+                    yield line(type="done", ok=ok, failed=failed, usage=analyzer.usage_stats())
+                else:
+                    yield line(type="done", ok=ok, failed=failed)
+            finally:
+                cancel.set()
+                if results is not None:
+                    results.close()
+                for key in list(claimed):
+                    settle(key, error=RuntimeError("cancelado"))
+                for ws_id in held:
+                    workspaces.release(ws_id)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.get("/api/metrics")
+def get_metrics(days: int = 7, by: str = "day", x_admin_token: str | None = Header(default=None)):
+    """Consumo de la IA de los ultimos `days` dias agrupado por day | account
+    (IP) | model: llamadas, errores, imagenes, aciertos de cache, tokens,
+    bytes de imagen enviados, costo estimado (USD) y latencia p50/p95.
+    by=account expone las IPs de los clientes y su gasto: requiere el token
+    admin (header X-Admin-Token = ELEKA_ADMIN_TOKEN, como /api/license/admin)."""
+    if by == "account":
+        expected = os.getenv("ELEKA_ADMIN_TOKEN")
+        if not expected or not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+            raise HTTPException(401, "Token de administrador invalido")
+    try:
+        rows = METRICS.summary(days, by)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"days": days, "by": by, "rows": rows,
+            "session": analyzer.usage_stats() if analyzer else None}
+
+
+@app.post("/api/batch-jobs")
+async def start_batch_job(payload: dict, request: Request):
+    """Analiza `filenames` (un catalogo entero) como Batch job de Gemini: mitad
+    de precio y sin la cuota por minuto, pero los resultados llegan en horas y
+    van directo al cache de analisis. Devuelve el progreso al instante; las
+    paginas se renderizan en alta resolucion y se envian en segundo plano.
+    Las imagenes que no estan en cache cuentan para la cuota diaria de Batch
+    jobs (BATCH_DAILY_*), aparte de la de /api/analyze."""
+    if not BATCH:
+        raise HTTPException(400, "Falta GEMINI_API_KEY en el .env")
+    ip = request.client.host if request.client else "?"
+    names = [str(n) for n in payload.get("filenames", [])]
+
+    def lookup():
+        found = {}
+        for name in names:
+            ws, fp = workspaces.resolve(name)
+            if fp is not None and fp.exists():
+                found[str(fp)] = ws
+        uncached = sum(1 for fp in found if AI_CACHE.get(_cache_key(fp)) is None)
+        return found, uncached
+
+    found, uncached = await asyncio.to_thread(lookup)
+    if not found:
+        raise HTTPException(404, "No se encontro ninguna imagen")
+    if uncached:
+        ok, msg = _batch_quota(ip, uncached)
+        if not ok:
+            raise HTTPException(429, msg)
+    # los workspaces no se borran mientras se preparan y envian sus imagenes
+    # (las prepara BATCH.prepare, aqui o en el hilo que vigila las corridas)
+    held = [ws.id for ws in {ws for ws in found.values() if ws} if workspaces.acquire(ws.id)]
+    try:
+        run = await asyncio.to_thread(BATCH.create, list(found), lambda p: _page_hints(found[p], p),
+                                      payload.get("name"), ip)
+    except Exception:
+        for ws_id in held:
+            workspaces.release(ws_id)
+        raise
+
+    def send():
+        try:
+            BATCH.submit(run["id"])
+        except Exception as e:
+            print(f"[batch] No se pudo enviar la corrida {run['id']}: {e}")
+        finally:
+            for ws_id in held:
+                workspaces.release(ws_id)
+
+    threading.Thread(target=send, daemon=True).start()
+    return run
+
+
+@app.get("/api/batch-jobs")
+def list_batch_jobs():
+    """Corridas de Batch jobs (las del backend y las de la CLI), la mas reciente primero."""
+    return {"runs": BATCH.runs() if BATCH else []}
+
+
+@app.get("/api/batch-jobs/{run_id}")
+def get_batch_job(run_id: str):
+    """Progreso de una corrida y los errores de sus imagenes ('<workspace>/<archivo>')."""
+    progress = BATCH.get(run_id) if BATCH else None
+    if progress is None:
+        raise HTTPException(404, "Corrida no encontrada")
+    errors = {f"{Path(p).parent.name}/{Path(p).name}": e for p, e in BATCH.errors(run_id).items()}
+    return {**progress, "errors": errors}
+
+
+@app.post("/api/batch-jobs/{run_id}/cancel")
+def cancel_batch_job(run_id: str):
+    if not BATCH or BATCH.get(run_id) is None:
+        raise HTTPException(404, "Corrida no encontrada")
+    return BATCH.cancel(run_id)
+
+
 # ======================================================================
 #  Login / sesion
 # ======================================================================
@@ -364,7 +1044,7 @@ def _publish_worker(items, evq: "queue.Queue"):
         emit(type="start", total=total, remaining_today=cfg.MAX_LISTINGS_PER_DAY)
         ok = 0
         for i, item in enumerate(items, 1):
-            fn = os.path.basename(item.get("filename", f"item{i}"))
+            fn = item.get("filename", f"item{i}")
             info = {"title": item.get("title") or _demo_info(fn)["title"], "price": item.get("price") or "15"}
             emit(type="item_start", page=i, filename=fn)
             emit(type="log", message=f"[DEMO] Analizando {fn}...")
@@ -406,23 +1086,43 @@ def _publish_worker(items, evq: "queue.Queue"):
         if ok >= remaining:
             emit(type="log", message="Limite diario alcanzado, deteniendo.")
             break
-        fn = os.path.basename(item.get("filename", ""))
-        fp = TEMP_DIR / fn
+        fn = item.get("filename", "")
         emit(type="item_start", page=i, filename=fn)
+        # la vista previa del grid no sirve para IA/Facebook: alta resolucion
+        try:
+            ws, src = workspaces.resolve(fn)
+            if src is None or not src.exists():
+                raise FileNotFoundError(f"imagen no encontrada: {fn}")
+            fp = _full_resolution(ws, src)
+            key = _cache_key(src)
+        except Exception as e:
+            fail += 1
+            history.record(fn, "(render fallido)", "0", "failed", error=e)
+            emit(type="item_done", page=i, status="failed", error=str(e))
+            continue
 
         # info: usa override del usuario o cache o IA
         info = None
         if item.get("title") and item.get("price") and item.get("description"):
             info = {"title": item["title"], "price": str(item["price"]),
                     "description": item["description"], "tags": item.get("tags", [])}
-        elif fn in AI_CACHE:
-            info = AI_CACHE[fn]
         else:
+            info = AI_CACHE.get(key)
+            if info is not None:
+                METRICS.hit(_model())
+        if info is None:
+            def analyze_now():
+                info = analyzer.analyze_image_for_marketplace(str(fp), _page_hints(ws, src))
+                if info.get("fallback"):
+                    # no publicar el texto generico como si fuera el producto
+                    raise RuntimeError(f"IA no disponible: {info['error']}")
+                AI_CACHE[key] = info
+                return info
+
             try:
                 emit(type="log", message=f"Analizando {fn} con IA...")
-                info = analyzer.analyze_image_for_marketplace(str(fp))
-                AI_CACHE[fn] = info
-                _save_cache(AI_CACHE)
+                with prefetcher.preempt():
+                    info = INFLIGHT.run(key, analyze_now)
             except Exception as e:
                 fail += 1
                 history.record(fn, "(analisis fallido)", "0", "failed", error=e)
@@ -468,6 +1168,17 @@ def _publish_worker(items, evq: "queue.Queue"):
     evq.put(None)
 
 
+def _publish_worker_held(items, evq: "queue.Queue"):
+    """_publish_worker manteniendo vivos los workspaces de sus imagenes."""
+    ids = {workspaces.split(item.get("filename", ""))[0] for item in items} - {""}
+    held = [ws_id for ws_id in ids if workspaces.acquire(ws_id)]
+    try:
+        _publish_worker(items, evq)
+    finally:
+        for ws_id in held:
+            workspaces.release(ws_id)
+
+
 @app.websocket("/api/ws/publish")
 async def ws_publish(ws: WebSocket):
     await ws.accept()
@@ -480,7 +1191,9 @@ async def ws_publish(ws: WebSocket):
             return
 
         evq: "queue.Queue" = queue.Queue()
-        threading.Thread(target=_publish_worker, args=(items, evq), daemon=True).start()
+        metrics_account.set(ws.client.host if ws.client else "?")
+        threading.Thread(target=contextvars.copy_context().run, args=(_publish_worker_held, items, evq),
+                         daemon=True).start()
 
         loop = asyncio.get_event_loop()
         while True:
@@ -0,0 +1,117 @@
+"""
+Analisis especulativo tras la subida (backend web)
+==================================================
+Mientras el usuario revisa el grid, Gemini esta ocioso. Con AI_PREFETCH=1
+cada imagen subida (paginas del PDF o fotos) entra en esta cola y un hilo
+de baja prioridad la analiza y la deja en el cache de analisis: cuando el
+usuario pulsa "Analizar" (o publica) el resultado ya esta.
+
+Prioridad:
+  - los analisis que pide el usuario entran en preempt(): mientras haya
+    alguno en curso el prefetch no empieza llamadas nuevas (la que ya esta
+    en vuelo termina; si es la misma imagen, el single flight la comparte)
+  - el presupuesto diario lo decide la funcion `analyze` de main.py (deja
+    una reserva para los clics del usuario)
+
+Parada: la cola de una sesion (su workspace) se descarta cuando se suelta el
+workspace (Limpiar, otro catalogo), cuando el dashboard deja de mandar
+latidos durante `idle_seconds` (pestana cerrada) o cuando `analyze` responde
+"stop" (sin cuota, Gemini caido).
+"""
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class Prefetcher:
+    """Cola FIFO de analisis especulativos con un hilo trabajador."""
+
+    def __init__(self, analyze=None, idle_seconds: int = 60, poll_seconds: float = 1.0):
+        # callable(nombre, dueno) -> "ok" | "skip" | "stop"; lo configura main.py
+        self.analyze = analyze
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self._queue = deque()    # (workspace, nombre, dueno)
+        self._seen = {}          # workspace -> ultimo latido (time.time)
+        self._urgent = 0         # analisis del usuario en curso
+        self._stats = {"queued": 0, "analyzed": 0, "skipped": 0, "dropped": 0}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ---------- sesiones ----------
+    def enqueue(self, ws_id: str, names, owner=None) -> None:
+        """Agrega imagenes de la sesion `ws_id` (owner: p.ej. la IP, para la cuota)."""
+        names = list(names)
+        if not names:
+            return
+        with self._cond:
+            self._seen[ws_id] = time.time()
+            self._queue.extend((ws_id, name, owner) for name in names)
+            self._stats["queued"] += len(names)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def heartbeat(self, ws_id: str) -> dict:
+        """El dashboard sigue abierto. Devuelve cuantas imagenes le quedan en cola."""
+        with self._cond:
+            if ws_id in self._seen:
+                self._seen[ws_id] = time.time()
+            return {"queued": sum(1 for w, _, _ in self._queue if w == ws_id)}
+
+    def drop(self, ws_id: str) -> None:
+        """La sesion se fue: se descarta lo que le quedaba en cola."""
+        with self._cond:
+            self._drop_locked(ws_id)
+
+    @contextmanager
+    def preempt(self):
+        """Mientras dura el bloque (un analisis del usuario) no se empieza nada."""
+        with self._cond:
+            self._urgent += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._urgent -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "pending": len(self._queue), "sessions": len(self._seen)}
+
+    # ---------- internos ----------
+    def _drop_locked(self, ws_id: str) -> None:
+        self._seen.pop(ws_id, None)
+        before = len(self._queue)
+        self._queue = deque(q for q in self._queue if q[0] != ws_id)
+        self._stats["dropped"] += before - len(self._queue)
+
+    def _next(self):
+        with self._cond:
+            while True:
+                limit = time.time() - self.idle_seconds
+                for ws_id in [w for w, t in self._seen.items() if t < limit]:
+                    self._drop_locked(ws_id)
+                if self._queue and not self._urgent:
+                    return self._queue.popleft()
+                self._cond.wait(self.poll_seconds)
+
+    def _run(self) -> None:
+        while True:
+            ws_id, name, owner = self._next()
+            try:
+                outcome = self.analyze(name, owner) if self.analyze else "skip"
+            except Exception as e:
+                print(f"[prefetch] {name}: {e}")
+                outcome = "skip"
+            with self._cond:
+                self._stats["analyzed" if outcome == "ok" else "skipped"] += 1
+                if outcome == "stop":
+                    self._drop_locked(ws_id)
+
+
+# Instancia compartida por main.py
+prefetcher = Prefetcher()
@@ -9,13 +9,15 @@ el relay le despacha los jobs publicados desde el dashboard y reenvia de vuelta
 los eventos de progreso a los suscriptores del dashboard.
 
 Self-contained: este modulo NO toca main.py. Solo importa de `licensing` las dos
-funciones del contrato (`validate_key`, `account_id_for`). Se expone como un
-`APIRouter` en la variable `router`, que el orquestador incluira en main.py.
+funciones del contrato (`validate_key`, `account_id_for`) y de `workspaces` el
+registro de directorios de subida. Se expone como un `APIRouter` en la variable
+`router`, que el orquestador incluira en main.py.
 
 La publicacion real a Facebook NUNCA corre aqui; solo en el agente local.
 """
 import os
 import json
+import time
 import asyncio
 import hashlib
 from pathlib import Path
@@ -24,6 +26,8 @@ from typing import Dict, List
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import FileResponse
 
+from workspaces import manager as workspaces
+
 # ----------------------------------------------------------------------
 #  Import de la API de licencias (la construye Agente 1 en licensing.py).
 #  Como puede que aun no exista cuando se trabaja en paralelo, hacemos el
@@ -69,12 +73,16 @@ except Exception:  # ImportError u otro fallo de carga del modulo real
 
 
 # ----------------------------------------------------------------------
-#  Rutas de trabajo. Las imagenes que el dashboard subio via /api/upload-images
-#  viven en web/backend/temp_images/<filename> (mismo directorio que usa main.py).
+#  Rutas de trabajo. Las imagenes que el dashboard subio viven en el workspace
+#  de su subida (image_files = "<workspace>/<archivo>"); los nombres sueltos se
+#  buscan en web/backend/temp_images/. Cada job toma una referencia de sus
+#  workspaces para que no se borren mientras el agente los descarga; la suelta
+#  al terminar (job_done), si su agente se desconecta a mitad o si vence
+#  RELAY_JOB_TTL_S sin terminar (p.ej. encolado y el agente nunca se conecto).
 # ----------------------------------------------------------------------
 WORK = Path(__file__).resolve().parent
-TEMP_DIR = WORK / "temp_images"
-TEMP_DIR.mkdir(exist_ok=True)
+TEMP_DIR = workspaces.legacy_dir
+JOB_TTL_SECONDS = int(os.getenv("RELAY_JOB_TTL_S", str(24 * 3600)))
 
 router = APIRouter()
 
@@ -124,6 +132,45 @@ def _build_publish_message(job: dict) -> dict:
     }
 
 
+def _hold_workspaces(job: dict) -> None:
+    """Toma una referencia de cada workspace que usan las imagenes del job."""
+    ids = {workspaces.split(f)[0] for item in job["items"] for f in (item.get("image_files") or [])}
+    job["workspaces"] = [ws_id for ws_id in ids if ws_id and workspaces.acquire(ws_id)]
+
+
+def _release_workspaces(job: dict) -> None:
+    """Suelta las referencias del job (una sola vez)."""
+    for ws_id in job.pop("workspaces", []):
+        workspaces.release(ws_id)
+
+
+async def _fail_job(job: dict, reason: str) -> None:
+    """Cierra un job que no va a terminar (agente caido, vencido): suelta sus
+    workspaces y manda un job_done con el error para que el dashboard no
+    quede esperando."""
+    job["status"] = "failed"
+    job.pop("agent", None)
+    _release_workspaces(job)
+    queued = QUEUE.get(job["account_id"], [])
+    if job["job_id"] in queued:
+        queued.remove(job["job_id"])
+    evs = job.setdefault("events", [])
+    ok = sum(1 for ev in evs if ev.get("type") == "item_done" and ev.get("status") == "success")
+    total = len(job["items"])
+    msg = {"type": "job_done", "job_id": job["job_id"], "ok": ok, "fail": total - ok,
+           "total": total, "error": reason}
+    evs.append(msg)
+    await _forward_to_subs(job["job_id"], msg)
+
+
+async def _expire_jobs() -> None:
+    """Falla los jobs abiertos con mas de JOB_TTL_SECONDS."""
+    limit = time.time() - JOB_TTL_SECONDS
+    for job in list(JOBS.values()):
+        if job["status"] in ("queued", "dispatched") and job.get("created", 0) < limit:
+            await _fail_job(job, "expired")
+
+
 async def _dispatch_job(job: dict) -> bool:
     """Envia el job al agente de su cuenta si esta online. Devuelve True si se
     despacho, False si no hay agente conectado."""
@@ -133,6 +180,8 @@ async def _dispatch_job(job: dict) -> bool:
     try:
         await ws.send_json(_build_publish_message(job))
         job["status"] = "dispatched"
+        # el agente que lo tiene: si se desconecta sin job_done, se falla
+        job["agent"] = ws
         return True
     except Exception:
         # El agente murio entre medias: lo damos por desconectado.
@@ -175,6 +224,7 @@ async def agent_ws(ws: WebSocket):
 
     account_id = info["account_id"]
     await ws.accept()
+    await _expire_jobs()
 
     # Si habia otro agente registrado para esta cuenta, lo reemplazamos.
     old = AGENTS.get(account_id)
@@ -217,6 +267,8 @@ async def agent_ws(ws: WebSocket):
                 if job_id and job_id in JOBS:
                     if mtype == "job_done":
                         JOBS[job_id]["status"] = "done"
+                        JOBS[job_id].pop("agent", None)
+                        _release_workspaces(JOBS[job_id])
                     # Guardar el evento para reproducirlo a suscriptores tardios
                     # (p.ej. el dashboard que se suscribe tras terminar el job).
                     evs = JOBS[job_id].setdefault("events", [])
@@ -235,6 +287,11 @@ async def agent_ws(ws: WebSocket):
         # Desregistrar solo si seguimos siendo el agente activo de la cuenta.
         if AGENTS.get(account_id) is ws:
             AGENTS.pop(account_id, None)
+        # Jobs que este agente no termino (se cayo, lo reemplazaron): no van a
+        # recibir job_done, asi que se fallan y sueltan sus workspaces.
+        for job in list(JOBS.values()):
+            if job.get("agent") is ws and job["status"] == "dispatched":
+                await _fail_job(job, "agent_disconnected")
 
 
 # ======================================================================
@@ -250,6 +307,7 @@ async def publish_job(payload: dict):
         raise HTTPException(400, "Falta account_id")
     if not items:
         raise HTTPException(400, "El job no tiene items")
+    await _expire_jobs()
 
     job_id = _new_job_id()
     job = {
@@ -259,8 +317,10 @@ async def publish_job(payload: dict):
         "settings": payload.get("settings", {}),
         "status": "queued",
         "events": [],  # historial para reproducir a suscriptores tardios
+        "created": time.time(),
     }
     JOBS[job_id] = job
+    _hold_workspaces(job)
 
     dispatched = await _dispatch_job(job)
     if dispatched:
@@ -276,6 +336,7 @@ async def publish_job(payload: dict):
 async def job_ws(ws: WebSocket, job_id: str):
     """Suscripcion del dashboard a los eventos de progreso de un job."""
     await ws.accept()
+    await _expire_jobs()
     SUBS.setdefault(job_id, []).append(ws)
 
     # Informar al dashboard del estado actual del job al suscribirse.
@@ -313,8 +374,8 @@ async def agent_online(account_id: str):
 
 @router.get("/api/jobs/{job_id}/img/{idx}")
 async def job_image(job_id: str, idx: int):
-    """Sirve los bytes de la imagen image_files[idx] del job desde temp_images/.
-    Lo usa el agente para descargar las fotos antes de publicar."""
+    """Sirve los bytes de la imagen image_files[idx] del job desde su workspace
+    (o temp_images/). Lo usa el agente para descargar las fotos antes de publicar."""
     job = JOBS.get(job_id)
     if job is None:
         raise HTTPException(404, "job no encontrado")
@@ -326,9 +387,8 @@ async def job_image(job_id: str, idx: int):
     for item in items:
         files = item.get("image_files") or []
         if 0 <= idx < len(files):
-            safe = os.path.basename(files[idx])
-            fp = TEMP_DIR / safe
-            if not fp.exists():
+            _, fp = workspaces.resolve(files[idx])
+            if fp is None or not fp.exists():
                 raise HTTPException(404, "imagen no encontrada")
             return FileResponse(fp)
     raise HTTPException(404, "indice de imagen fuera de rango")
@@ -0,0 +1,165 @@
+"""
+Autotest del doble local de Gemini (modules/ai_backends.py)
+===========================================================
+  CASO 1  Respuestas validas: una imagen, varias por llamada (array con su
+          numero) y pagina de solo texto; el analizador las acepta con
+          confianza 1.0 (cumplen el PROMPT).
+  CASO 2  Errores como los de google-genai: un 429 trae Retry-After y
+          RetryInfo, un 503 es reintentable; con reintentos el analizador
+          se recupera. La cuota simulada responde 429 pasado el limite.
+  CASO 3  Reproducible: con la misma semilla, los mismos errores y
+          latencias.
+  CASO 4  Medicion: con latencia fija el lote con concurrencia 4 tarda
+          ~1/4 que en serie.
+  CASO 5  create_client: 'fake' no necesita API key; backend desconocido o
+          'gemini' sin key fallan con un mensaje claro.
+
+Ejecutar:
+    python web/backend/test_ai_backends.py
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                   # noqa: E402
+
+from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+from modules.ai_backends import FakeGeminiClient, create_client   # noqa: E402
+from modules.gemini_client import classify, retry_after  # noqa: E402
+from modules.price_extractor import page_hints           # noqa: E402
+
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def make_images(folder: str, n: int) -> list:
+    paths = []
+    for i in range(n):
+        path = Path(folder) / f"img_{i}.png"
+        Image.new("RGB", (32 + i, 32), (i * 30 % 255, 80, 120)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def analyzer_for(client, **kwargs) -> AIImageAnalyzer:
+    return AIImageAnalyzer(None, client=client, requests_per_minute=0, **kwargs)
+
+
+def outcome(client: FakeGeminiClient) -> str:
+    try:
+        client.models.generate_content("m", ["hola"])
+        return "ok"
+    except Exception as e:
+        return str(e.code)
+
+
+def test_schema(paths: list) -> None:
+    client = FakeGeminiClient(latency_ms=0, latency_sigma=0)
+    analyzer = analyzer_for(client, images_per_request=3)
+    single = analyzer.analyze_image_for_marketplace(paths[0])
+    packed = analyzer.analyze_batch(paths[:3])
+    text = analyzer.analyze_image_for_marketplace(paths[0], page_hints("MOCHILA ESCOLAR AZUL\nS/ 15"))
+    check("CASO 1a una imagen: JSON valido y conforme al PROMPT",
+          not single.get("fallback") and single["confidence"] == 1.0, str(single["title"]))
+    # 3 llamadas: la imagen suelta, el lote de 3 en una y la de solo texto
+    check("CASO 1b varias por llamada: cada una a su imagen",
+          client.stats["calls"] == 3 and all(r["info"] and r["info"]["confidence"] == 1.0 for r in packed),
+          str(client.stats))
+    check("CASO 1c solo texto: responde sin imagen",
+          text["price"] == "15" and text["confidence"] == 1.0 and client.stats["images"] == 4)
+
+
+def test_errors(paths: list) -> None:
+    try:
+        FakeGeminiClient(latency_ms=0, rate_429=1.0, retry_after=3).models.generate_content("m", ["x"])
+        err = None
+    except Exception as e:
+        err = e
+    check("CASO 2a 429 con Retry-After y RetryInfo",
+          err is not None and classify(err) == (True, 429) and retry_after(err) == 3.0, repr(err)[:80])
+    try:
+        FakeGeminiClient(latency_ms=0, error_rate=1.0).models.generate_content("m", ["x"])
+        err = None
+    except Exception as e:
+        err = e
+    check("CASO 2b 503 reintentable", err is not None and classify(err) == (True, 503))
+
+    flaky = FakeGeminiClient(latency_ms=0, latency_sigma=0, error_rate=0.5, seed=3)
+    analyzer = analyzer_for(flaky, max_retries=8)
+    analyzer.gemini.base_delay = 0.001
+    analyzer.gemini.breaker.failure_threshold = 100
+    results = analyzer.analyze_batch(paths)
+    check("CASO 2c con reintentos el lote se recupera",
+          all(r["info"] for r in results) and flaky.stats["errors_503"] > 0 and analyzer.usage_stats()["retries"] > 0,
+          str(flaky.stats))
+
+    quota = FakeGeminiClient(latency_ms=0, quota_rpm=3)
+    seen = [outcome(quota) for _ in range(4)]
+    check("CASO 2d cuota simulada: 429 pasado el limite", seen == ["ok", "ok", "ok", "429"], str(seen))
+
+
+def test_seed() -> None:
+    runs = []
+    for _ in range(2):
+        client = FakeGeminiClient(latency_ms=1, latency_sigma=1.0, error_rate=0.3, rate_429=0.2, seed=42)
+        runs.append([outcome(client) for _ in range(20)])
+    check("CASO 3 misma semilla, mismos resultados", runs[0] == runs[1] and len(set(runs[0])) == 3, str(runs[0]))
+
+
+def test_throughput(paths: list) -> None:
+    times = {}
+    for workers in (1, 4):
+        analyzer = analyzer_for(FakeGeminiClient(latency_ms=100, latency_sigma=0), max_concurrency=workers)
+        start = time.perf_counter()
+        analyzer.analyze_batch(paths)
+        times[workers] = time.perf_counter() - start
+    check("CASO 4 concurrencia 4 ~4x mas rapido que en serie",
+          times[1] > 0.75 and times[4] < times[1] / 2.5, f"serie={times[1]:.2f}s x4={times[4]:.2f}s")
+
+
+def test_create_client() -> None:
+    config = type("Cfg", (), {"AI_BACKEND": "fake", "GEMINI_API_KEY": "", "AI_FAKE_LATENCY_MS": 5,
+                              "AI_FAKE_LATENCY_SIGMA": 0, "AI_FAKE_ERROR_RATE": 0, "AI_FAKE_429_RATE": 0,
+                              "AI_FAKE_QUOTA_RPM": 0, "AI_FAKE_SEED": 1,
+                              "AI_FAKE_BATCH_S": 0})
+    check("CASO 5a 'fake' sin API key", isinstance(create_client(config), FakeGeminiClient))
+    errors = []
+    for backend in ("gemini", "openai"):
+        config.AI_BACKEND = backend
+        try:
+            create_client(config)
+        except ValueError as e:
+            errors.append(str(e))
+    check("CASO 5b 'gemini' sin key y backend desconocido fallan claro",
+          len(errors) == 2 and "GEMINI_API_KEY" in errors[0] and "openai" in errors[1], str(errors))
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="ai_backends_test_")
+    paths = make_images(tmp, 8)
+    print("== Autotest doble local de Gemini ==")
+
+    test_schema(paths)
+    test_errors(paths)
+    test_seed()
+    test_throughput(paths)
+    test_create_client()
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,505 @@
+"""
+Autotest del analisis IA (AIImageAnalyzer) sin llamar a Gemini
+===============================================================
+Sustituye el cliente de Gemini por un doble local que tarda lo que tarda un
+viaje de ida y vuelta y devuelve JSON, y verifica:
+
+  CASO 1  Lote en paralelo: N imagenes con concurrencia C tardan ~N/C
+          llamadas, no la suma; el resultado viene en el orden de entrada.
+  CASO 2  Errores por item: una imagen que falla no tumba el lote.
+  CASO 3  Cancelacion: con el cancel_event activo no se empiezan mas items.
+  CASO 4  Varias imagenes por llamada: menos llamadas y menos tokens por
+          imagen; cada resultado va a su imagen aunque lleguen desordenados.
+  CASO 5  Respuesta de lote malformada: el grupo se parte en dos hasta que
+          las respuestas cuadran.
+  CASO 6  Preparacion en memoria: una imagen grande se envia como JPEG
+          reducido sin escribir copias "_resized" y se memoiza por contenido.
+  CASO 7  Clave de cache: mismo contenido con otro nombre acierta, otra
+          imagen con el mismo nombre no, y cambiar modelo o cualquier prompt
+          invalida.
+  CASO 8  Cuota: un 429 con Retry-After se reintenta tras esperar lo pedido,
+          un 400 falla al momento con GeminiError y la cubeta limita el ritmo.
+  CASO 9  Circuit breaker: con Gemini caido se falla al instante, pasado el
+          reset una sola llamada de prueba lo cierra; el texto generico de
+          respaldo viene marcado como fallback.
+  CASO 10 Single flight: peticiones simultaneas de la misma imagen hacen una
+          sola llamada y todas reciben su resultado (o su error).
+  CASO 11 Cascada: solo los resultados de baja confianza del modelo barato
+          se repiten con el fuerte; si el fuerte falla queda el barato y
+          usage_stats reporta la tasa de escalado.
+
+Ejecutar:
+    python web/backend/test_analysis.py
+"""
+import io
+import sys
+import asyncio
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                # noqa: E402
+
+from modules import ai_analyzer                      # noqa: E402
+from modules.ai_analyzer import AIImageAnalyzer, analysis_cache_key  # noqa: E402
+from modules.gemini_client import (GeminiClient, GeminiError, TokenBucket,  # noqa: E402
+                                   CircuitBreaker, CircuitOpenError)
+from modules.single_flight import SingleFlight, wait as wait_flight  # noqa: E402
+
+LATENCY = 0.2
+_RESULTS = []
+
+
+def image_name(part) -> str:
+    """img_<i> a partir del Part enviado: make_images codifica i en el ancho."""
+    with Image.open(io.BytesIO(part.inline_data.data)) as img:
+        return f"img_{img.width - 64}"
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+class FakeUsage:
+    """Como usage_metadata de Gemini: ~1000 tokens de prompt por llamada,
+    258 por imagen y 80 de salida por producto."""
+
+    def __init__(self, images):
+        self.prompt_token_count = 1000 + 258 * images
+        self.candidates_token_count = 80 * images
+
+
+class FakeResponse:
+    def __init__(self, text, images=1):
+        self.text = text
+        self.usage_metadata = FakeUsage(images)
+
+
+def product(name, image=None):
+    obj = {"title": f"Producto {name}", "price": 12, "description": "d", "tags": ["a", "b"]}
+    if image is not None:
+        obj["image"] = image
+    return obj
+
+
+class FakeModels:
+    """Doble de client.models: cuenta llamadas y concurrencia maxima.
+
+    max_packed: con mas imagenes que esto en una llamada, la respuesta omite
+    un objeto (simula un array malformado)."""
+
+    def __init__(self, fail_on=(), max_packed=None):
+        self.fail_on = set(fail_on)
+        self.max_packed = max_packed
+        self.calls = 0
+        self.sizes = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        names = [image_name(c) for c in contents if getattr(c, "inline_data", None)]
+        with self._lock:
+            self.calls += 1
+            self.sizes.append(len(names))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(LATENCY)
+            for name in names:
+                if name in self.fail_on:
+                    raise RuntimeError(f"503 UNAVAILABLE ({name})")
+            if len(names) == 1:
+                return FakeResponse(json.dumps(product(names[0])))
+            objs = [product(name, i) for i, name in enumerate(names, 1)][::-1]  # desordenado
+            if self.max_packed and len(names) > self.max_packed:
+                objs = objs[1:]
+            return FakeResponse(json.dumps(objs), len(names))
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def fake_client(models) -> object:
+    return type("FakeClient", (), {"models": models})()
+
+
+def make_analyzer(models: FakeModels, concurrency: int, per_request: int = 1) -> AIImageAnalyzer:
+    analyzer = AIImageAnalyzer("clave-de-prueba", max_concurrency=concurrency,
+                               images_per_request=per_request, requests_per_minute=0)
+    analyzer.client = analyzer.gemini.client = fake_client(models)
+    return analyzer
+
+
+class FakeAPIError(Exception):
+    """Como google.genai.errors.APIError: code, details y response.headers."""
+
+    def __init__(self, code, headers=None):
+        super().__init__(f"{code} error simulado")
+        self.code = code
+        self.details = {"error": {"code": code, "details": []}}
+        self.response = type("FakeHTTP", (), {"headers": headers or {}})()
+
+
+class FlakyModels:
+    """Lanza los errores de `errors` en orden y luego responde bien."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def generate_content(self, model, contents, config=None):
+        self.calls.append(time.perf_counter())
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse(json.dumps(product("ok")))
+
+
+def make_images(folder: str, n: int) -> list:
+    paths = []
+    for i in range(n):
+        path = str(Path(folder) / f"img_{i}.png")
+        Image.new("RGB", (64 + i, 64), (i * 20 % 255, 80, 160)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_parallel(paths: list) -> None:
+    models = FakeModels()
+    analyzer = make_analyzer(models, concurrency=4)
+    start = time.perf_counter()
+    results = analyzer.analyze_batch(paths)
+    elapsed = time.perf_counter() - start
+    sequential = LATENCY * len(paths)
+    check("CASO 1a lote mas rapido que la suma de llamadas", elapsed < sequential / 2,
+          f"{elapsed:.2f}s vs {sequential:.2f}s secuencial")
+    check("CASO 1b concurrencia acotada", models.peak == 4, f"pico={models.peak}")
+    check("CASO 1c resultados en el orden de entrada",
+          [r["info"]["title"] for r in results] == [f"Producto img_{i}" for i in range(len(paths))])
+
+
+def test_item_errors(paths: list) -> None:
+    analyzer = make_analyzer(FakeModels(fail_on={"img_2"}), concurrency=3)
+    results = list(analyzer.iter_analyze_batch(paths))
+    failed = [r for r in results if r["error"]]
+    check("CASO 2a todos los items reportados", len(results) == len(paths))
+    check("CASO 2b solo falla el item roto",
+          len(failed) == 1 and failed[0]["index"] == 2 and "503" in failed[0]["error"], str(failed))
+    check("CASO 2c el resto trae su info", all(r["info"]["price"] == "12" for r in results if not r["error"]))
+
+
+def test_cancel(paths: list) -> None:
+    models = FakeModels()
+    analyzer = make_analyzer(models, concurrency=2)
+    cancel = threading.Event()
+    seen = []
+    for res in analyzer.iter_analyze_batch(paths, cancel_event=cancel):
+        seen.append(res)
+        cancel.set()
+    skipped = [r for r in seen if r["error"] == "cancelado"]
+    check("CASO 3 cancelar no empieza mas llamadas", models.calls < len(paths) and skipped,
+          f"llamadas={models.calls}/{len(paths)}")
+
+
+def test_packed(paths: list) -> None:
+    single = make_analyzer(FakeModels(), concurrency=4)
+    single.analyze_batch(paths)
+    models = FakeModels()
+    packed = make_analyzer(models, concurrency=4, per_request=4)
+    results = packed.analyze_batch(paths)
+    check("CASO 4a una llamada por grupo", models.sizes == [4, 4], f"tamanos={models.sizes}")
+    check("CASO 4b cada resultado en su imagen",
+          [r["info"]["title"] for r in results] == [f"Producto img_{i}" for i in range(len(paths))])
+    a, b = single.usage_stats()["tokens_per_image"], packed.usage_stats()["tokens_per_image"]
+    check("CASO 4c menos tokens por imagen", b < a and results[0]["tokens"] == b, f"{a} -> {b}")
+
+
+def test_malformed_split(paths: list) -> None:
+    models = FakeModels(max_packed=2)
+    analyzer = make_analyzer(models, concurrency=1, per_request=8)
+    results = analyzer.analyze_batch(paths)
+    check("CASO 5a lote malformado se parte en mitades", models.sizes == [8, 4, 2, 2, 4, 2, 2],
+          f"tamanos={models.sizes}")
+    check("CASO 5b sin perder ni cruzar resultados",
+          all(not r["error"] for r in results)
+          and [r["info"]["title"] for r in results] == [f"Producto img_{i}" for i in range(len(paths))])
+    bad = make_analyzer(FakeModels(), concurrency=1, per_request=2)
+    try:
+        bad._parse_json_array('{"title": "sin array"}')
+        raised = False
+    except ValueError:
+        raised = True
+    check("CASO 5c objeto suelto no pasa como array", raised)
+
+
+def test_in_memory_prepare(folder: str) -> None:
+    big = Path(folder) / "grande" / "foto.jpg"
+    big.parent.mkdir()
+    Image.new("RGB", (3000, 2000), (200, 120, 40)).save(big, quality=95)
+    analyzer = make_analyzer(FakeModels(), concurrency=1)
+    analyzer.max_size = 1024
+    part = analyzer.prepare_image(str(big))
+    data = part.inline_data.data
+    with Image.open(io.BytesIO(data)) as img:
+        size, fmt = img.size, img.format
+    check("CASO 6a JPEG reducido en memoria",
+          fmt == "JPEG" and max(size) <= 1024 and part.inline_data.mime_type == "image/jpeg",
+          f"{fmt} {size}, {len(data) // 1024} KB")
+    check("CASO 6b sin copias _resized en disco", sorted(p.name for p in big.parent.iterdir()) == ["foto.jpg"])
+    copy = big.with_name("copia.jpg")
+    copy.write_bytes(big.read_bytes())
+    check("CASO 6c mismo contenido -> mismo payload memoizado",
+          analyzer.prepare_image(str(copy)).inline_data.data is data)
+
+
+def test_cache_key(folder: str) -> None:
+    base = Path(folder) / "claves"
+    base.mkdir()
+    page, upload = base / "page_1.png", base / "img_3f2a.png"
+    Image.new("RGB", (40, 40), (10, 20, 30)).save(page)
+    upload.write_bytes(page.read_bytes())
+    analyzer = make_analyzer(FakeModels(), concurrency=1)
+    key = analyzer.cache_key(str(page))
+    check("CASO 7a misma foto con otro nombre -> misma clave", analyzer.cache_key(str(upload)) == key)
+    time.sleep(0.01)
+    Image.new("RGB", (40, 40), (200, 20, 30)).save(page)  # otro catalogo, misma pagina
+    check("CASO 7b page_1 de otro catalogo -> otra clave", analyzer.cache_key(str(page)) != key)
+    key = analyzer.cache_key(str(page))
+    check("CASO 7c otro modelo -> otra clave", analysis_cache_key(str(page), "gemini-2.5-pro") != key)
+    original = ai_analyzer.PROMPT_VERSION
+    ai_analyzer.PROMPT_VERSION = "otro-prompt"
+    try:
+        check("CASO 7d otro prompt -> otra clave", analyzer.cache_key(str(page)) != key)
+    finally:
+        ai_analyzer.PROMPT_VERSION = original
+    versions = [ai_analyzer.prompt_version()]
+    for name in ("packed_prompt", "hint_block"):
+        template = getattr(ai_analyzer, name)
+        setattr(ai_analyzer, name, lambda *a, t=template: t(*a) + " (editado)")
+        try:
+            versions.append(ai_analyzer.prompt_version())
+        finally:
+            setattr(ai_analyzer, name, template)
+    check("CASO 7e la version cubre el prompt de varias imagenes y el de pistas",
+          versions[0] == original and len(set(versions)) == 3, str(versions))
+
+
+def test_quota() -> None:
+    flaky = FlakyModels([FakeAPIError(429, {"retry-after": "0.3"})])
+    client = GeminiClient(fake_client(flaky), "modelo-prueba", requests_per_minute=0, base_delay=0.01)
+    client.generate_content(["x"])
+    gap = flaky.calls[1] - flaky.calls[0]
+    check("CASO 8a 429 con Retry-After: reintenta tras esperar", client.retries == 1 and gap >= 0.3,
+          f"espera={gap:.2f}s")
+
+    flaky = FlakyModels([FakeAPIError(400)])
+    client = GeminiClient(fake_client(flaky), "modelo-prueba", requests_per_minute=0, base_delay=0.01)
+    try:
+        client.generate_content(["x"])
+        err = None
+    except GeminiError as e:
+        err = e
+    check("CASO 8b 400 -> GeminiError sin reintentar",
+          err is not None and err.code == 400 and not err.retryable and len(flaky.calls) == 1, str(err))
+
+    flaky = FlakyModels([FakeAPIError(503)] * 5)
+    client = GeminiClient(fake_client(flaky), "modelo-prueba", requests_per_minute=0,
+                          max_retries=2, base_delay=0.01)
+    try:
+        client.generate_content(["x"])
+        err = None
+    except GeminiError as e:
+        err = e
+    check("CASO 8c 503 persistente: se rinde tras max_retries",
+          err is not None and err.retryable and len(flaky.calls) == 3, f"llamadas={len(flaky.calls)}")
+
+    bucket = TokenBucket(600, burst=2)   # 10 por segundo, rafaga de 2
+    start = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    elapsed = time.perf_counter() - start
+    check("CASO 8d la cubeta limita el ritmo", 0.35 <= elapsed < 1.0, f"6 peticiones en {elapsed:.2f}s")
+
+    analyzer = AIImageAnalyzer("clave-de-prueba", requests_per_minute=0)
+    analyzer.client = analyzer.gemini.client = fake_client(FlakyModels([FakeAPIError(429)]))
+    analyzer.gemini.base_delay = 0.01
+    analyzer._generate(["x"], 1)
+    check("CASO 8e usage_stats cuenta los reintentos", analyzer.usage_stats()["retries"] == 1)
+
+
+def test_breaker() -> None:
+    flaky = FlakyModels([FakeAPIError(503)] * 2)
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.3)
+    client = GeminiClient(fake_client(flaky), "modelo-breaker", requests_per_minute=0,
+                          max_retries=0, breaker=breaker)
+    for _ in range(2):
+        try:
+            client.generate_content(["x"])
+        except GeminiError:
+            pass
+    start = time.perf_counter()
+    try:
+        client.generate_content(["x"])
+        fast = None
+    except CircuitOpenError as e:
+        fast = e
+    elapsed = time.perf_counter() - start
+    check("CASO 9a circuito abierto: falla al instante sin llamar",
+          fast is not None and len(flaky.calls) == 2 and elapsed < 0.05, f"{elapsed * 1000:.1f}ms")
+
+    time.sleep(0.35)
+    breaker.before_call()          # la llamada de prueba
+    try:
+        breaker.before_call()
+        second = True
+    except CircuitOpenError:
+        second = False
+    breaker.release_probe()
+    check("CASO 9b half-open deja pasar una sola prueba", breaker.state == "half_open" and not second)
+    client.generate_content(["x"])
+    check("CASO 9c prueba correcta cierra el circuito", breaker.state == "closed" and len(flaky.calls) == 3)
+
+    analyzer = AIImageAnalyzer("clave-de-prueba", requests_per_minute=0)
+    analyzer.client = analyzer.gemini.client = fake_client(FlakyModels([FakeAPIError(400)]))
+    info = analyzer.analyze_image_for_marketplace(make_images(tempfile.mkdtemp(), 1)[0])
+    check("CASO 9d el texto de respaldo viene marcado",
+          info.get("fallback") is True and "400" in info.get("error", ""), str(info.get("error")))
+
+
+class CascadeModels:
+    """Doble con dos modelos: el barato responde bien (8 tags) salvo para
+    `weak`, donde omite el precio y da 2 tags; el fuerte siempre bien."""
+
+    def __init__(self, weak, strong_fails=False):
+        self.weak = set(weak)
+        self.strong_fails = strong_fails
+        self.calls = {}
+
+    def generate_content(self, model, contents, config=None):
+        names = [image_name(c) for c in contents if getattr(c, "inline_data", None)]
+        self.calls.setdefault(model, []).extend(names)
+        if model == "fuerte" and self.strong_fails:
+            raise FakeAPIError(400)
+        objs = []
+        for i, name in enumerate(names, 1):
+            obj = dict(product(name, i), tags=[f"t{k}" for k in range(8)])
+            if model == "barato" and name in self.weak:
+                obj.update(price=None, tags=["a", "b"])
+            objs.append(obj)
+        return FakeResponse(json.dumps(objs if len(objs) > 1 else objs[0]), len(objs))
+
+
+def test_cascade(paths: list) -> None:
+    models = CascadeModels(weak={"img_1", "img_3"})
+    analyzer = AIImageAnalyzer("clave-de-prueba", "barato", images_per_request=2, requests_per_minute=0,
+                               escalate_model="fuerte", min_confidence=0.8)
+    good = dict(product("x"), tags=[f"t{k}" for k in range(8)])
+    scores = [ai_analyzer.confidence(d, analyzer._normalize(d))
+              for d in (good, dict(good, price=None), dict(good, description="Oferta 🔥"))]
+    check("CASO 11a confianza: completo 1.0, sin precio baja, emoji penaliza",
+          scores[0] == 1.0 and scores[1] < 0.8 <= scores[2] < 1.0, str(scores))
+
+    analyzer.client = analyzer.gemini.client = analyzer.strong.client = fake_client(models)
+    results = analyzer.analyze_batch(paths[:4])
+    by_model = [r["info"]["model"] for r in results]
+    usage = analyzer.usage_stats()
+    check("CASO 11b solo lo de baja confianza va al modelo fuerte",
+          sorted(models.calls["fuerte"]) == ["img_1", "img_3"]
+          and by_model == ["barato", "fuerte", "barato", "fuerte"]
+          and all(r["info"]["confidence"] == 1.0 for r in results), str(models.calls))
+    check("CASO 11c usage_stats reporta escalado y latencia",
+          usage["escalated"] == 2 and usage["escalation_rate"] == 0.5 and usage["requests"] == 2
+          and "escalation_latency_s" in usage and "latency_s" in usage, str(usage))
+
+    models = CascadeModels(weak={"img_0"}, strong_fails=True)
+    analyzer.client = analyzer.gemini.client = analyzer.strong.client = fake_client(models)
+    info = analyzer.analyze_image_for_marketplace(paths[0])
+    check("CASO 11d si el fuerte falla queda el del barato",
+          not info.get("fallback") and info["model"] == "barato" and info["confidence"] < 0.8, str(info))
+
+
+def test_single_flight() -> None:
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(LATENCY)
+        return {"title": "unico"}
+
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(flight.run("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    check("CASO 10a cinco pedidos simultaneos -> una llamada",
+          len(calls) == 1 and got == [{"title": "unico"}] * 5 and flight.in_flight() == 0,
+          f"llamadas={len(calls)}")
+
+    def broken():
+        time.sleep(LATENCY)
+        raise RuntimeError("503 UNAVAILABLE")
+
+    errors = []
+
+    def call():
+        try:
+            flight.run("k", broken)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    check("CASO 10b el error llega a todos", errors == ["503 UNAVAILABLE"] * 3, str(errors))
+
+    async def scenario():
+        future, leader = flight.claim("img")
+        followers = [asyncio.ensure_future(wait_flight(flight.claim("img")[0])) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        followers[0].cancel()          # un cliente se desconecta
+        await asyncio.sleep(0.01)
+        flight.resolve("img", {"title": "async"})
+        return leader, await followers[1]
+
+    leader, result = asyncio.run(scenario())
+    check("CASO 10c async: cancelar a uno no cancela a los demas",
+          leader and result == {"title": "async"}, str(result))
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="analysis_test_")
+    paths = make_images(tmp, 8)
+    print("== Autotest analisis IA ==")
+
+    test_parallel(paths)
+    test_item_errors(paths)
+    test_cancel(paths)
+    test_packed(paths)
+    test_malformed_split(paths)
+    test_in_memory_prepare(tmp)
+    test_cache_key(tmp)
+    test_quota()
+    test_breaker()
+    test_single_flight()
+    test_cascade(paths)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
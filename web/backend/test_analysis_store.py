@@ -0,0 +1,114 @@
+"""
+Autotest del almacen de analisis (modules/analysis_store.py)
+============================================================
+  CASO 1  Persistencia: lo guardado por una instancia lo lee otra (otro
+          proceso / reinicio) sin cargar nada al arrancar.
+  CASO 2  Eviccion: con max_entries se borran los menos usados; con ttl los
+          vencidos dejan de acertar.
+  CASO 3  Concurrencia: varios procesos escribiendo a la vez sobre la misma
+          base (WAL) no pierden filas ni fallan por "database is locked".
+  CASO 4  Migracion: el ai_analysis_cache.json antiguo se importa una vez
+          (solo claves por contenido) y queda renombrado.
+
+Ejecutar:
+    python web/backend/test_analysis_store.py
+"""
+import sys
+import json
+import time
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from modules.analysis_store import AnalysisStore    # noqa: E402
+
+_RESULTS = []
+INFO = {"title": "Mochila", "price": "12", "description": "d", "tags": ["a"]}
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def writer(db_path: str, worker: int, n: int) -> None:
+    store = AnalysisStore(db_path)
+    for i in range(n):
+        store[f"{worker}-{i}:v:m"] = dict(INFO, title=f"p{worker}-{i}")
+
+
+def test_persistence(tmp: str) -> None:
+    db = str(Path(tmp) / "persist.db")
+    AnalysisStore(db)["abc:v1:flash"] = INFO
+    other = AnalysisStore(db)
+    check("CASO 1a otra instancia lee lo guardado", other.get("abc:v1:flash") == INFO)
+    check("CASO 1b clave desconocida -> None, no esta",
+          other.get("zzz:v1:flash") is None and "zzz:v1:flash" not in other)
+
+
+def test_eviction(tmp: str) -> None:
+    store = AnalysisStore(str(Path(tmp) / "lru.db"), max_entries=3, ttl_days=0)
+    for i in range(3):
+        store[f"k{i}:v:m"] = INFO
+    # k0 es el mas antiguo pero se acaba de consultar: el menos usado es k1
+    store._conn().execute("UPDATE analyses SET last_used = last_used - 10000 WHERE key != 'k0:v:m'")
+    store._conn().execute("UPDATE analyses SET last_used = last_used - 20000 WHERE key = 'k1:v:m'")
+    store["k3:v:m"] = INFO
+    store.evict()
+    check("CASO 2a LRU por tamano", len(store) == 3 and "k1:v:m" not in store and "k0:v:m" in store,
+          f"n={len(store)}")
+
+    ttl = AnalysisStore(str(Path(tmp) / "ttl.db"), ttl_days=1)
+    ttl["viejo:v:m"] = INFO
+    ttl["nuevo:v:m"] = INFO
+    ttl._conn().execute("UPDATE analyses SET created = ? WHERE key = 'viejo:v:m'", (time.time() - 2 * 86400,))
+    check("CASO 2b vencido por ttl no acierta", ttl.get("viejo:v:m") is None and ttl.get("nuevo:v:m") == INFO)
+
+
+def test_processes(tmp: str) -> None:
+    db = str(Path(tmp) / "procs.db")
+    AnalysisStore(db)
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=writer, args=(db, w, 150)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    codes = [p.exitcode for p in procs]
+    store = AnalysisStore(db)
+    check("CASO 3 cuatro procesos escribiendo a la vez", codes == [0] * 4 and len(store) == 600,
+          f"exit={codes} filas={len(store)}")
+
+
+def test_migration(tmp: str) -> None:
+    legacy = Path(tmp) / "ai_analysis_cache.json"
+    legacy.write_text(json.dumps({"page_1.png": INFO, "abc:v1:flash": INFO}), encoding="utf-8")
+    store = AnalysisStore(str(Path(tmp) / "migr.db"))
+    n = store.import_json(legacy)
+    check("CASO 4a importa solo claves por contenido", n == 1 and store.get("abc:v1:flash") == INFO, f"n={n}")
+    check("CASO 4b el JSON queda renombrado (una sola vez)",
+          not legacy.exists() and store.import_json(legacy) == 0)
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="analysis_store_test_")
+    print("== Autotest almacen de analisis ==")
+
+    test_persistence(tmp)
+    test_eviction(tmp)
+    test_processes(tmp)
+    test_migration(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
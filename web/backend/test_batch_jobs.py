@@ -0,0 +1,237 @@
+"""
+Autotest de los Batch jobs (modules/batch_jobs.py)
+==================================================
+Contra el doble local de Gemini (sus jobs terminan batch_seconds despues de
+crearse), sin red ni API key:
+
+  CASO 1  Envio: las imagenes ya en cache se omiten; el resto va en UN job y
+          el estado queda en <state_dir>/<id>.json.
+  CASO 2  Reinicio: otro runner sobre la misma carpeta retoma la corrida;
+          al terminar el job los resultados quedan en el cache con la clave
+          de /api/analyze.
+  CASO 3  Envio cortado (se creo la corrida pero no se envio): resume() la
+          envia. Con un tope de MB chico se parte en varios jobs.
+  CASO 4  Peticiones fallidas quedan 'failed' (con su error) y no tocan el
+          cache; cancelar deja la corrida 'cancelled'.
+  CASO 5  Paginas de solo texto: sin imagen y con el precio de las pistas.
+  CASO 6  Metricas: filas 'batch' a mitad de precio; la carpeta de imagenes
+          propia se borra al terminar de enviar.
+  CASO 7  Preparar: resume() prepara con el prepare del runner (no envia las
+          vistas previas) y `keys` guarda con la clave de la vista previa.
+  CASO 8  Dos procesos con la misma carpeta: mientras uno envia (prepare
+          lento), resume() del otro no la vuelve a enviar; un solo job. Con
+          accept, resume() deja las corridas que no le tocan (la CLI, las
+          del backend con paginas sin enviar).
+
+Ejecutar:
+    python web/backend/test_batch_jobs.py
+"""
+import sys
+import time
+import threading
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                   # noqa: E402
+
+from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+from modules.ai_backends import FakeGeminiClient         # noqa: E402
+from modules.analysis_store import AnalysisStore         # noqa: E402
+from modules.batch_jobs import BatchJobRunner            # noqa: E402
+from modules.metrics_store import MetricsStore, cost_usd  # noqa: E402
+
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def make_images(folder: Path, n: int, size: int = 64) -> list:
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = folder / f"p{i}.png"
+        Image.effect_noise((size + i, size), 60).convert("RGB").save(path)
+        paths.append(str(path))
+    return paths
+
+
+def runner_for(client, tmp: Path, **kwargs) -> BatchJobRunner:
+    """Un 'proceso': analizador + cache + runner sobre las mismas carpetas."""
+    analyzer = AIImageAnalyzer(None, client=client, requests_per_minute=0)
+    cache = AnalysisStore(str(tmp / "ai_analysis.db"))
+    return BatchJobRunner(analyzer, cache, tmp / "batch_jobs", **kwargs)
+
+
+def test_submit_and_resume(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0.5, seed=1)
+    paths = make_images(tmp / "catalogo", 6)
+    runner = runner_for(client, tmp)
+    for path in paths[:2]:
+        runner.cache.put(runner.analyzer.cache_key(path), {"title": "ya analizado"})
+    run = runner.start(paths, name="catalogo")
+    state = tmp / "batch_jobs" / f"{run['id']}.json"
+    check("CASO 1 omite lo cacheado, un job, estado en disco",
+          run["cached"] == 2 and run["submitted"] == 4 and len(run["jobs"]) == 1
+          and run["status"] == "running" and state.exists() and client.stats["batch_jobs"] == 1, str(run))
+
+    # "reinicio": otro runner (otro proceso) con la misma carpeta y cache
+    again = runner_for(client, tmp)
+    early = again.resume()
+    time.sleep(0.6)
+    done = again.resume()[0]
+    infos = [again.cache.get(again.analyzer.cache_key(p)) for p in paths[2:]]
+    check("CASO 2a retoma tras reiniciar: en curso, luego terminada",
+          early[0]["status"] == "running" and done["status"] == "done" and done["done"] == 4
+          and done["prompt_tokens"] > 0 and again.resume() == [], f"{early[0]['status']} -> {done['status']}")
+    check("CASO 2b resultados en el cache con la clave de /api/analyze",
+          all(i and i["confidence"] == 1.0 and i["model"] == "gemini-2.5-flash" for i in infos)
+          and runner.get(run["id"])["status"] == "done", str(infos[0]["title"] if infos[0] else None))
+
+
+def test_interrupted(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0, seed=2)
+    paths = make_images(tmp / "cortado", 5, size=96)
+    runner = runner_for(client, tmp / "cortado_state", inline_mb=0.04)
+    run = runner.create(paths)      # el proceso murio antes de enviar
+    resumed = runner_for(client, tmp / "cortado_state", inline_mb=0.04).resume()[0]
+    check("CASO 3 resume envia lo que faltaba, en varios jobs si no cabe",
+          run["pending"] == 5 and resumed["status"] == "done" and resumed["done"] == 5
+          and len(resumed["jobs"]) > 1, f"jobs={len(resumed['jobs'])}")
+
+
+def test_failures(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0, error_rate=1.0)
+    paths = make_images(tmp / "fallas", 2)
+    runner = runner_for(client, tmp / "fallas_state")
+    run = runner.start(paths)
+    done = runner.poll(run["id"])
+    errors = runner.errors(run["id"])
+    check("CASO 4a peticiones fallidas: 'failed' con su error y sin cache",
+          done["status"] == "done" and done["failed"] == 2 and all("503" in e for e in errors.values())
+          and runner.cache.get(runner.analyzer.cache_key(paths[0])) is None, str(errors)[:80])
+
+    slow = runner_for(FakeGeminiClient(batch_seconds=60), tmp / "cancelar_state")
+    run = slow.start(make_images(tmp / "cancelar", 2))
+    cancelled = slow.cancel(run["id"])
+    check("CASO 4b cancelar", cancelled["status"] == "cancelled" and cancelled["failed"] == 2
+          and cancelled["jobs"][0]["state"] == "CANCELLED" and slow.resume() == [])
+
+
+def test_text_only(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0)
+    paths = make_images(tmp / "texto", 2)
+    hints = {paths[0]: {"text": "OLLA ARROCERA\nS/ 45", "price": 45, "prices": ["S/ 45"],
+                        "name": "OLLA ARROCERA", "complete": True}}
+    runner = runner_for(client, tmp / "texto_state")
+    run = runner.start(paths, hints=hints.get)
+    runner.poll(run["id"])
+    text_info = runner.cache.get(runner.analyzer.cache_key(paths[0]))
+    check("CASO 5 solo texto: sin imagen y precio de las pistas",
+          text_info["price"] == "45" and client.stats["images"] == 1, str(client.stats))
+
+
+def test_metrics_and_files(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0)
+    files = tmp / "extraidas"
+    paths = make_images(files, 2)
+    runner = runner_for(client, tmp / "metricas_state")
+    store = MetricsStore(str(tmp / "metrics.db"))
+    runner.analyzer.metrics = store.record
+    run = runner.start(paths, files_dir=files, account="cli")
+    check("CASO 6a la carpeta propia se borra al terminar de enviar", not files.exists())
+    done = runner.poll(run["id"])
+    row = store.summary(7, "account")[0]
+    expected = cost_usd("gemini-2.5-flash", done["prompt_tokens"], done["output_tokens"]) / 2
+    check("CASO 6b metricas 'batch' a mitad de precio",
+          row["account"] == "cli" and row["calls"] == 2 and row["images"] == 2 and row["p50_s"] is None
+          and row["cost_usd"] == round(expected, 6), str(row["cost_usd"]))
+
+
+def test_prepare(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0)
+    previews = make_images(tmp / "previas", 2)
+    fulls = make_images(tmp / "altas", 2, size=128)
+    full_of = dict(zip(previews, fulls))
+    sent = []
+
+    def prepare(path):
+        sent.append(path)
+        return full_of[path]
+
+    creator = runner_for(client, tmp / "preparar_state")
+    creator.create(previews)       # el envio aun no empezo
+    watcher = runner_for(client, tmp / "preparar_state", prepare=prepare)
+    pending = watcher.pending_paths()
+    done = watcher.resume()[0]
+    check("CASO 7a resume prepara las pendientes antes de enviarlas",
+          pending == previews and sent == previews and done["done"] == 2 and watcher.pending_paths() == [],
+          str(sent))
+
+    cli = runner_for(client, tmp / "claves_state")
+    keys = {full: cli.analyzer.cache_key(preview) for preview, full in full_of.items()}
+    run = cli.start(fulls, keys=keys.get)
+    cli.poll(run["id"])
+    check("CASO 7b con keys el resultado queda en la clave de la vista previa",
+          all(cli.cache.get(cli.analyzer.cache_key(p)) for p in previews)
+          and not any(cli.cache.get(cli.analyzer.cache_key(p)) for p in fulls))
+
+
+def test_two_processes(tmp: Path) -> None:
+    client = FakeGeminiClient(batch_seconds=0)
+    paths = make_images(tmp / "dos_procesos", 3)
+    cli = runner_for(client, tmp / "compartida")
+    backend = runner_for(client, tmp / "compartida")      # el watch() del backend
+    run = cli.create(paths)
+    started = threading.Event()
+
+    def slow_prepare(path):
+        started.set()
+        time.sleep(0.3)
+        return path
+
+    sender = threading.Thread(target=cli.submit, args=(run["id"], slow_prepare))
+    sender.start()
+    started.wait(5)
+    during = backend.resume()
+    sender.join()
+    after = backend.resume()
+    check("CASO 8a la corrida tomada por otro proceso no se reenvia: un solo job",
+          client.stats["batch_jobs"] == 1 and during[0]["submitted"] == 0
+          and after[0]["status"] == "done" and after[0]["done"] == 3,
+          f"jobs={client.stats['batch_jobs']}")
+
+    other = cli.create(make_images(tmp / "del_backend", 1))
+    left = cli.resume(accept=lambda r: r["id"] != other["id"])
+    check("CASO 8b resume(accept) no toca las corridas rechazadas",
+          all(p["id"] != other["id"] for p in left) and cli.get(other["id"])["pending"] == 1
+          and client.stats["batch_jobs"] == 1)
+
+
+def run() -> int:
+    tmp = Path(tempfile.mkdtemp(prefix="batch_jobs_test_"))
+    print("== Autotest Batch jobs ==")
+
+    test_submit_and_resume(tmp)
+    test_interrupted(tmp)
+    test_failures(tmp)
+    test_text_only(tmp)
+    test_metrics_and_files(tmp)
+    test_prepare(tmp)
+    test_two_processes(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
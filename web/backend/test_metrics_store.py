@@ -0,0 +1,147 @@
+"""
+Autotest de las metricas de la IA (modules/metrics_store.py)
+============================================================
+  CASO 1  Cada llamada del analizador (con el doble local de Gemini) deja
+          una fila con modelo, tokens de usage_metadata, bytes de imagen y
+          tiempo; los errores tambien.
+  CASO 2  Cuenta: la fijada en el contexto del llamador llega a los hilos
+          del lote.
+  CASO 3  Agregados por modelo / cuenta / dia: costo estimado, p50/p95,
+          aciertos de cache y tasa de acierto.
+  CASO 4  Retencion: las filas viejas se borran; agrupacion desconocida da
+          ValueError.
+
+Ejecutar:
+    python web/backend/test_metrics_store.py
+"""
+import sys
+import time
+import tempfile
+import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                   # noqa: E402
+
+from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+from modules.ai_backends import FakeGeminiClient         # noqa: E402
+from modules.metrics_store import MetricsStore, account, cost_usd, percentile  # noqa: E402
+
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def make_images(folder: str, n: int) -> list:
+    paths = []
+    for i in range(n):
+        path = Path(folder) / f"img_{i}.png"
+        Image.new("RGB", (64 + i, 64), (i * 40 % 255, 90, 30)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def rows(store: MetricsStore) -> list:
+    return store._conn().execute(
+        "SELECT kind, model, account, images, image_bytes, prompt_tokens, output_tokens, seconds, error "
+        "FROM calls ORDER BY ts").fetchall()
+
+
+def test_calls(tmp: str, paths: list) -> MetricsStore:
+    store = MetricsStore(str(Path(tmp) / "calls.db"))
+    client = FakeGeminiClient(latency_ms=20, latency_sigma=0)
+    analyzer = AIImageAnalyzer(None, "gemini-2.5-flash", client=client, requests_per_minute=0,
+                               max_concurrency=4)
+    analyzer.metrics = store.record
+
+    token = account.set("10.0.0.7")
+    try:
+        analyzer.analyze_batch(paths)
+    finally:
+        account.reset(token)
+    calls = rows(store)
+    first = calls[0]
+    check("CASO 1a una fila por llamada con tokens, bytes y tiempo",
+          len(calls) == len(paths) and first[1] == "gemini-2.5-flash" and first[4] > 0
+          and first[5] > 0 and first[6] == 120 and first[7] >= 0.02 and first[8] is None, str(first))
+    check("CASO 2 la cuenta del contexto llega a los hilos del lote",
+          {c[2] for c in calls} == {"10.0.0.7"}, str({c[2] for c in calls}))
+
+    client.error_rate = 1.0
+    analyzer.gemini.max_retries = 0
+    analyzer.analyze_image_for_marketplace(paths[0])
+    last = rows(store)[-1]
+    check("CASO 1b los errores tambien se registran",
+          last[8] is not None and "503" in last[8] and last[2] is None, str(last[8])[:60])
+    return store
+
+
+def test_summary(tmp: str) -> None:
+    store = MetricsStore(str(Path(tmp) / "summary.db"))
+    now = time.time()
+    for i in range(20):
+        store.record({"model": "gemini-2.5-flash", "account": "a", "images": 1, "image_bytes": 1000,
+                      "prompt_tokens": 1000, "output_tokens": 100, "seconds": 1.0 + i / 10, "ts": now})
+    store.record({"model": "gemini-2.5-pro", "account": "b", "images": 1, "prompt_tokens": 1000,
+                  "output_tokens": 100, "seconds": 9.0, "ts": now})
+    store.record({"model": "gemini-2.5-pro", "account": "b", "error": "503", "seconds": 30, "ts": now})
+    token = account.set("a")
+    store.hit("gemini-2.5-flash", images=5)
+    store.hit("gemini-2.5-flash", "coalesced")
+    account.reset(token)
+
+    by_model = {r["model"]: r for r in store.summary(7, "model")}
+    flash, pro = by_model["gemini-2.5-flash"], by_model["gemini-2.5-pro"]
+    check("CASO 3a por modelo: costo, p50/p95 y errores aparte",
+          flash["cost_usd"] == round(20 * cost_usd("gemini-2.5-flash", 1000, 100), 6)
+          and flash["p50_s"] == 1.9 and flash["p95_s"] == 2.8 and pro["errors"] == 1 and pro["p95_s"] == 9.0,
+          f"p50={flash['p50_s']} p95={flash['p95_s']} pro={pro['p95_s']}")
+    check("CASO 3b aciertos de cache y tasa de acierto",
+          flash["cache_hits"] == 5 and flash["coalesced"] == 1 and flash["hit_rate"] == round(6 / 26, 3),
+          str(flash["hit_rate"]))
+    by_account = {r["account"]: r for r in store.summary(7, "account")}
+    by_day = store.summary(7, "day")
+    check("CASO 3c por cuenta y por dia",
+          by_account["a"]["images"] == 20 and by_account["b"]["calls"] == 2
+          and len(by_day) == 1 and by_day[0]["day"] == datetime.date.today().isoformat()
+          and by_day[0]["calls"] == 22, str(list(by_account)))
+    check("CASO 3d percentil por rango", percentile([1, 2, 3, 4], 50) == 2 and percentile([], 95) is None)
+
+
+def test_retention(tmp: str) -> None:
+    store = MetricsStore(str(Path(tmp) / "retention.db"), retention_days=1)
+    store.record({"model": "m", "ts": time.time() - 3 * 86400})
+    store.record({"model": "m"})
+    store.purge()
+    try:
+        store.summary(7, "ip")
+        bad = False
+    except ValueError:
+        bad = True
+    check("CASO 4 retencion y agrupacion invalida", len(rows(store)) == 1 and bad)
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="metrics_test_")
+    paths = make_images(tmp, 6)
+    print("== Autotest metricas IA ==")
+
+    test_calls(tmp, paths)
+    test_summary(tmp)
+    test_retention(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,348 @@
+"""
+Autotest de la extraccion PDF -> imagenes (PDFImageExtractor)
+=============================================================
+Genera un catalogo PDF sintetico con Pillow (sin archivos externos) y verifica:
+
+  CASO 1  Streaming: iter_images_from_pdf entrega las paginas una a una,
+          en orden y con el total correcto.
+  CASO 2  Cancelacion: si se activa el cancel_event se detiene antes de la
+          siguiente pagina.
+  CASO 3  Render en paralelo por shards: mismas paginas y mismo orden que el
+          modo secuencial; los rangos cubren el documento sin huecos. El
+          streaming tambien usa los shards (en orden y cancelable, sin dejar
+          paginas de los shards en curso) y si pdftocairo falla se usa
+          pdftoppm.
+  CASO 4  Cache de render: la segunda extraccion del mismo PDF sale del cache
+          (sin renderizar), otra DPI es otra entrada, la eviccion LRU respeta
+          el tamano maximo y dos procesos con la misma carpeta no se pisan
+          el indice.
+  CASO 5  Passthrough JPEG: una pagina que es solo una foto se copia byte a
+          byte (sin re-codificar); si la foto no cubre la pagina se renderiza.
+  CASO 6  Dos niveles: la vista previa sale a baja DPI y la alta resolucion
+          se renderiza solo al pedirla (una vez) con full_resolution.
+  CASO 7  Formato de salida: 'auto' elige JPEG para fotos y PNG para
+          graficos planos; las estadisticas reportan los bytes ahorrados.
+  CASO 8  Memoria acotada: pdf2image se llama por bloques de paginas y nunca
+          hay mas de max_inflight_pages imagenes vivas a la vez; la
+          extraccion normal llega a ese camino con PDF_BACKEND=pdf2image y
+          las paginas-foto se copian sin pasar por pdf2image.
+  CASO 9  Probe de metadatos: numero de paginas sin parsear con PyPDF2 (que
+          ya no se importa al cargar el modulo) y memoizado por archivo.
+
+Usa directorios temporales aislados (no toca temp_images/).
+Ejecutar:
+    python web/backend/test_pdf_pipeline.py
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+import pypdfium2 as pdfium                           # noqa: E402
+from PIL import Image                                # noqa: E402
+
+from modules import pdf_extractor                    # noqa: E402
+from modules.pdf_extractor import PDFImageExtractor  # noqa: E402
+from modules.render_cache import RenderCache         # noqa: E402
+from modules.image_encoder import encode_image       # noqa: E402
+
+PYPDF2_AT_IMPORT = "PyPDF2" in sys.modules
+
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def make_pdf(folder: str, pages: int = 5) -> str:
+    """Catalogo de prueba: una foto a pagina completa por pagina."""
+    imgs = [Image.new("RGB", (600, 800), (40 * i % 255, 120, 200)) for i in range(pages)]
+    path = os.path.join(folder, "catalogo.pdf")
+    imgs[0].save(path, save_all=True, append_images=imgs[1:])
+    return path
+
+
+def test_streaming(tmp: str, pdf: str) -> None:
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "stream"))
+    events = list(extractor.iter_images_from_pdf(pdf, dpi=50))
+    check("CASO 1a entrega todas las paginas", len(events) == 5, f"n={len(events)}")
+    check("CASO 1b paginas en orden", [e["page"] for e in events] == [1, 2, 3, 4, 5])
+    check("CASO 1c total correcto en cada evento", all(e["total"] == 5 for e in events))
+    check("CASO 1d cada pagina existe en disco", all(os.path.exists(e["path"]) for e in events))
+
+
+def test_cancel(tmp: str, pdf: str) -> None:
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "cancel"))
+    cancel = threading.Event()
+    seen = []
+    for ev in extractor.iter_images_from_pdf(pdf, dpi=50, cancel_event=cancel):
+        seen.append(ev["page"])
+        if ev["page"] == 2:
+            cancel.set()
+    check("CASO 2 cancelacion detiene la extraccion", seen == [1, 2], f"seen={seen}")
+
+
+def test_parallel(tmp: str, pdf: str) -> None:
+    ranges = pdf_extractor._split_pages(10, 4)
+    pages = [p for first, last in ranges for p in range(first, last + 1)]
+    check("CASO 3a shards cubren 1..N sin huecos", pages == list(range(1, 11)), f"ranges={ranges}")
+    check("CASO 3b nunca mas shards que paginas", len(pdf_extractor._split_pages(3, 8)) == 3)
+
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "parallel"), passthrough=False)
+    paths = extractor.extract_images_parallel(pdf, dpi=50, workers=2)
+    names = [os.path.basename(p) for p in paths]
+    check("CASO 3c paralelo devuelve paginas en orden",
+          names == [f"page_{i}.png" for i in range(1, 6)], f"names={names}")
+    check("CASO 3d paralelo escribe todas las paginas", all(os.path.exists(p) for p in paths))
+
+    streamed = PDFImageExtractor(temp_dir=os.path.join(tmp, "parallel_stream"), passthrough=False,
+                                 max_inflight_pages=4)
+    events = list(streamed._iter_parallel(pdf, 50, None, workers=2))
+    check("CASO 3e streaming por shards: paginas en orden",
+          [e["page"] for e in events] == [1, 2, 3, 4, 5]
+          and [os.path.basename(e["path"]) for e in events] == names and all(e["total"] == 5 for e in events),
+          f"{[e['page'] for e in events]}")
+    cancelled = PDFImageExtractor(temp_dir=os.path.join(tmp, "parallel_cancel"), passthrough=False,
+                                  max_inflight_pages=4)
+    cancel, seen = threading.Event(), []
+    for ev in cancelled._iter_parallel(pdf, 50, cancel, workers=2):
+        seen.append(ev["page"])
+        if ev["page"] == 2:
+            cancel.set()
+    left = sorted(os.listdir(cancelled.temp_dir))
+    check("CASO 3f streaming por shards cancelable: sin paginas de shards en curso",
+          seen == [1, 2] and left == ["page_1.png", "page_2.png"], f"seen={seen} left={left}")
+
+    calls = []
+
+    def fake_convert(path, use_pdftocairo=False, **kwargs):
+        calls.append(use_pdftocairo)
+        if use_pdftocairo:
+            raise RuntimeError("pdftocairo no instalado")
+        return [Image.new("RGB", (60, 80)) for _ in range(kwargs["first_page"], kwargs["last_page"] + 1)]
+
+    original = pdf_extractor.convert_from_path
+    pdf_extractor.convert_from_path = fake_convert
+    try:
+        shard = pdf_extractor._render_shard("pdf2image", pdf, 1, 2, 50, os.path.join(tmp, "parallel"))
+    finally:
+        pdf_extractor.convert_from_path = original
+    check("CASO 3g shard pdf2image: pdftoppm si pdftocairo falla", len(shard) == 2 and calls == [True, False],
+          f"calls={calls}")
+
+
+def test_render_cache(tmp: str, pdf: str) -> None:
+    cache = RenderCache(os.path.join(tmp, "cache"))
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "cached"), cache=cache, passthrough=False)
+    first = extractor.extract_images_from_pdf(pdf, dpi=50)
+    extractor.cleanup()
+
+    calls = []
+    original = extractor._render_images
+    extractor._render_images = lambda *a: calls.append(a) or original(*a)
+    second = extractor.extract_images_from_pdf(pdf, dpi=50)
+    check("CASO 4a re-subida sale del cache sin renderizar", not calls and second == first,
+          f"renders={len(calls)}")
+    check("CASO 4b paginas del cache presentes tras cleanup", all(os.path.exists(p) for p in second))
+
+    extractor.extract_images_from_pdf(pdf, dpi=60)
+    check("CASO 4c otra DPI es otra entrada", len(calls) == 1 and cache.stats()["entries"] == 2)
+
+    # Sobrescribir la pagina en temp_dir no debe corromper la copia cacheada
+    extractor._save_page(Image.new("RGB", (10, 10)), 1)
+    again = extractor.extract_images_from_pdf(pdf, dpi=50)
+    check("CASO 4d re-render local no corrompe el cache", Image.open(again[0]).size != (10, 10))
+
+    small = RenderCache(os.path.join(tmp, "cache_small"), max_bytes=1)
+    small.put("a", second[:1])
+    small.put("b", second[1:2])
+    check("CASO 4e eviccion LRU por tamano", small.stats()["entries"] == 1 and small.get("a", tmp) is None)
+
+    # dos procesos (GUI y backend) con la misma carpeta: ninguno pisa el indice del otro
+    gui, web = RenderCache(os.path.join(tmp, "cache_shared")), RenderCache(os.path.join(tmp, "cache_shared"))
+    gui.put("gui", second[:1])
+    web.put("web", second[1:2])
+    fresh = RenderCache(os.path.join(tmp, "cache_shared"))
+    check("CASO 4f cache compartido entre procesos: no se pierden entradas",
+          fresh.stats()["entries"] == 2 and gui.get("web", os.path.join(tmp, "shared_out")) is not None,
+          str(fresh.stats()))
+
+
+def make_half_page_pdf(folder: str) -> str:
+    """Una pagina con la foto ocupando solo un cuarto del area (debe renderizarse)."""
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 400), (200, 10, 10)).save(buf, "JPEG")
+    buf.seek(0)
+    pdf = pdfium.PdfDocument.new()
+    page = pdf.new_page(600, 800)
+    img = pdfium.PdfImage.new(pdf)
+    img.load_jpeg(buf, inline=True)
+    img.set_matrix(pdfium.PdfMatrix().scale(300, 400))
+    page.insert_obj(img)
+    page.gen_content()
+    path = os.path.join(folder, "media_pagina.pdf")
+    pdf.save(path)
+    return path
+
+
+def test_passthrough(tmp: str, pdf: str) -> None:
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "passthrough"))
+    paths = extractor.extract_images_from_pdf(pdf, dpi=50)
+    check("CASO 5a paginas-foto salen como .jpg", all(p.endswith(".jpg") for p in paths),
+          f"paths={[os.path.basename(p) for p in paths]}")
+    doc = pdfium.PdfDocument(pdf)
+    original = bytes(list(doc[0].get_objects())[0].get_data(decode_simple=False))
+    doc.close()
+    with open(paths[0], "rb") as f:
+        check("CASO 5b JPEG copiado byte a byte", f.read() == original)
+
+    streamed = [e["path"] for e in extractor.iter_images_from_pdf(pdf, dpi=50)]
+    check("CASO 5c streaming tambien usa passthrough", all(p.endswith(".jpg") for p in streamed))
+
+    half = extractor.extract_images_from_pdf(make_half_page_pdf(tmp), dpi=50)
+    check("CASO 5d foto parcial se renderiza a PNG", half[0].endswith(".png"), f"path={half[0]}")
+
+    off = PDFImageExtractor(temp_dir=os.path.join(tmp, "no_passthrough"), passthrough=False)
+    check("CASO 5e passthrough desactivable",
+          all(p.endswith(".png") for p in off.extract_images_from_pdf(pdf, dpi=50)))
+
+
+def test_two_tier(tmp: str, pdf: str) -> None:
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "tiers"), passthrough=False, full_dpi=100)
+    previews = [e["path"] for e in extractor.iter_images_from_pdf(pdf, dpi=25)]
+    fulls = [p for p in os.listdir(extractor.temp_dir) if p.endswith("_full.png")]
+    check("CASO 6a la extraccion no renderiza alta resolucion", not fulls, f"full={fulls}")
+
+    full = extractor.full_resolution(previews[1])
+    small, big = Image.open(previews[1]).size, Image.open(full).size
+    check("CASO 6b full_resolution renderiza la pagina a mas DPI",
+          os.path.basename(full) == "page_2_full.png" and abs(big[0] - small[0] * 4) <= 4, f"{small} -> {big}")
+    mtime = os.path.getmtime(full)
+    check("CASO 6c segunda llamada reutiliza el render",
+          extractor.full_resolution(previews[1]) == full and os.path.getmtime(full) == mtime)
+    check("CASO 6d imagen ajena (foto subida) se devuelve tal cual",
+          extractor.full_resolution(pdf) == pdf)
+
+    jpg = PDFImageExtractor(temp_dir=os.path.join(tmp, "tiers_jpg"))
+    page = jpg.extract_images_from_pdf(pdf, dpi=25)[0]
+    check("CASO 6e JPEG original ya es la version final", jpg.full_resolution(page) == page)
+
+
+def test_output_format(tmp: str, pdf: str) -> None:
+    photo = Image.effect_noise((400, 300), 60).convert("RGB")
+    flat = Image.new("RGB", (400, 300), (255, 255, 255))
+    base = os.path.join(tmp, "enc")
+    path, st = encode_image(photo, base + "_photo", "auto", 80)
+    check("CASO 7a auto: foto -> JPEG", path.endswith(".jpg") and st["format"] == "jpeg", path)
+    check("CASO 7b JPEG ocupa menos que el PNG sin compresion", st["bytes"] < st["raw_bytes"],
+          f"{st['bytes']} < {st['raw_bytes']}")
+    path, st = encode_image(flat, base + "_flat", "auto", 80)
+    check("CASO 7c auto: grafico plano -> PNG sin perdida", path.endswith(".png"), path)
+    path, _ = encode_image(photo, base + "_webp", "webp", 80)
+    check("CASO 7d webp explicito", path.endswith(".webp") and Image.open(path).format == "WEBP")
+
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "jpeg_out"), passthrough=False,
+                                  image_format="jpeg", image_quality=70)
+    paths = extractor.extract_images_from_pdf(pdf, dpi=50)
+    stats = extractor.encode_stats.as_dict()
+    check("CASO 7e extractor respeta la politica", all(p.endswith(".jpg") for p in paths))
+    check("CASO 7f estadisticas de la extraccion",
+          stats["images"] == 5 and stats["bytes_saved"] > 0 and stats["formats"] == {"jpeg": 5}, str(stats))
+
+
+def test_bounded_memory(tmp: str, pdf: str) -> None:
+    """pdf2image necesita poppler: se sustituye convert_from_path por un doble que mide."""
+    ranges, live, peak = [], set(), [0]
+
+    def fake_convert(path, dpi=100, first_page=1, last_page=1, **kwargs):
+        ranges.append((first_page, last_page))
+        images = []
+        for _ in range(first_page, last_page + 1):
+            img = Image.new("RGB", (60, 80), (10, 20, 30))
+            live.add(id(img))
+            img.close = (lambda i=id(img): live.discard(i))
+            images.append(img)
+        peak[0] = max(peak[0], len(live))
+        return images
+
+    original = pdf_extractor.convert_from_path
+    pdf_extractor.convert_from_path = fake_convert
+    try:
+        extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "bounded"), passthrough=False,
+                                      max_inflight_pages=2)
+        paths = extractor._extract_with_pdf2image(pdf, 50)
+        chunked, chunked_peak = list(ranges), peak[0]
+        routed = PDFImageExtractor(temp_dir=os.path.join(tmp, "bounded_routed"), backend="pdf2image",
+                                   passthrough=False, max_inflight_pages=4, parallel_min_pages=100)
+        ranges.clear()
+        routed_paths = routed.extract_images_from_pdf(pdf, dpi=50)
+        routed_ranges = list(ranges)
+        photos = PDFImageExtractor(temp_dir=os.path.join(tmp, "bounded_photos"), backend="pdf2image",
+                                   parallel_min_pages=100)
+        ranges.clear()
+        photo_paths = photos.extract_images_from_pdf(pdf, dpi=50)
+    finally:
+        pdf_extractor.convert_from_path = original
+    check("CASO 8a pdf2image por bloques", chunked == [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)], f"ranges={chunked}")
+    check("CASO 8b nunca mas de max_inflight_pages vivas", chunked_peak <= 2 and not live, f"pico={chunked_peak}")
+    check("CASO 8c todas las paginas guardadas en orden",
+          [os.path.basename(p) for p in paths] == [f"page_{i}.png" for i in range(1, 6)])
+    check("CASO 8e la extraccion normal usa los bloques con backend pdf2image",
+          routed_ranges == [(1, 2), (3, 4), (5, 5)] and len(routed_paths) == 5, f"ranges={routed_ranges}")
+    check("CASO 8f paginas-foto copiadas sin pdf2image",
+          not ranges and all(p.endswith(".jpg") for p in photo_paths) and len(photo_paths) == 5, f"ranges={ranges}")
+    chunks = list(pdf_extractor._chunked_runs([1, 2, 3, 4, 5, 8], 2))
+    check("CASO 8d shards tambien por bloques", chunks == [(1, 2), (3, 4), (5, 5), (8, 8)], f"{chunks}")
+
+
+def test_probe(tmp: str, pdf: str) -> None:
+    info = pdf_extractor.probe_pdf(pdf)
+    check("CASO 9a probe cuenta las paginas", info["num_pages"] == 5, str(info))
+    check("CASO 9b metadatos como dict", isinstance(info["metadata"], dict))
+    check("CASO 9c PyPDF2 no se importa al cargar el extractor", not PYPDF2_AT_IMPORT)
+
+    extractor = PDFImageExtractor(temp_dir=os.path.join(tmp, "probe"))
+    calls = []
+    original = pdf_extractor.probe_pdf
+    pdf_extractor.probe_pdf = lambda path: calls.append(path) or original(path)
+    try:
+        counts = [extractor.get_pdf_info(pdf)["num_pages"] for _ in range(3)]
+    finally:
+        pdf_extractor.probe_pdf = original
+    check("CASO 9d get_pdf_info memoizado", counts == [5, 5, 5] and len(calls) == 1, f"probes={len(calls)}")
+    check("CASO 9e PDF ilegible -> 0 paginas",
+          extractor.get_pdf_info(os.path.join(tmp, "no_existe.pdf"))["num_pages"] == 0)
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="pdf_pipeline_test_")
+    pdf = make_pdf(tmp)
+    print("== Autotest extraccion PDF ==")
+
+    test_streaming(tmp, pdf)
+    test_cancel(tmp, pdf)
+    test_parallel(tmp, pdf)
+    test_render_cache(tmp, pdf)
+    test_passthrough(tmp, pdf)
+    test_two_tier(tmp, pdf)
+    test_output_format(tmp, pdf)
+    test_bounded_memory(tmp, pdf)
+    test_probe(tmp, pdf)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,142 @@
+"""
+Autotest del analisis especulativo (prefetch.py)
+================================================
+Verifica la cola sin levantar main.py ni llamar a Gemini:
+
+  CASO 1  Orden: las imagenes encoladas se analizan en el orden de subida.
+  CASO 2  Prioridad: mientras hay un analisis del usuario (preempt) no se
+          empieza ninguno especulativo; al terminar se reanuda.
+  CASO 3  Parada: soltar el workspace (drop) descarta lo que quedaba.
+  CASO 4  Latidos: la sesion sin latidos durante idle_seconds se descarta;
+          la que sigue latiendo no.
+  CASO 5  "stop" (sin cuota, Gemini caido) corta solo esa sesion.
+
+Ejecutar:
+    python web/backend/test_prefetch.py
+"""
+import sys
+import time
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from prefetch import Prefetcher              # noqa: E402
+
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def wait_until(condition, timeout: float = 3.0) -> bool:
+    limit = time.time() + timeout
+    while time.time() < limit:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+class Recorder:
+    """Funcion analyze de prueba: anota lo analizado; `gate` la frena."""
+
+    def __init__(self, outcome=None):
+        self.done = []
+        self.outcome = outcome or {}
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, name, owner):
+        self.gate.wait(5)
+        self.done.append(name)
+        return self.outcome.get(name, "ok")
+
+
+def new_prefetcher(rec: Recorder, idle: float = 60) -> Prefetcher:
+    return Prefetcher(rec, idle_seconds=idle, poll_seconds=0.05)
+
+
+def test_order() -> None:
+    rec = Recorder()
+    pf = new_prefetcher(rec)
+    pf.enqueue("ws1", ["ws1/p1", "ws1/p2", "ws1/p3"], "1.2.3.4")
+    check("CASO 1 en orden de subida",
+          wait_until(lambda: len(rec.done) == 3) and rec.done == ["ws1/p1", "ws1/p2", "ws1/p3"]
+          and pf.stats()["analyzed"] == 3, str(rec.done))
+
+
+def test_preempt() -> None:
+    rec = Recorder()
+    pf = new_prefetcher(rec)
+    with pf.preempt():
+        pf.enqueue("ws1", ["ws1/p1", "ws1/p2"])
+        time.sleep(0.3)
+        idle = list(rec.done)
+    check("CASO 2a con un analisis del usuario en curso no empieza nada", idle == [], str(idle))
+    check("CASO 2b al terminar se reanuda", wait_until(lambda: len(rec.done) == 2), str(rec.done))
+
+
+def test_drop() -> None:
+    rec = Recorder()
+    rec.gate.clear()
+    pf = new_prefetcher(rec)
+    pf.enqueue("ws1", [f"ws1/p{i}" for i in range(5)])
+    wait_until(lambda: pf.stats()["pending"] == 4)
+    pf.drop("ws1")
+    rec.gate.set()
+    time.sleep(0.3)
+    check("CASO 3 soltar el workspace descarta la cola",
+          rec.done == ["ws1/p0"] and pf.stats()["dropped"] == 4, f"{rec.done} {pf.stats()}")
+
+
+def test_heartbeat() -> None:
+    rec = Recorder()
+    rec.gate.clear()
+    pf = new_prefetcher(rec, idle=0.4)
+    pf.enqueue("viva", ["viva/p1", "viva/p2"])
+    pf.enqueue("cerrada", ["cerrada/p1"])
+    for _ in range(8):       # 0.8 s: la "cerrada" deja de latir
+        time.sleep(0.1)
+        pf.heartbeat("viva")
+    left = pf.heartbeat("viva")["queued"]
+    rec.gate.set()
+    wait_until(lambda: len(rec.done) == 2)
+    time.sleep(0.2)
+    check("CASO 4 sin latidos se descarta, con latidos sigue",
+          rec.done == ["viva/p1", "viva/p2"] and left == 1, f"{rec.done} queued={left}")
+
+
+def test_stop() -> None:
+    rec = Recorder(outcome={"a/p1": "stop"})
+    rec.gate.clear()
+    pf = new_prefetcher(rec)
+    pf.enqueue("a", ["a/p1", "a/p2", "a/p3"])
+    pf.enqueue("b", ["b/p1"])
+    rec.gate.set()
+    wait_until(lambda: len(rec.done) == 2)
+    time.sleep(0.2)
+    check("CASO 5 stop corta solo esa sesion", rec.done == ["a/p1", "b/p1"], str(rec.done))
+
+
+def run() -> int:
+    print("== Autotest prefetch ==")
+
+    test_order()
+    test_preempt()
+    test_drop()
+    test_heartbeat()
+    test_stop()
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
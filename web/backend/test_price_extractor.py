@@ -0,0 +1,170 @@
+"""
+Autotest de precios desde la capa de texto (modules/price_extractor.py)
+======================================================================
+  CASO 1  Reglas del PROMPT: "3 X 50" -> 17, "Por Unidad 20" + "3 X 50" -> 17,
+          "Por Mayor 9.50" -> 9; los miles se leen enteros (1,250.00 -> 1250).
+  CASO 2  Sin falsos precios: medidas ("30 x 40 cm"), telefonos y "N x M"
+          sin moneda ni etiqueta.
+  CASO 3  Plantilla: nombre + precio = completa; sin nombre, solo pistas;
+          varios productos en la pagina, sin precio; un precio con dos
+          lecturas ("S/ 1.250") no deja la plantilla completa.
+  CASO 4  PDF real con capa de texto: el extractor da las pistas por pagina.
+  CASO 5  Analizador: plantilla completa -> llamada sin imagen y precio
+          local; incompleta -> imagen + pistas; el lote no renderiza la alta
+          resolucion de las paginas que van solo con texto.
+
+Ejecutar:
+    python web/backend/test_price_extractor.py
+"""
+import sys
+import json
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                   # noqa: E402
+
+from modules.price_extractor import lowest_unit_price, page_hints   # noqa: E402
+from modules.pdf_extractor import PDFImageExtractor      # noqa: E402
+from modules.ai_analyzer import AIImageAnalyzer          # noqa: E402
+
+_RESULTS = []
+PAGE = "MOCHILA ESCOLAR IMPERMEABLE\nPor unidad S/ 20\n3 x 50 soles\nContacto: 995665397 WhatsApp"
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def make_text_pdf(path: Path, pages: list) -> None:
+    """PDF minimo con una linea de texto Helvetica por renglon."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        ops = "BT /F1 18 Tf 40 760 Td 22 TL " + " ".join(f"({ln}) '" for ln in lines.splitlines()) + " ET"
+        objs.append(f"<< /Length {len(ops)} >>\nstream\n{ops}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF".encode()
+    path.write_bytes(out)
+
+
+class RecordingModels:
+    """Doble de client.models que guarda lo enviado y responde un producto."""
+
+    def __init__(self):
+        self.contents = []
+
+    def generate_content(self, model, contents, config=None):
+        self.contents.append(contents)
+        body = {"title": "Mochila", "price": 99, "description": "d", "tags": ["a"]}
+        return type("R", (), {"text": json.dumps(body), "usage_metadata": None})()
+
+
+def test_rules() -> None:
+    cases = {"3 X 50 soles": 17, "Por Unidad 20\nPor mayor 3 X 50": 17, "Por Mayor 9.50": 9}
+    got = {text: lowest_unit_price(text) for text in cases}
+    check("CASO 1a reglas de precio del PROMPT", got == cases, str(got))
+    cases = {"S/ 1,250.00": 1250, "Precio: 2.480,50": 2480, "3 x S/ 1,500": 500, "1250 soles": 1250}
+    got = {text: lowest_unit_price(text) for text in cases}
+    check("CASO 1b separador de miles", got == cases, str(got))
+
+
+def test_false_positives() -> None:
+    texts = ["Medidas 30 x 40 cm", "Contacto: 995665397 WhatsApp", "2 x 10", "Pack 6 x 60"]
+    got = [lowest_unit_price(text) for text in texts]
+    check("CASO 2 medidas, telefonos y N x M sin moneda no son precios", got == [None] * 4, str(got))
+
+
+def test_template() -> None:
+    full = page_hints(PAGE)
+    check("CASO 3a plantilla completa", full["complete"] and full["price"] == 17
+          and full["name"] == "MOCHILA ESCOLAR IMPERMEABLE", str(full["prices"]))
+    partial = page_hints("Por unidad S/ 20\n3 x 50 soles")
+    check("CASO 3b sin nombre: solo pistas", partial["price"] == 17 and not partial["complete"])
+    many = page_hints("OLLAS DE ACERO\nS/ 30\nSARTEN GRANDE\nS/ 25\nTAZAS DE CERAMICA\nS/ 8\nPLATOS HONDOS\nS/ 12")
+    check("CASO 3c varios productos: sin precio", many["price"] is None and not many["complete"])
+    check("CASO 3d pagina sin texto -> None", page_hints("  \n ") is None)
+    doubtful = [page_hints("OLLA ARROCERA GRANDE\nS/ 1.250"), page_hints("OLLA ARROCERA GRANDE\nS/ 1 250")]
+    check("CASO 3e precio con dos lecturas: no completa",
+          all(h["price"] and not h["exact"] and not h["complete"] for h in doubtful),
+          str([(h["price"], h["exact"]) for h in doubtful]))
+
+
+def test_pdf(tmp: Path) -> None:
+    pdf = tmp / "catalogo.pdf"
+    make_text_pdf(pdf, [PAGE, "Por Mayor 9.50"])
+    extractor = PDFImageExtractor(str(tmp / "paginas"), backend="pypdfium2")
+    pages = extractor.extract_images_from_pdf(str(pdf), dpi=40)
+    first, second = extractor.page_hints(pages[0]), extractor.page_hints(pages[1])
+    check("CASO 4a capa de texto leida por pagina",
+          first and first["complete"] and first["price"] == 17 and second["price"] == 9,
+          f"{first and first['prices']} / {second and second['prices']}")
+    photo = tmp / "foto.png"
+    Image.new("RGB", (20, 20)).save(photo)
+    check("CASO 4b foto suelta -> sin pistas", extractor.page_hints(str(photo)) is None)
+
+
+def test_analyzer(tmp: Path) -> None:
+    models = RecordingModels()
+    analyzer = AIImageAnalyzer("clave-de-prueba", requests_per_minute=0)
+    analyzer.client = analyzer.gemini.client = type("C", (), {"models": models})()
+    photo = tmp / "pagina.png"
+    Image.new("RGB", (32, 32)).save(photo)
+
+    info = analyzer.analyze_image_for_marketplace(str(photo), page_hints(PAGE))
+    sent = models.contents[-1]
+    check("CASO 5a plantilla completa: sin imagen y precio local",
+          len(sent) == 1 and isinstance(sent[0], str) and info["price"] == "17", f"partes={len(sent)}")
+
+    analyzer.analyze_image_for_marketplace(str(photo), page_hints("Por unidad S/ 20\n3 x 50 soles"))
+    sent = models.contents[-1]
+    check("CASO 5b incompleta: imagen + pistas en el prompt",
+          len(sent) == 2 and "PRECIO UNITARIO MAS BAJO ya calculado" in sent[0] and ": 17" in sent[0])
+
+    rendered = []
+    items = ["pagina_texto", "pagina_foto"]
+    hints = {"pagina_texto": page_hints(PAGE), "pagina_foto": None}
+    results = analyzer.analyze_batch(items, prepare=lambda it: rendered.append(it) or str(photo),
+                                     images_per_request=2, hints=hints.get)
+    check("CASO 5c el lote no renderiza las paginas de solo texto",
+          rendered == ["pagina_foto"] and all(not r["error"] for r in results), f"render={rendered}")
+
+    analyzer.pdf_text = "off"
+    analyzer.analyze_image_for_marketplace(str(photo), page_hints(PAGE))
+    check("CASO 5d AI_PDF_TEXT=off ignora las pistas", models.contents[-1][0].endswith("'oferta'."))
+
+
+def run() -> int:
+    tmp = Path(tempfile.mkdtemp(prefix="price_test_"))
+    print("== Autotest precios desde la capa de texto ==")
+
+    test_rules()
+    test_false_positives()
+    test_template()
+    test_pdf(tmp)
+    test_analyzer(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -12,6 +12,10 @@ y WebSocket de forma sincrona):
           agente llegan al WS del dashboard /api/jobs/ws/{job_id}.
   CASO 4  Agente offline: el job queda "queued" y se entrega al conectar.
   CASO 5  Servir imagen: /api/jobs/{job_id}/img/{idx} devuelve los bytes.
+  CASO 6  Sin job_done: si el agente se desconecta a mitad, el job falla, el
+          dashboard recibe un job_done con el error y el workspace se suelta.
+  CASO 7  Job encolado cuyo agente nunca se conecta: vence a RELAY_JOB_TTL_S
+          y suelta su workspace.
 
 Ejecutar:
     set RELAY_ALLOW_INSECURE=1   (Windows)  /  export RELAY_ALLOW_INSECURE=1
@@ -210,6 +214,59 @@ def test_offline_queue(app):
               f"status={relay.JOBS[job_id]['status']}")
 
 
+def _workspace_job():
+    """Payload con una imagen dentro de un workspace real (referencia de sesion)."""
+    ws = relay.workspaces.create()
+    (ws.path / "img.png").write_bytes(b"PNGDATA")
+    payload = _publish_payload()
+    payload["items"][0]["image_files"] = [f"{ws.id}/img.png"]
+    return ws, payload
+
+
+def _refs(ws) -> int:
+    live = relay.workspaces.get(ws.id)
+    return live.refs if live else 0
+
+
+def test_agent_lost(app):
+    """CASO 6: el agente se cae con el job a medias (nunca manda job_done)."""
+    client = TestClient(app)
+    ws, payload = _workspace_job()
+    with client.websocket_connect(f"/api/agent/ws?key={KEY}&machine_id={MACHINE}") as agent:
+        job_id = client.post("/api/jobs/publish", json=payload).json()["job_id"]
+        agent.receive_json()
+        check("CASO 6a el job sujeta su workspace", _refs(ws) == 2, f"refs={_refs(ws)}")
+        agent.send_json({"type": "item_done", "job_id": job_id, "page": 1, "status": "success"})
+        with client.websocket_connect(f"/api/jobs/ws/{job_id}") as dash:
+            dash.receive_json()
+            dash.receive_json()  # item_done reproducido
+            agent.close()
+            ev = dash.receive_json()
+    check("CASO 6b el dashboard recibe job_done con el error",
+          ev.get("type") == "job_done" and ev.get("error") == "agent_disconnected" and ev.get("ok") == 1,
+          f"ev={ev}")
+    check("CASO 6c job fallido y workspace soltado",
+          relay.JOBS[job_id]["status"] == "failed" and _refs(ws) == 1, f"refs={_refs(ws)}")
+    relay.workspaces.disown(ws.id)
+
+
+def test_job_expiry(app):
+    """CASO 7: encolado sin agente; al vencer el TTL suelta el workspace."""
+    client = TestClient(app)
+    ws, payload = _workspace_job()
+    job_id = client.post("/api/jobs/publish", json=payload).json()["job_id"]
+    client.post("/api/jobs/publish", json=payload)
+    check("CASO 7a encolado sigue sujetando el workspace",
+          relay.JOBS[job_id]["status"] == "queued" and _refs(ws) == 3, f"refs={_refs(ws)}")
+    relay.JOBS[job_id]["created"] -= relay.JOB_TTL_SECONDS + 1
+    client.post("/api/jobs/publish", json=payload)
+    acc = relay.account_id_for(KEY)
+    check("CASO 7b vencido: falla, sale de la cola y suelta el workspace",
+          relay.JOBS[job_id]["status"] == "failed" and job_id not in relay.QUEUE.get(acc, [])
+          and _refs(ws) == 3, f"refs={_refs(ws)}")
+    relay.workspaces.disown(ws.id)
+
+
 def test_invalid_license(app):
     """Extra: licencia vacia debe rechazar la conexion del agente."""
     client = TestClient(app)
@@ -235,6 +292,12 @@ def main():
     reset_state()
     test_offline_queue(make_app())
 
+    reset_state()
+    test_agent_lost(make_app())
+
+    reset_state()
+    test_job_expiry(make_app())
+
     reset_state()
     test_invalid_license(make_app())
 
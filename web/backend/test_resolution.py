@@ -0,0 +1,196 @@
+"""
+Autotest de la resolucion adaptativa (modules/resolution_ladder.py)
+===================================================================
+Con un cliente de prueba que solo "lee" el precio de las fotos con letra
+chica si la imagen enviada mide al menos 1200 px, y que cobra tokens por
+mosaico de 768 px como Gemini:
+
+  CASO 1  Escalera: sube de escalon con la mitad de fallos, prueba uno mas
+          abajo cada probe_every y baja con dos pruebas completas.
+  CASO 2  Catalogo legible: una llamada por imagen al escalon mas bajo y
+          menos tokens que a MAX_IMAGE_SIZE.
+  CASO 3  Catalogo con letra chica: las primeras suben (2 llamadas), luego
+          el catalogo empieza directo en 1280 (1 llamada); el otro catalogo
+          sigue en el escalon bajo.
+  CASO 4  Varias imagenes por llamada: las incompletas se repiten solas.
+  CASO 5  Sin escalones: siempre MAX_IMAGE_SIZE y sin 'resolution'.
+
+Ejecutar:
+    python web/backend/test_resolution.py
+"""
+import io
+import sys
+import json
+import math
+import tempfile
+import threading
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from PIL import Image                                   # noqa: E402
+
+from modules.ai_analyzer import AIImageAnalyzer, incomplete     # noqa: E402
+from modules.resolution_ladder import ResolutionLadder          # noqa: E402
+
+_RESULTS = []
+STEPS = [512, 1280]
+MAX_SIZE = 2048
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+class Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+
+
+class Response:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class SmallPrintClient:
+    """Las fotos rojas traen el precio en letra chica: sin 1200 px no se lee."""
+
+    def __init__(self):
+        self.sizes = []
+        self._lock = threading.Lock()
+
+    @property
+    def models(self):
+        return self
+
+    def generate_content(self, model, contents, config=None):
+        objs, tokens = [], 0
+        for part in contents:
+            if not getattr(part, "inline_data", None):
+                continue
+            with Image.open(io.BytesIO(part.inline_data.data)) as img:
+                side, red = max(img.size), img.convert("RGB").getpixel((0, 0))[0]
+                tiles = math.ceil(img.size[0] / 768) * math.ceil(img.size[1] / 768)
+            with self._lock:
+                self.sizes.append(side)
+            tokens += 258 * tiles
+            legible = red < 128 or side >= 1200
+            objs.append({"image": len(objs) + 1, "title": "Set de Ollas", "price": 17 if legible else 0,
+                         "description": "GENTE LLEGARON LAS OLLAS <3",
+                         "tags": ["ollas", "cocina", "hogar", "set", "menaje", "utensilios", "calidad", "acero"]})
+        text = json.dumps(objs if len(objs) > 1 else objs[0])
+        return Response(text, Usage(tokens + 500, 120 * len(objs)))
+
+
+def make_images(folder: Path, n: int, red: int) -> list:
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = folder / f"p{i}.png"
+        Image.new("RGB", (2000, 1500), (red, 40 + i, 60)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def analyzer_for(client, steps=STEPS, **kwargs) -> AIImageAnalyzer:
+    return AIImageAnalyzer(None, max_size=MAX_SIZE, client=client, requests_per_minute=0,
+                           resolution_steps=steps, **kwargs)
+
+
+def test_ladder() -> None:
+    ladder = ResolutionLadder([512, 1280, 2048], window=8, probe_every=5)
+    starts = []
+    for ok in (False, True, False, True):
+        starts.append(ladder.start("a"))
+        ladder.observe("a", starts[-1], ok)
+    check("CASO 1a sube de escalon con la mitad de fallos",
+          starts == [512] * 4 and ladder.stats()["a"] == 1280, str(ladder.stats()))
+    seen = [ladder.start("a") for _ in range(6)]
+    check("CASO 1b cada probe_every prueba uno mas abajo", seen == [1280] * 4 + [512, 1280], str(seen))
+    ladder.observe("a", 512, True)
+    ladder.observe("a", 512, True)
+    check("CASO 1c dos pruebas completas: baja de escalon", ladder.stats()["a"] == 512, str(ladder.stats()))
+    ladder.observe("a", 2048, False)
+    check("CASO 1d otro escalon no cuenta", ladder.stats() == {"a": 512})
+
+
+def test_legible(tmp: Path) -> None:
+    paths = make_images(tmp / "legible", 4, red=0)
+    client = SmallPrintClient()
+    analyzer = analyzer_for(client)
+    results = analyzer.analyze_batch(paths)
+    full = analyzer_for(SmallPrintClient(), steps=None)
+    full.analyze_batch(paths)
+    low, high = analyzer.usage_stats()["tokens_per_image"], full.usage_stats()["tokens_per_image"]
+    check("CASO 2 catalogo legible: 1 llamada a 512 px y menos tokens",
+          client.sizes == [512] * 4 and all(r["info"]["resolution"] == 512 and r["info"]["price"] == "17"
+                                            for r in results) and low < high,
+          f"tokens/img {low} vs {high}")
+
+
+def test_small_print(tmp: Path) -> None:
+    small = make_images(tmp / "letra_chica", 10, red=200)
+    legible = make_images(tmp / "otro", 2, red=0)
+    client = SmallPrintClient()
+    analyzer = analyzer_for(client, max_concurrency=1)
+    first = analyzer.analyze_image_for_marketplace(small[0])
+    check("CASO 3a incompleta a 512: se repite a 1280 y lee el precio",
+          client.sizes == [512, 1280] and first["price"] == "17" and first["resolution"] == 1280
+          and not incomplete(first), str(client.sizes))
+    for path in small[1:4]:
+        analyzer.analyze_image_for_marketplace(path)
+    client.sizes.clear()
+    for path in small[4:8]:
+        analyzer.analyze_image_for_marketplace(path)
+    check("CASO 3b el catalogo ya empieza en 1280: 1 llamada por imagen",
+          client.sizes == [1280] * 4, str(client.sizes))
+    client.sizes.clear()
+    analyzer.analyze_image_for_marketplace(legible[0])
+    stats = analyzer.usage_stats()
+    check("CASO 3c el otro catalogo sigue en 512",
+          client.sizes == [512] and stats["resolution"][str(tmp / "otro")] == 512
+          and stats["climbed"] == 4 and stats["climb_rate"] == round(4 / 9, 3), str(stats["resolution"]))
+
+
+def test_packed(tmp: Path) -> None:
+    paths = make_images(tmp / "mixto_a", 2, red=0) + make_images(tmp / "mixto_b", 1, red=200)
+    client = SmallPrintClient()
+    analyzer = analyzer_for(client, images_per_request=3)
+    results = analyzer.analyze_batch(paths)
+    check("CASO 4 lote empaquetado: solo la incompleta se repite",
+          client.sizes == [512, 512, 512, 1280] and [r["info"]["resolution"] for r in results] == [512, 512, 1280]
+          and all(r["info"]["price"] == "17" for r in results), str(client.sizes))
+
+
+def test_off(tmp: Path) -> None:
+    paths = make_images(tmp / "sin_escalera", 1, red=200)
+    client = SmallPrintClient()
+    info = analyzer_for(client, steps=None).analyze_image_for_marketplace(paths[0])
+    check("CASO 5 sin escalones: MAX_IMAGE_SIZE de una",
+          client.sizes == [2000] and "resolution" not in info and info["price"] == "17", str(client.sizes))
+
+
+def run() -> int:
+    tmp = Path(tempfile.mkdtemp(prefix="resolution_test_"))
+    print("== Autotest resolucion adaptativa ==")
+
+    test_ladder()
+    test_legible(tmp)
+    test_small_print(tmp)
+    test_packed(tmp)
+    test_off(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,171 @@
+"""
+Autotest de los workspaces por subida (workspaces.py)
+=====================================================
+Verifica el aislamiento y el conteo de referencias sin levantar main.py:
+
+  CASO 1  Aislamiento: dos subidas tienen directorios distintos y liberar una
+          no toca los archivos de la otra.
+  CASO 2  Referencias: un job (u operacion en curso) mantiene vivo el
+          workspace aunque la sesion lo suelte; al soltar la ultima se borra.
+  CASO 3  Inactividad: sweep() suelta la referencia de sesion vieja.
+  CASO 4  Nombres: "<id>/<archivo>" resuelve dentro del workspace, los nombres
+          sueltos van a temp_images/ y no hay path traversal.
+  CASO 5  Relay: el job conserva sus imagenes hasta job_done aunque el
+          dashboard haya subido otro catalogo.
+  CASO 6  Reinicio: purge_orphans conserva los workspaces de `keep` (Batch
+          jobs sin enviar) y adopt() los vuelve a registrar.
+
+Ejecutar:
+    python web/backend/test_workspaces.py
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fastapi import FastAPI                  # noqa: E402
+from fastapi.testclient import TestClient    # noqa: E402
+
+import relay                                 # noqa: E402
+from workspaces import WorkspaceManager      # noqa: E402
+
+KEY = "ELEKA-MKT-TEST-WORKSPACES"
+_RESULTS = []
+
+
+def check(name: str, condition: bool, detail: str = "") -> None:
+    estado = "PASS" if condition else "FAIL"
+    extra = f" -> {detail}" if detail else ""
+    print(f"[{estado}] {name}{extra}")
+    _RESULTS.append(condition)
+
+
+def new_manager(tmp: str) -> WorkspaceManager:
+    return WorkspaceManager(Path(tmp) / "workspaces", Path(tmp) / "temp_images")
+
+
+def test_isolation(tmp: str) -> None:
+    mgr = new_manager(tmp)
+    a, b = mgr.create(), mgr.create()
+    (a.path / "page_1.png").write_bytes(b"A")
+    (b.path / "page_1.png").write_bytes(b"B")
+    check("CASO 1a directorios distintos", a.path != b.path and a.id != b.id)
+    mgr.disown(a.id)
+    check("CASO 1b liberar A borra solo A",
+          not a.path.exists() and (b.path / "page_1.png").read_bytes() == b"B")
+
+
+def test_refcount(tmp: str) -> None:
+    mgr = new_manager(tmp)
+    ws = mgr.create()
+    check("CASO 2a job toma referencia", mgr.acquire(ws.id) and ws.refs == 2)
+    mgr.disown(ws.id)
+    mgr.disown(ws.id)  # la sesion suelta una sola vez
+    check("CASO 2b la sesion suelta pero el job lo mantiene", ws.path.exists() and ws.refs == 1,
+          f"refs={ws.refs}")
+    mgr.release(ws.id)
+    check("CASO 2c ultima referencia borra el directorio",
+          not ws.path.exists() and mgr.get(ws.id) is None)
+    try:
+        with mgr.hold(ws):
+            pass
+        held = True
+    except FileNotFoundError:
+        held = False
+    check("CASO 2d hold de un workspace liberado falla", not held)
+    check("CASO 2e acquire de un workspace liberado -> False", mgr.acquire(ws.id) is False)
+
+
+def test_sweep(tmp: str) -> None:
+    mgr = new_manager(tmp)
+    mgr.idle_seconds = 60
+    old, fresh = mgr.create(), mgr.create()
+    old.last_used = time.time() - 3600
+    mgr.sweep()
+    check("CASO 3 sweep suelta solo el inactivo", not old.path.exists() and fresh.path.exists())
+
+
+def test_names(tmp: str) -> None:
+    mgr = new_manager(tmp)
+    ws = mgr.create()
+    got_ws, fp = mgr.resolve(ws.name_for(ws.path / "page_3.png"))
+    check("CASO 4a nombre del workspace", got_ws is ws and fp == ws.path / "page_3.png", str(fp))
+    _, fp = mgr.resolve("img_legacy.png")
+    check("CASO 4b nombre suelto -> temp_images", fp == mgr.legacy_dir / "img_legacy.png")
+    check("CASO 4c workspace desconocido", mgr.resolve("deadbeef0000/page_1.png") == (None, None))
+    for name in (f"{ws.id}/../../secreto.txt", "../secreto.txt", f"../{ws.id}/x/../secreto.txt"):
+        _, fp = mgr.resolve(name)
+        inside = fp is None or fp.parent in (ws.path, mgr.legacy_dir)
+        if not inside:
+            break
+    check("CASO 4d sin path traversal", inside, f"{name} -> {fp}")
+
+
+def test_relay_hold(tmp: str) -> None:
+    mgr = new_manager(tmp)
+    original = relay.workspaces
+    relay.workspaces = mgr
+    try:
+        app = FastAPI()
+        app.include_router(relay.router)
+        client = TestClient(app)
+        ws = mgr.create()
+        (ws.path / "page_1_full.png").write_bytes(b"FULL")
+        payload = {"account_id": relay.account_id_for(KEY),
+                   "items": [{"page": 1, "title": "x", "price": "1", "description": "d",
+                              "image_files": [ws.name_for("page_1_full.png")]}]}
+        job_id = client.post("/api/jobs/publish", json=payload).json()["job_id"]
+
+        mgr.disown(ws.id)  # el dashboard sube otro catalogo
+        r = client.get(f"/api/jobs/{job_id}/img/0")
+        check("CASO 5a el agente descarga tras liberar la sesion",
+              r.status_code == 200 and r.content == b"FULL", f"code={r.status_code}")
+
+        # lo que hace agent_ws al recibir job_done (sin abrir el WS: no
+        # necesitamos una licencia real para esto)
+        relay._release_workspaces(relay.JOBS[job_id])
+        relay._release_workspaces(relay.JOBS[job_id])
+        check("CASO 5b job_done libera el workspace (una sola vez)",
+              not ws.path.exists() and mgr.stats()["active"] == 0)
+    finally:
+        relay.workspaces = original
+
+
+def test_restart(tmp: str) -> None:
+    before = new_manager(str(Path(tmp) / "reinicio"))
+    pending, stale = before.create(), before.create()
+    (pending.path / "page_1.png").write_bytes(b"P")
+    after = new_manager(str(Path(tmp) / "reinicio"))      # otro proceso
+    after.purge_orphans(keep={pending.id})
+    check("CASO 6a purge_orphans conserva los de keep",
+          (pending.path / "page_1.png").exists() and not stale.path.exists())
+    ws = after.adopt(pending.id)
+    name_ws, fp = after.resolve(f"{pending.id}/page_1.png")
+    check("CASO 6b adopt vuelve a registrarlo con la referencia de sesion",
+          ws is not None and name_ws is ws and fp.read_bytes() == b"P" and ws.refs == 1
+          and after.adopt(pending.id) is ws and after.adopt(stale.id) is None)
+    after.disown(ws.id)
+    check("CASO 6c al soltarlo se borra", not pending.path.exists())
+
+
+def run() -> int:
+    tmp = tempfile.mkdtemp(prefix="workspaces_test_")
+    print("== Autotest workspaces ==")
+
+    test_isolation(tmp)
+    test_refcount(tmp)
+    test_sweep(tmp)
+    test_names(tmp)
+    test_relay_hold(tmp)
+    test_restart(tmp)
+
+    total = len(_RESULTS)
+    passed = sum(1 for r in _RESULTS if r)
+    print(f"\nResultado: {passed}/{total} casos PASS")
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,205 @@
+"""
+Workspaces por subida / sesion (backend web)
+============================================
+Antes todas las subidas compartian web/backend/temp_images/ y WORK/upload.pdf:
+dos dashboards (o dos pestanas) subiendo a la vez se pisaban las paginas, y
+extractor.cleanup() borraba imagenes que los jobs encolados en el relay aun
+tenian que servir al agente.
+
+Ahora cada subida crea un workspace aislado en workspaces/<id>/ con su propio
+PDFImageExtractor (el cache de render si es compartido). Hacia el frontend, el
+relay y el agente los archivos se nombran "<id>/<archivo>".
+
+Conteo de referencias:
+  - la sesion que lo creo tiene una (se suelta al subir otro catalogo, al
+    pulsar Limpiar o tras `idle_seconds` sin uso)
+  - cada job del relay que usa sus imagenes toma otra hasta el job_done
+  - cada extraccion / analisis / publicacion en curso la toma mientras trabaja
+El directorio se borra cuando la cuenta llega a cero.
+
+Los nombres sin "<id>/" se buscan en temp_images/ (compatibilidad con jobs y
+archivos anteriores).
+"""
+import os
+import time
+import uuid
+import shutil
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+WORK = Path(__file__).resolve().parent
+
+
+class Workspace:
+    """Directorio de trabajo de una subida + su extractor."""
+
+    def __init__(self, ws_id: str, path: Path, extractor=None):
+        self.id = ws_id
+        self.path = path
+        self.extractor = extractor
+        self.refs = 1          # la de la sesion que lo creo
+        self.owned = True
+        self.last_used = time.time()
+        self.uploads: Dict[str, str] = {}   # sha256 -> foto ya guardada (dedupe)
+        # sha256 del PDF subido: identifica el catalogo mas alla del workspace
+        # (la resolucion adaptativa aprende por catalogo)
+        self.source: Optional[str] = None
+
+    def name_for(self, path) -> str:
+        """Nombre publico de un archivo del workspace: '<id>/<archivo>'."""
+        return f"{self.id}/{os.path.basename(str(path))}"
+
+
+class WorkspaceManager:
+    """Registro thread-safe de workspaces con conteo de referencias."""
+
+    def __init__(self, root: Path, legacy_dir: Path, extractor_factory=None, idle_seconds: int = 12 * 3600):
+        self.root = Path(root)
+        self.legacy_dir = Path(legacy_dir)
+        # callable(temp_dir) -> PDFImageExtractor; lo configura main.py
+        self.extractor_factory = extractor_factory
+        self.idle_seconds = idle_seconds
+        self._spaces: Dict[str, Workspace] = {}
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.legacy_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---------- ciclo de vida ----------
+    def create(self) -> Workspace:
+        """Nuevo workspace con una referencia (la de la sesion)."""
+        self.sweep()
+        ws_id = uuid.uuid4().hex[:12]
+        path = self.root / ws_id
+        path.mkdir(parents=True)
+        extractor = self.extractor_factory(str(path)) if self.extractor_factory else None
+        ws = Workspace(ws_id, path, extractor)
+        with self._lock:
+            self._spaces[ws_id] = ws
+        return ws
+
+    def get(self, ws_id: str) -> Optional[Workspace]:
+        with self._lock:
+            ws = self._spaces.get(ws_id)
+            if ws:
+                ws.last_used = time.time()
+            return ws
+
+    def acquire(self, ws_id: str) -> bool:
+        """Toma una referencia. False si el workspace ya no existe."""
+        with self._lock:
+            ws = self._spaces.get(ws_id)
+            if ws is None:
+                return False
+            ws.refs += 1
+            ws.last_used = time.time()
+            return True
+
+    def release(self, ws_id: str) -> None:
+        """Suelta una referencia; al llegar a cero se borra el directorio."""
+        with self._lock:
+            ws = self._spaces.get(ws_id)
+            if ws is None:
+                return
+            ws.refs -= 1
+            if ws.refs > 0:
+                return
+            del self._spaces[ws_id]
+        self._destroy(ws)
+
+    def disown(self, ws_id: str) -> None:
+        """La sesion deja el workspace (nuevo catalogo, Limpiar). Solo una vez."""
+        with self._lock:
+            ws = self._spaces.get(ws_id)
+            if ws is None or not ws.owned:
+                return
+            ws.owned = False
+        self.release(ws_id)
+
+    @contextmanager
+    def hold(self, ws: Optional[Workspace]):
+        """Mantiene vivo el workspace mientras dura el bloque (None = temp_images)."""
+        if ws is None:
+            yield None
+            return
+        if not self.acquire(ws.id):
+            raise FileNotFoundError(f"workspace {ws.id} ya fue liberado")
+        try:
+            yield ws
+        finally:
+            self.release(ws.id)
+
+    def sweep(self) -> None:
+        """Suelta la referencia de sesion de los workspaces inactivos."""
+        limit = time.time() - self.idle_seconds
+        with self._lock:
+            idle = [w.id for w in self._spaces.values() if w.owned and w.last_used < limit]
+        for ws_id in idle:
+            self.disown(ws_id)
+
+    def purge_orphans(self, keep=()) -> None:
+        """Borra directorios que no pertenecen a ningun workspace vivo (restos de
+        una ejecucion anterior: su estado en memoria ya no existe). `keep`:
+        ids que aun se necesitan (corridas de Batch jobs sin enviar)."""
+        with self._lock:
+            alive = set(self._spaces) | set(keep)
+        for entry in self.root.iterdir():
+            if entry.name not in alive:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def adopt(self, ws_id: str) -> Optional[Workspace]:
+        """Vuelve a registrar el directorio de una ejecucion anterior que
+        purge_orphans conservo (None si no existe). Queda con la referencia
+        de sesion: sweep() lo suelta tras `idle_seconds` sin uso."""
+        path = self.root / os.path.basename(ws_id)
+        with self._lock:
+            ws = self._spaces.get(ws_id)
+            if ws is not None or not ws_id or not path.is_dir():
+                return ws
+            extractor = self.extractor_factory(str(path)) if self.extractor_factory else None
+            ws = Workspace(ws_id, path, extractor)
+            self._spaces[ws_id] = ws
+            return ws
+
+    # ---------- nombres ----------
+    @staticmethod
+    def split(name: str) -> Tuple[str, str]:
+        """'<id>/<archivo>' -> (id, archivo); nombre suelto -> ('', archivo)."""
+        ws_id, _, fn = str(name).rpartition("/")
+        return os.path.basename(ws_id), os.path.basename(fn)
+
+    def resolve(self, name: str) -> Tuple[Optional[Workspace], Optional[Path]]:
+        """
+        Ruta en disco de un nombre publico.
+
+        Returns:
+            (workspace, Path); (None, temp_images/archivo) para nombres sueltos;
+            (None, None) si el workspace no existe (o ya se libero).
+        """
+        ws_id, fn = self.split(name)
+        if not fn:
+            return None, None
+        if not ws_id:
+            return None, self.legacy_dir / fn
+        ws = self.get(ws_id)
+        if ws is None:
+            return None, None
+        return ws, ws.path / fn
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": len(self._spaces),
+                "refs": sum(w.refs for w in self._spaces.values()),
+            }
+
+    # ---------- internos ----------
+    def _destroy(self, ws: Workspace) -> None:
+        if ws.extractor is not None:
+            ws.extractor.cleanup()
+        shutil.rmtree(ws.path, ignore_errors=True)
+
+
+# Instancia compartida por main.py (subidas) y relay.py (jobs del agente)
+manager = WorkspaceManager(WORK / "workspaces", WORK / "temp_images")
@@ -10,6 +10,30 @@ async function accountIdFor(key) {
   return Array.from(new Uint8Array(buf)).map(b => b.toString(16).padStart(2, '0')).join('').slice(0, 16)
 }
 
+// Lee una respuesta NDJSON (un evento JSON por linea) a medida que llega.
+async function readNdjson(res, onEvent) {
+  const reader = res.body.getReader()
+  const dec = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += dec.decode(value, { stream: true })
+    let nl
+    while ((nl = buf.indexOf('\n')) >= 0) {
+      const line = buf.slice(0, nl).trim()
+      buf = buf.slice(nl + 1)
+      if (line) onEvent(JSON.parse(line))
+    }
+  }
+  if (buf.trim()) onEvent(JSON.parse(buf))
+}
+
+// Resumen de la codificacion de imagenes que reporta el backend (bytes ahorrados).
+const encodingNote = (enc) => enc && enc.images
+  ? ` (${(enc.bytes_written / 1e6).toFixed(1)} MB, ${(enc.bytes_saved / 1e6).toFixed(1)} MB ahorrados)`
+  : ''
+
 export default function App() {
   const [tab, setTab] = useState('productos')
   const [health, setHealth] = useState({})
@@ -25,11 +49,15 @@ export default function App() {
   const [accountId, setAccountId] = useState('')
   const [agentOnline, setAgentOnline] = useState(false)
   const wsRef = useRef(null)
+  const pdfAbortRef = useRef(null)
+  const workspaceRef = useRef('')                 // workspace del backend con las imagenes de esta sesion
   const logRef = useRef(null)
 
   const refreshStatus = async () => {
     setHealth(await api('/api/health'))
     setSession(await api('/api/session'))
+    // latido: el backend mantiene el workspace (y su analisis anticipado) mientras la pestana siga abierta
+    if (workspaceRef.current) fetch(`/api/workspaces/${workspaceRef.current}/heartbeat`, { method: 'POST' }).catch(() => {})
   }
   useEffect(() => {
     refreshStatus()
@@ -43,17 +71,29 @@ export default function App() {
   const log = (m) => setLogLines(l => [...l, m])
 
   // ---------- PDF ----------
+  // Las paginas llegan en streaming (NDJSON): cada una aparece en el grid
+  // apenas el backend la escribe, sin esperar al catalogo completo.
   const uploadPdf = async (e) => {
     const file = e.target.files[0]
     if (!file) return
-    setBusy(true); log(`Subiendo ${file.name}...`)
-    const fd = new FormData(); fd.append('file', file)
+    if (pdfAbortRef.current) pdfAbortRef.current.abort()
+    const ctrl = new AbortController(); pdfAbortRef.current = ctrl
+    setBusy(true); setItems([]); log(`Subiendo ${file.name}...`)
+    // el workspace anterior se libera: el catalogo nuevo reemplaza al grid
+    const fd = new FormData(); fd.append('file', file); fd.append('workspace', workspaceRef.current)
     try {
-      const res = await fetch('/api/upload-pdf', { method: 'POST', body: fd }).then(r => r.json())
-      setItems((res.items || []).map(it => ({ ...it, info: null, selected: false })))
-      log(`Extraidas ${res.count} paginas`)
-    } catch (err) { log('Error subiendo PDF: ' + err) }
-    setBusy(false)
+      const res = await fetch('/api/upload-pdf-stream', { method: 'POST', body: fd, signal: ctrl.signal })
+      if (!res.ok) { const err = await res.json(); log('Error: ' + (err.detail || res.status)) }
+      else await readNdjson(res, (d) => {
+        if (d.type === 'start') { workspaceRef.current = d.workspace; log(`Extrayendo ${d.total} paginas...`) }
+        else if (d.type === 'page') {
+          setItems(arr => [...arr, { page: d.page, filename: d.filename, url: d.url, info: null, selected: false }])
+        }
+        else if (d.type === 'error') log('[!] ' + d.message)
+        else if (d.type === 'done') log(`Extraidas ${d.count} paginas` + encodingNote(d.encoding))
+      })
+    } catch (err) { if (err.name !== 'AbortError') log('Error subiendo PDF: ' + err) }
+    if (pdfAbortRef.current === ctrl) { pdfAbortRef.current = null; setBusy(false) }
   }
 
   // ---------- Imagenes (subir / pegar / arrastrar) ----------
@@ -63,16 +103,19 @@ export default function App() {
     setBusy(true); log(`Subiendo ${files.length} foto(s)...`)
     const fd = new FormData()
     files.forEach(f => fd.append('files', f))
+    fd.append('workspace', workspaceRef.current)
     try {
       const res = await fetch('/api/upload-images', { method: 'POST', body: fd }).then(r => r.json())
       if (res.detail) { log('Error: ' + res.detail) }
       else {
+        workspaceRef.current = res.workspace
         setItems(arr => {
           const base = arr.length
           const add = (res.items || []).map((it, i) => ({ ...it, page: base + i + 1, info: null, selected: false }))
           return [...arr, ...add]
         })
-        log(`Agregadas ${res.count} foto(s)`)
+        log(`Agregadas ${res.count} foto(s)` + encodingNote(res.encoding)
+          + (res.duplicates ? ` · ${res.duplicates} repetida(s) omitida(s)` : ''))
       }
     } catch (e) { log('Error subiendo fotos: ' + e) }
     setBusy(false)
@@ -108,19 +151,50 @@ export default function App() {
         body: JSON.stringify({ filename: it.filename, force }),
       })
       if (info.detail) { log('IA: ' + info.detail); }
+      if (info.fallback) log(`[!] IA no disponible (${info.error}); texto generico sin guardar, editalo o reintenta`)
       setItems(arr => arr.map((x, i) => i === idx ? { ...x, analyzing: false, selected: true, info: {
         title: info.title || '', price: info.price || '', description: info.description || '', tags: info.tags || [],
       } } : x))
     } catch (e) { log('Error IA: ' + e); setItems(arr => arr.map((x, i) => i === idx ? { ...x, analyzing: false } : x)) }
   }
 
+  // Todas las pendientes en un solo lote: el backend las analiza en paralelo
+  // y cada resultado llega (NDJSON) apenas termina
   const analyzeAll = async () => {
-    for (let i = 0; i < items.length; i++) { if (!items[i].info) await analyze(i) }
+    const names = items.filter(x => !x.info).map(x => x.filename)
+    if (!names.length) return
+    setBusy(true); log(`Analizando ${names.length} imagen(es) con IA...`)
+    setItems(arr => arr.map(x => names.includes(x.filename) ? { ...x, analyzing: true } : x))
+    try {
+      const res = await fetch('/api/analyze-batch', {
+        method: 'POST', headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filenames: names }),
+      })
+      if (!res.ok) { const err = await res.json(); log('IA: ' + (err.detail || res.status)) }
+      else await readNdjson(res, (d) => {
+        if (d.type === 'result') setItems(arr => arr.map(x => x.filename === d.filename ? { ...x, analyzing: false, selected: true, info: {
+          title: d.title || '', price: d.price || '', description: d.description || '', tags: d.tags || [],
+        } } : x))
+        else if (d.type === 'error') {
+          log(`[!] ${d.filename}: ${d.message}`)
+          setItems(arr => arr.map(x => x.filename === d.filename ? { ...x, analyzing: false } : x))
+        }
+        else if (d.type === 'done') log(`IA: ${d.ok} analizadas, ${d.failed} con error`
+          + (d.usage && d.usage.images ? ` · ~${Math.round(d.usage.tokens_per_image)} tokens/imagen` : ''))
+      })
+    } catch (e) { log('Error IA: ' + e) }
+    setItems(arr => arr.map(x => x.analyzing ? { ...x, analyzing: false } : x))
+    setBusy(false)
   }
 
   const editInfo = (idx, field, value) =>
     setItems(arr => arr.map((x, i) => i === idx ? { ...x, info: { ...x.info, [field]: value } } : x))
 
+  const clearItems = () => {
+    if (workspaceRef.current) fetch(`/api/workspaces/${workspaceRef.current}`, { method: 'DELETE' }).catch(() => {})
+    workspaceRef.current = ''
+    setItems([])
+  }
   const toggle = (idx) => setItems(arr => arr.map((x, i) => i === idx ? { ...x, selected: !x.selected } : x))
 
   // ---------- Demo ----------
@@ -199,11 +273,18 @@ export default function App() {
     setBusy(true); setProgress({ done: 0, total: sel.length, ok: 0, fail: 0 })
     let ok = 0, fail = 0
     try {
+      // El grid muestra vistas previas: el agente debe recibir la alta resolucion
+      const full = await api('/api/full-res', {
+        method: 'POST', headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filenames: sel.map(s => s.filename) }),
+      })
+      if (full.detail) { log('[!] ' + full.detail); setBusy(false); return }
       const payload = {
         account_id: accountId,
         items: sel.map(s => ({
           page: s.page, title: s.info?.title || '', price: s.info?.price || '',
-          description: s.info?.description || '', tags: s.info?.tags || [], image_files: [s.filename],
+          description: s.info?.description || '', tags: s.info?.tags || [],
+          image_files: [full.files[s.filename] || s.filename],
         })),
         settings: { category: cfg.default_category, condition: cfg.default_condition },
       }
@@ -226,7 +307,7 @@ export default function App() {
           log(`  ${d.status === 'success' ? '[OK]' : '[x]'} ${d.title || ''}` + (d.error ? ` (${d.error})` : ''))
           setProgress({ done: ok + fail, total: sel.length, ok, fail })
         }
-        else if (d.type === 'job_done') { log(`\nListo: ${d.ok} ok, ${d.fail} fallos`); setBusy(false); try { ws.close() } catch {} loadHistory() }
+        else if (d.type === 'job_done') { log(`\nListo: ${d.ok} ok, ${d.fail} fallos` + (d.error ? ` (${d.error})` : '')); setBusy(false); try { ws.close() } catch {} loadHistory() }
         else if (d.type === 'error') { log('[!] ' + d.message); setBusy(false) }
       }
       ws.onerror = () => { log('Error de conexion WS del job'); setBusy(false) }
@@ -272,7 +353,7 @@ export default function App() {
               {health.demo && <button className="btn ghost" onClick={demoLoad}><IcSparkle /> Cargar ejemplo</button>}
               <button className="btn ghost" disabled={!items.length || busy} onClick={analyzeAll}><IcCpu /> Analizar todo (IA)</button>
               <button className="btn ghost" disabled={!items.length} onClick={() => setItems(a => a.map(x => ({ ...x, selected: true })))}>Seleccionar todo</button>
-              {items.length > 0 && <button className="btn ghost" onClick={() => setItems([])}>Limpiar</button>}
+              {items.length > 0 && <button className="btn ghost" onClick={clearItems}>Limpiar</button>}
               <span className="muted">{items.length} elementos · {selCount} seleccionados</span>
             </div>
 